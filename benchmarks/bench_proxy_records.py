@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# API服务内存代理记录的内存/构建耗时对比
+# 前两行只比较代理记录本身(旧的嵌套字典+状态对象 vs ProxyRecord), 不含任何索引;
+# 之后几行是新结构加上API实际维护的索引, 才是 /proxy/memory 里每个代理的实际占用
+# 用法: python benchmarks/bench_proxy_records.py [代理数量, 默认100000]
+
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+from pydantic import BaseModel
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from schedulers.proxy_index import IdleProxyIndex
+from schedulers.proxy_record import ProxyRecord, intern_status, intern_types, make_flags
+from utils.hash_ring import HashRing
+from utils.score_buckets import ScoreBuckets
+
+
+# 旧的状态模型(每个代理一个 pydantic 实例)
+class LegacyProxyStatus(BaseModel):
+    proxy: str
+    status: str
+    task_id: Optional[str] = None
+    acquire_time: Optional[float] = None
+    heartbeat_time: Optional[float] = None
+
+
+def make_rows(count: int):
+    """生成和 proxies 表列一致的模拟数据"""
+    rng = random.Random(42)
+    types_choices = ['["http"]', '["https"]', '["http", "https"]', '["socks4"]', '["socks5"]']
+    rows = []
+    for i in range(count):
+        rows.append((
+            f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}:{rng.randint(1024, 65535)}",
+            rng.randint(0, 100), rng.choice(types_choices), rng.randint(0, 1), rng.randint(0, 1),
+            rng.randint(0, 1), f"1.2.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+            "city", "region", "CN", "0,0", "AS0000 org", "000000", "Asia/Shanghai",
+            rng.randint(0, 1), "2026-01-01", round(rng.random() * 3, 3),
+            "pass", "pass", "pass", "2026-01-01",
+            round(rng.random() * 5, 3), round(rng.random(), 2), "2026-01-01"
+        ))
+    return rows
+
+
+def build_legacy(rows):
+    """旧结构: 每个代理一个嵌套字典 + 一个 pydantic 状态对象"""
+    proxies, status = {}, {}
+    for (proxy, score, types_json, support_china, support_international, transparent, detected_ip,
+         city, region, country, loc, org, postal, timezone, browser_valid, browser_check_date,
+         browser_response_time, dns_hijacking, ssl_valid, malicious_content, security_check_date,
+         avg_response_time, success_rate, last_checked) in rows:
+        proxies[proxy] = {
+            "score": score,
+            "info": {
+                "types": json.loads(types_json),
+                "support": {"china": bool(support_china), "international": bool(support_international)},
+                "transparent": bool(transparent),
+                "detected_ip": detected_ip,
+                "location": {"city": city, "region": region, "country": country, "loc": loc,
+                             "org": org, "postal": postal, "timezone": timezone},
+                "browser": {"valid": bool(browser_valid), "check_date": browser_check_date,
+                            "response_time": browser_response_time},
+                "security": {"dns_hijacking": dns_hijacking, "ssl_valid": ssl_valid,
+                             "malicious_content": malicious_content, "check_date": security_check_date},
+                "performance": {"avg_response_time": avg_response_time, "success_rate": success_rate,
+                                "last_checked": last_checked}
+            }
+        }
+        status[proxy] = LegacyProxyStatus(proxy=proxy, status="idle")
+    return proxies, status
+
+
+def build_compact(rows):
+    """新结构: 每个代理一个 __slots__ 记录, 冷数据不常驻内存"""
+    proxies = {}
+    for (proxy, score, types_json, support_china, support_international, transparent, _detected_ip,
+         _city, _region, _country, _loc, _org, _postal, _timezone, browser_valid, _browser_check_date,
+         _browser_response_time, _dns_hijacking, _ssl_valid, _malicious_content, _security_check_date,
+         avg_response_time, success_rate, last_checked) in rows:
+        proxies[proxy] = ProxyRecord(
+            proxy, score, intern_types(types_json),
+            make_flags(support_china, support_international, transparent, browser_valid),
+            intern_status(None), None, None, None,
+            avg_response_time, success_rate, sys.intern(last_checked)
+        )
+    return proxies
+
+
+def build_indexed(rows):
+    """新结构 + 常驻索引: 全部代理的分数桶, 按(类型, 地区)分桶的空闲索引(全部空闲)"""
+    proxies = build_compact(rows)
+    score_index = ScoreBuckets(100)
+    score_index.add_many((proxy, record.score) for proxy, record in proxies.items())
+    idle_index = IdleProxyIndex(100, latency_of=lambda proxy: proxies[proxy].avg_response_time)
+    idle_index.add_many((proxy, record.score, record.types, record.support) for proxy, record in proxies.items())
+    return proxies, score_index, idle_index
+
+
+def build_on_demand(rows):
+    """新结构 + 常驻索引 + 按需建立的索引(fastest 的响应时间桶, 粘性获取的哈希环)"""
+    proxies, score_index, idle_index = build_indexed(rows)
+    idle_index.install_latency(idle_index.build_latency(idle_index.latency_snapshot()))
+    ring = HashRing()
+    ring.add_many(proxies)
+    return proxies, score_index, idle_index, ring
+
+
+def measure(name: str, builder, rows):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = builder(rows)
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    gc.collect()
+
+    count = len(rows)
+    print(f"{name:<12} 总内存 {used / 1024 / 1024:8.1f} MB  每个代理 {used / count:7.1f} B  "
+          f"构建耗时 {elapsed:.3f} 秒")
+    return used
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"[info] 生成 {count} 条模拟代理数据...")
+    # 两种结构都要引用代理字符串, 先生成好行数据, 只统计结构本身的内存
+    rows = make_rows(count)
+
+    legacy = measure("旧结构", build_legacy, rows)
+    compact = measure("新结构", build_compact, rows)
+    print(f"[info] 代理记录本身(不含索引)内存减少 {(1 - compact / legacy) * 100:.1f}%")
+
+    indexed = measure("新结构+索引", build_indexed, rows)
+    on_demand = measure("再加按需索引", build_on_demand, rows)
+    print(f"[info] 常驻索引每个代理 {(indexed - compact) / count:.1f} B, "
+          f"按需索引(响应时间桶、哈希环)每个代理 {(on_demand - indexed) / count:.1f} B")
+
+
+if __name__ == "__main__":
+    main()
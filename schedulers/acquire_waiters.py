@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# 等待获取代理的请求队列
+
+import asyncio
+import itertools
+import logging
+from typing import Any, Callable, Container, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AcquireWaiter:
+    """一个等待中的获取请求"""
+
+    __slots__ = ("seq", "key", "min_score", "exclude", "task_id", "loop", "future", "fields", "domain")
+
+    def __init__(self, seq: int, key: Tuple[str, str], min_score: int, exclude: Optional[Container[str]],
+                 task_id: str, loop: asyncio.AbstractEventLoop, fields: Optional[Tuple[str, ...]] = None,
+                 domain: Optional[str] = None):
+        self.seq = seq
+        self.key = key
+        self.min_score = min_score
+        self.exclude = exclude
+        self.task_id = task_id
+        self.loop = loop
+        self.fields = fields  # 分配时返回的字段, None 为完整结果
+        self.domain = domain  # 目标域名(已规范化), 分配时需要该代理对这个域名还有令牌
+        self.future = loop.create_future()
+
+    def accepts(self, proxy: str, score: int, ready: Optional[Callable[[str, str], bool]] = None) -> bool:
+        if score < self.min_score or (self.exclude and proxy in self.exclude):
+            return False
+        return self.domain is None or ready is None or ready(proxy, self.domain)
+
+    def deliver(self, result: Dict[str, Any], on_orphan: Callable[[Dict[str, Any]], Any]):
+        """
+        把已经分配好的代理交给等待者(可在任意线程调用)
+        等待者已超时或断开时调用 on_orphan 把代理还回去
+        """
+        try:
+            self.loop.call_soon_threadsafe(self._resolve, result, on_orphan)
+        except RuntimeError:
+            # 事件循环已关闭, 代理等租约到期回收
+            logger.warning(f"等待者所在的事件循环已关闭, 代理 {result['proxy']} 等待租约到期回收")
+
+    def _resolve(self, result: Dict[str, Any], on_orphan: Callable[[Dict[str, Any]], Any]):
+        if self.future.done():
+            on_orphan(result)
+        else:
+            self.future.set_result(result)
+
+
+class AcquireWaiters:
+    """
+    按 (类型, 地区) 分队列的等待者, 队列内先到先得
+    有代理变为空闲时, 在它所属的各个桶的队列里找最早的、条件匹配的等待者, 直接把代理分给它,
+    不会唤醒全部等待者去抢(调用方需持有代理池的锁)
+    """
+
+    def __init__(self, max_waiters: int = 1000):
+        self.max_waiters = max_waiters
+        self._queues: Dict[Tuple[str, str], Dict[int, AcquireWaiter]] = {}  # dict 保持加入顺序
+        self._seq = itertools.count()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, waiter: AcquireWaiter) -> bool:
+        """还在队列中(没有被分配代理、没有超时)"""
+        queue = self._queues.get(waiter.key)
+        return queue is not None and waiter.seq in queue
+
+    def add(self, key: Tuple[str, str], min_score: int, exclude: Optional[Container[str]],
+            task_id: str, loop: asyncio.AbstractEventLoop,
+            fields: Optional[Tuple[str, ...]] = None, domain: Optional[str] = None) -> Optional[AcquireWaiter]:
+        """加入等待队列, 队列已满时返回 None"""
+        if self._count >= self.max_waiters:
+            return None
+        waiter = AcquireWaiter(next(self._seq), key, min_score, exclude, task_id, loop, fields, domain)
+        self._queues.setdefault(key, {})[waiter.seq] = waiter
+        self._count += 1
+        return waiter
+
+    def remove(self, waiter: AcquireWaiter) -> bool:
+        """移出等待队列(超时或取消), 已经被分配过代理时返回 False"""
+        queue = self._queues.get(waiter.key)
+        if queue is None or queue.pop(waiter.seq, None) is None:
+            return False
+        self._count -= 1
+        if not queue:
+            del self._queues[waiter.key]
+        return True
+
+    def match(self, proxy: str, score: int, keys: Iterable[Tuple[str, str]],
+              ready: Optional[Callable[[str, str], bool]] = None) -> Optional[AcquireWaiter]:
+        """
+        找出并移除能接收该代理的最早的等待者
+        ready(proxy, domain): 代理现在能否用于该域名(限速), 只对指定了目标域名的等待者检查
+        """
+        best = None
+        for key in keys:
+            queue = self._queues.get(key)
+            if not queue:
+                continue
+            for waiter in queue.values():
+                if waiter.accepts(proxy, score, ready):
+                    if best is None or waiter.seq < best.seq:
+                        best = waiter
+                    break
+        if best is not None:
+            self.remove(best)
+        return best
+
+    def waiting(self) -> List[AcquireWaiter]:
+        """全部等待者, 按加入顺序"""
+        return sorted((w for queue in self._queues.values() for w in queue.values()), key=lambda w: w.seq)
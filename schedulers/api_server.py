@@ -1,21 +1,47 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import gc
 import json
+import math
 import asyncio
 import threading
 import time
 import random
 from datetime import datetime
-from typing import Dict, List, Optional, Any
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import HTMLResponse
+from typing import Callable, Dict, List, Literal, Optional, Any, Set, Tuple
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import uvicorn
 import sqlite3
 from contextlib import asynccontextmanager,contextmanager
 import logging
 import os
+import sys
+import tracemalloc
+
+try:
+    import orjson
+except ImportError:  # 可选依赖, 没有时退回标准库 json
+    orjson = None
+
+from schedulers.proxy_index import IdleProxyIndex
+from schedulers.proxy_gateway import ProxyGateway
+from schedulers.write_behind import WriteBehindWriter
+from schedulers.change_feed import ChangeFeed
+from schedulers.acquire_waiters import AcquireWaiters
+from schedulers.domain_limiter import DomainGate, DomainRateLimiter
+from schedulers.pool_events import PoolEventBus
+from schedulers.pool_lock import InstrumentedRLock
+from schedulers.pool_metrics import PoolMetrics
+from schedulers.expiry_heap import ExpiryHeap
+from schedulers.pool_stats import PoolCounters, deep_getsizeof, tracemalloc_summary
+from schedulers.proxy_record import (ProxyRecord, BUSY, DEAD, IDLE, QUARANTINE, COLD_COLUMNS, cold_info_from_row,
+                                     intern_status, intern_types, make_flags)
+from utils.hash_ring import HashRing
+from utils.score_buckets import ScoreBuckets
 
 # 配置日志
 logging.basicConfig(
@@ -28,15 +54,40 @@ logger = logging.getLogger(__name__)
 # === 数据结构定义 ===
 
 class DatabaseManager:
-    """数据库管理器"""
+    """
+    数据库管理器
+    长连接池: 一个写连接(由写锁串行化) + 每个线程一个读连接,
+    连接打开时设置 WAL 等参数, 让CLI验证器写库时API仍能正常读
+    """
 
-    def __init__(self, db_path="./data/proxies.db"):
+    def __init__(self, db_path="./data/proxies.db", busy_timeout_ms: int = 5000,
+                 cache_size_kb: int = 20000, mmap_size_mb: int = 256):
         self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+
+        self._local = threading.local()  # 每线程读连接
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.RLock()
         self._init_db()
 
+    def _open(self) -> sqlite3.Connection:
+        """打开连接并设置参数"""
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # 返回字典格式
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")  # 负数表示KB
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size_mb) * 1024 * 1024}")
+        return conn
+
     def _init_db(self):
         """初始化数据库（如果不存在）"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_writer_conn()
         cursor = conn.cursor()
 
         # 确保代理状态表存在
@@ -51,25 +102,49 @@ class DatabaseManager:
         ''')
 
         conn.commit()
-        conn.close()
+
+    def _get_writer_conn(self) -> sqlite3.Connection:
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._open()
+            return self._writer
 
     @contextmanager
     def get_connection(self):
-        """获取数据库连接（上下文管理器）"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # 返回字典格式
-        try:
-            yield conn
-        finally:
-            conn.close()
+        """获取当前线程的只读连接（上下文管理器）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        yield conn
 
-# 代理状态
-class ProxyStatus(BaseModel):
-    proxy: str
-    status: str  # idle, busy, dead
-    task_id: Optional[str] = None
-    acquire_time: Optional[float] = None
-    heartbeat_time: Optional[float] = None
+    @contextmanager
+    def get_writer(self):
+        """获取写连接（上下文管理器）, 持有写锁, 出错时回滚未提交的修改"""
+        with self._writer_lock:
+            conn = self._get_writer_conn()
+            try:
+                yield conn
+            except Exception:
+                conn.rollback()
+                raise
+
+    def close(self):
+        """关闭所有连接"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._readers:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._readers.clear()
+        self._local = threading.local()
 
 # 代理信息
 class ProxyInfo(BaseModel):
@@ -84,6 +159,30 @@ class AcquireRequest(BaseModel):
     min_score: int = 0
     exclude_proxies: Optional[List[str]] = None
     task_id: Optional[str] = None
+    wait_timeout: Optional[float] = Field(None, ge=0, le=300)  # 没有可用代理时最多排队等待的秒数
+    # 选择策略, 见 IdleProxyIndex
+    strategy: Literal["best", "weighted_random", "p2c", "least_recently_used", "fastest"] = "best"
+    # 只返回 proxy、task_id 和这里列出的字段(见 LEASE_FIELDS, 都从内存读取),
+    # 不传时返回完整的 proxy_info(位置、安全检测等冷数据从数据库补上)
+    fields: Optional[List[Literal["proxy_url", "score", "types", "support", "transparent",
+                                  "browser", "performance", "proxy_info"]]] = None
+    compact: bool = False  # 等同于 fields=["proxy_url"]
+    # 粘性会话: 同一个键总是拿到同一个代理(一致性哈希), 该代理死亡或占满时顺延到环上的下一个;
+    # 排队等待时不保证粘性
+    affinity_key: Optional[str] = None
+    # 目标站点域名: 每个代理对同一域名按令牌桶限速(见 DomainRateLimiter), 令牌用完的代理会被跳过
+    target_domain: Optional[str] = Field(None, max_length=DomainRateLimiter.MAX_DOMAIN_LENGTH)
+
+    def lease_fields(self) -> Optional[tuple]:
+        """返回结果需要的字段, None 表示完整结果"""
+        if self.compact:
+            return ("proxy_url", *(f for f in self.fields or () if f != "proxy_url"))
+        return tuple(self.fields) if self.fields is not None else None
+
+# 批量获取请求
+class AcquireBatchRequest(AcquireRequest):
+    count: int = Field(1, ge=1, le=1000)
+    task_ids: Optional[List[str]] = None  # 每个租约的任务ID, 不足的自动生成
 
 # 释放请求
 class ReleaseRequest(BaseModel):
@@ -96,381 +195,959 @@ class ReleaseRequest(BaseModel):
 class HealthCheckRequest(BaseModel):
     proxy: str
     task_id: str
-# ===      ===
 
-class ProxyPoolManager:
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        self.db_manager = DatabaseManager(db_path)
-
-        self.proxies: Dict[str, Dict] = {}  # 代理信息缓存
-        self.status: Dict[str, ProxyStatus] = {}  # 代理状态缓存
-        self.lock = threading.RLock()
-
-        # 索引结构
-        self.type_index: Dict[str, List[str]] = {}
-        self.region_index: Dict[str, List[str]] = {}
-        self.score_index: List[tuple] = []  # (score, proxy)
-
-        # 统计数据
-        self.stats = {
-            "total": 0,
-            "idle": 0,
-            "busy": 0,
-            "dead": 0,
-            "last_updated": None
-        }
-
-        # 启动时加载数据
-        self.load_proxies()
+# 批量心跳请求
+class HeartbeatBatchRequest(BaseModel):
+    items: List[HealthCheckRequest] = Field(..., min_length=1, max_length=1000)
 
-    def load_proxies(self):
-        """从数据库加载代理数据"""
-        with self.lock:
-            try:
-                with self.db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
+# 批量释放的一项
+class ReleaseBatchItem(ReleaseRequest):
+    success: Optional[bool] = True  # None 表示租约没有用过, 归还时不调整分数
 
-                    # 加载代理信息
-                    cursor.execute('''
-                    SELECT 
-                        proxy, score, types, support_china, support_international,
-                        transparent, detected_ip, city, region, country, loc, org,
-                        postal, timezone, browser_valid, browser_check_date,
-                        browser_response_time, dns_hijacking, ssl_valid,
-                        malicious_content, security_check_date, avg_response_time,
-                        success_rate, last_checked
-                    FROM proxies
-                    ''')
+# 批量释放请求
+class ReleaseBatchRequest(BaseModel):
+    items: List[ReleaseBatchItem] = Field(..., min_length=1, max_length=1000)
+# ===      ===
 
-                    for row in cursor.fetchall():
-                        proxy = row["proxy"]
-                        score = row["score"]
-
-                        # 构建info字典
-                        info = {
-                            "types": json.loads(row["types"]) if row["types"] else [],
-                            "support": {
-                                "china": bool(row["support_china"]),
-                                "international": bool(row["support_international"])
-                            },
-                            "transparent": bool(row["transparent"]),
-                            "detected_ip": row["detected_ip"],
-                            "location": {
-                                "city": row["city"],
-                                "region": row["region"],
-                                "country": row["country"],
-                                "loc": row["loc"],
-                                "org": row["org"],
-                                "postal": row["postal"],
-                                "timezone": row["timezone"]
-                            },
-                            "browser": {
-                                "valid": bool(row["browser_valid"]),
-                                "check_date": row["browser_check_date"],
-                                "response_time": row["browser_response_time"]
-                            },
-                            "security": {
-                                "dns_hijacking": row["dns_hijacking"],
-                                "ssl_valid": row["ssl_valid"],
-                                "malicious_content": row["malicious_content"],
-                                "check_date": row["security_check_date"]
-                            },
-                            "performance": {
-                                "avg_response_time": row["avg_response_time"],
-                                "success_rate": row["success_rate"],
-                                "last_checked": row["last_checked"]
-                            }
-                        }
-
-                        # 存储代理信息
-                        self.proxies[proxy] = {
-                            "score": score,
-                            "info": info
-                        }
-
-                        # 初始化状态（从数据库或默认）
-                        cursor.execute(
-                            "SELECT status, task_id, acquire_time, heartbeat_time FROM proxy_status WHERE proxy = ?",
-                            (proxy,)
-                        )
-                        status_row = cursor.fetchone()
-
-                        if status_row:
-                            self.status[proxy] = ProxyStatus(
-                                proxy=proxy,
-                                status=status_row["status"],
-                                task_id=status_row["task_id"],
-                                acquire_time=status_row["acquire_time"],
-                                heartbeat_time=status_row["heartbeat_time"]
-                            )
-                        else:
-                            self.status[proxy] = ProxyStatus(
-                                proxy=proxy,
-                                status="idle"
-                            )
-
-                        # 构建索引
-                        proxy_types = info.get("types", [])
-                        for ptype in proxy_types:
-                            if ptype not in self.type_index:
-                                self.type_index[ptype] = []
-                            self.type_index[ptype].append(proxy)
-
-                        # 构建地区索引
-                        support = info.get("support", {})
-                        if support.get("china"):
-                            if "china" not in self.region_index:
-                                self.region_index["china"] = []
-                            self.region_index["china"].append(proxy)
-                        if support.get("international"):
-                            if "international" not in self.region_index:
-                                self.region_index["international"] = []
-                            self.region_index["international"].append(proxy)
-
-                        # 构建分数索引
-                        self.score_index.append((score, proxy))
-
-                    # 按分数排序
-                    self.score_index.sort(reverse=True)
-
-                    # 更新统计
-                    self.stats["total"] = len(self.proxies)
-                    self.stats["idle"] = sum(1 for s in self.status.values() if s.status == "idle")
-                    self.stats["busy"] = sum(1 for s in self.status.values() if s.status == "busy")
-                    self.stats["dead"] = sum(1 for s in self.status.values() if s.status == "dead")
-                    self.stats["last_updated"] = datetime.now().isoformat()
-
-                    logger.info(f"成功加载 {len(self.proxies)} 个代理")
+# 获取结果中可选的字段: 字段名 -> (代理记录, 请求的类型) -> 值
+LEASE_FIELDS: Dict[str, Callable[[ProxyRecord, str], Any]] = {
+    "proxy_url": lambda record, proxy_type: record.url(proxy_type),
+    "score": lambda record, proxy_type: record.score,
+    "types": lambda record, proxy_type: list(record.types),
+    "support": lambda record, proxy_type: record.support,
+    "transparent": lambda record, proxy_type: record.transparent,
+    "browser": lambda record, proxy_type: {"valid": record.browser_valid},
+    "performance": lambda record, proxy_type: record.performance(),
+    "proxy_info": lambda record, proxy_type: {"score": record.score, "info": record.hot_info()},
+}
 
-            except Exception as e:
-                logger.error(f"加载代理数据失败: {e}")
 
-    async def save_proxy_update(self, proxy: str, score_delta: int = 0,response_time: Optional[float] = None):
-        """异步保存代理更新到数据库"""
-        with self.lock:
-            try:
-                with self.db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
+class FastJSONResponse(JSONResponse):
+    """获取代理接口的响应, 装了 orjson 时用它序列化, 否则用标准库"""
 
-                    # 获取当前代理信息
-                    cursor.execute(
-                        "SELECT score, types, support_china, support_international, "
-                        "transparent, detected_ip, city, region, country, loc, org, "
-                        "postal, timezone, browser_valid, browser_check_date, "
-                        "browser_response_time, dns_hijacking, ssl_valid, "
-                        "malicious_content, security_check_date, avg_response_time, "
-                        "success_rate, last_checked FROM proxies WHERE proxy = ?",
-                        (proxy,)
-                    )
-                    row = cursor.fetchone()
-
-                    if not row:
-                        logger.warning(f"代理 {proxy} 不存在于数据库中")
-                        return
-
-                    # 更新分数
-                    current_score = row["score"]
-                    new_score = max(0, min(100, current_score + score_delta))
-
-                    # 更新成功率
-                    current_success = row["success_rate"]
-                    if score_delta > 0:
-                        new_success = min(1.0, round(current_success + 0.1, 2))
-                    else:
-                        new_success = max(0.0, round(current_success - 0.1, 2))
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return super().render(content)
 
-                    logger.info(f"代理 {proxy} 成功率 {current_success:.2f} -> {new_success:.2f}")
 
-                    # 更新平均响应时间（如果有response_time）
-                    current_avg = row["avg_response_time"]
-                    if response_time is not None:
-                        new_avg = (current_avg * 0.7 + response_time * 0.3)
-                    else:
-                        new_avg = current_avg
-
-                    # 更新数据库
-                    cursor.execute('''
-                    UPDATE proxies SET
-                        score = ?,
-                        avg_response_time = ?,
-                        success_rate = ?,
-                        last_checked = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE proxy = ?
-                    ''', (
-                        new_score,
-                        round(new_avg, 3),
-                        new_success,
-                        datetime.now().strftime("%Y-%m-%d"),
-                        proxy
-                    ))
+class PoolState:
+    """代理池的内存数据(代理记录、索引、计数器), 重新加载时在锁外整体构建好再替换"""
 
-                    conn.commit()
+    __slots__ = ("proxies", "score_index", "idle_index", "lease_expiry", "quarantine", "counters")
 
-                    # 更新内存缓存
-                    if proxy in self.proxies:
-                        self.proxies[proxy]["score"] = new_score
-                        self.proxies[proxy]["info"]["performance"]["avg_response_time"] = round(new_avg, 3)
-                        self.proxies[proxy]["info"]["performance"]["success_rate"] = new_success
-                        self.proxies[proxy]["info"]["performance"]["last_checked"] = datetime.now().strftime("%Y-%m-%d")
+    def __init__(self, max_score: int = 100):
+        # 代理热数据和占用状态, 冷数据(位置、安全检测等)查询详情时才从数据库读取
+        self.proxies: Dict[str, ProxyRecord] = {}
+        self.score_index = ScoreBuckets(max_score)  # 全部代理的分数桶
+        # 空闲代理索引, 按(类型, 地区)分桶
+        self.idle_index = IdleProxyIndex(max_score, latency_of=self.latency_of)
+        self.lease_expiry = ExpiryHeap()  # 占用中代理的到期时间, 心跳时刷新
+        self.quarantine = ExpiryHeap()  # 隔离中代理的恢复时间
+        # 统计数据, 每次状态/分数变化时增量更新
+        self.counters = PoolCounters(max_score)
 
-                    # 更新分数索引
-                    self.score_index = [(score, p) for score, p in self.score_index if p != proxy]
-                    self.score_index.append((new_score, proxy))
-                    self.score_index.sort(reverse=True)
+    def latency_of(self, proxy: str) -> Optional[float]:
+        """代理的平均响应时间, 已经移除的代理返回 None(建立响应时间桶时在锁外调用)"""
+        record = self.proxies.get(proxy)
+        return record.avg_response_time if record is not None else None
 
-            except Exception as e:
-                logger.error(f"保存代理 {proxy} 更新失败: {e}")
 
-    def acquire_proxy(self, request: AcquireRequest) -> Optional[Dict[str, Any]]:
-        """获取一个代理"""
-        with self.lock:
-            # 生成任务ID
-            if not request.task_id:
-                request.task_id = f"task_{int(time.time())}_{random.randint(1000, 9999)}"
+class ProxyPoolManager:
+    LOAD_BATCH_SIZE = 2000  # 启动加载时每批读取的行数
+    DEFAULT_RESPONSE_TIME = 5.0  # 没有测过响应时间的代理按这个值估算(秒)
+    LEASE_CAPACITY_MODES = ("fixed", "performance")
+    FAST_RESPONSE_TIME = 1.0  # performance 模式下响应时间不超过这个值(秒)的代理才能用满并发上限
+    AFFINITY_MAX_PROBES = 64  # 粘性获取时沿哈希环最多检查的代理数, 都不可用时按策略选择
 
-            # 筛选符合条件的代理
-            candidates = []
+    def __init__(self, db_path: str, api_config: Optional[Dict[str, Any]] = None):
+        self.db_path = db_path
+        api_config = api_config or {}
+        self.db_manager = DatabaseManager(
+            db_path,
+            busy_timeout_ms=api_config.get("db_busy_timeout_ms", 5000),
+            cache_size_kb=api_config.get("db_cache_size_kb", 20000),
+            mmap_size_mb=api_config.get("db_mmap_size_mb", 256)
+        )
 
-            for proxy in self.proxies:
-                status = self.status.get(proxy)
-                if not status or status.status != "idle":
-                    continue
+        self.max_score = api_config.get("max_score", 100)
+        self.lease_timeout = api_config.get("lease_timeout", 1800)  # 超过这么久没有心跳的占用会被回收(秒)
+
+        # 每个代理同时允许的租约数: fixed 模式都用上限, performance 模式按成功率和响应时间折算
+        self.max_leases = max(1, int(api_config.get("max_concurrent_leases", 1)))
+        self.lease_capacity_mode = api_config.get("lease_capacity_mode", "performance")
+        if self.lease_capacity_mode not in self.LEASE_CAPACITY_MODES:
+            logger.warning(f"未知的租约容量模式 {self.lease_capacity_mode}, 使用 performance")
+            self.lease_capacity_mode = "performance"
+
+        # 断路器: 释放失败时先隔离, 隔离时间从 breaker_base_backoff 起每次连续失败翻倍(不超过 breaker_max_backoff),
+        # 连续失败 breaker_max_failures 次才标记为死亡; 设为 1 时和以前一样一次失败即死亡
+        self.breaker_base_backoff = api_config.get("breaker_base_backoff", 30)
+        self.breaker_max_backoff = api_config.get("breaker_max_backoff", 1800)
+        self.breaker_max_failures = max(1, int(api_config.get("breaker_max_failures", 5)))
+
+        # 每个代理对同一目标域名的请求速率(次/分钟)和突发上限, 0 为不限速
+        self.rate_limiter = DomainRateLimiter(api_config.get("domain_rate_per_minute", 0),
+                                              api_config.get("domain_burst", 1))
+
+        # /metrics 的计数器和直方图
+        self.metrics = PoolMetrics()
+
+        # 状态和分数变化的后写队列, 请求路径不直接访问数据库
+        self.writer = WriteBehindWriter(
+            self.db_manager,
+            flush_interval_ms=api_config.get("status_flush_interval_ms", 500),
+            flush_batch=api_config.get("status_flush_batch", 500),
+            durability=api_config.get("status_durability", "interval"),
+            max_score=self.max_score,
+            on_flush=self.metrics.observe_flush
+        )
 
-                # 检查排除列表
-                if request.exclude_proxies and proxy in request.exclude_proxies:
-                    continue
+        # 写路径用的锁, 释放时发布只读快照, 只读接口不需要加锁
+        self.lock = InstrumentedRLock(observe_wait=self.metrics.lock_wait.observe,
+                                      observe_hold=self.metrics.lock_hold.observe)
+
+        # 代理记录和索引(见 PoolState), 重新加载时整体替换
+        self._install_state(PoolState(self.max_score))
+        self._reload_guard = threading.Lock()  # 同一时间只允许一个重新加载
+        self._index_guard = threading.Lock()  # 同一时间只在锁外建立一个按需索引(哈希环、响应时间桶)
+        self._reload_touched: Optional[Set[str]] = None  # 重新加载期间状态/分数有变化的代理
+        # 排队等待代理的获取请求, 有代理空闲时按先后顺序直接分配
+        self.waiters = AcquireWaiters(api_config.get("max_acquire_waiters", 1000))
+        # 推送给面板/监控的事件, 没有订阅者时不记录
+        self.events = PoolEventBus(
+            lambda: self.stats_snapshot,
+            interval_ms=api_config.get("event_interval_ms", 500),
+            max_subscribers=api_config.get("max_event_subscribers", 100)
+        )
 
-                # 检查分数
-                proxy_data = self.proxies[proxy]
-                if proxy_data["score"] < request.min_score:
-                    continue
+        self.last_updated: Optional[str] = None
+        self._stats_dirty = True
+        self.stats_snapshot: Dict[str, Any] = {}  # 只读快照, 每次写操作结束时整体替换
+        self._publish_snapshot()
+        self.lock.on_release = self._publish_snapshot
+
+        # CLI验证器写入数据库的变化, 定期增量同步到内存(读取前先把后写队列落盘)
+        self.change_feed = ChangeFeed(
+            self.db_manager,
+            self.apply_changes,
+            interval=api_config.get("change_feed_interval", 3),
+            before_poll=self.writer.flush,
+            pause_writes=self.writer.paused,
+            max_backlog=api_config.get("change_feed_max_backlog", 100000),
+            on_overflow=self.reload_proxies
+        )
+        self.change_feed.install()
 
-                # 检查类型
-                if request.proxy_type != "all":
-                    proxy_types = proxy_data["info"].get("types", [])
-                    if request.proxy_type not in proxy_types:
-                        continue
+        # 启动时加载数据
+        self.load_proxies()
 
-                # 检查地区
-                if request.support_region and request.support_region != "all":
-                    support = proxy_data["info"].get("support", {})
-                    if not support.get(request.support_region):
-                        continue
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """当前统计(只读快照)"""
+        return self.stats_snapshot
+
+    def _publish_snapshot(self):
+        """发布统计快照(写锁释放前调用), 读者拿到的总是一份完整、不会再被修改的字典"""
+        if not self._stats_dirty:
+            return
+        self._stats_dirty = False
+        self.stats_snapshot = {**self.counters.snapshot(), "last_updated": self.last_updated}
+
+    def _count_proxy(self, proxy: str, sign: int = 1):
+        """把代理计入(或移出)计数器(调用方需持有锁)"""
+        record = self.proxies[proxy]
+        update = self.counters.add_proxy if sign > 0 else self.counters.remove_proxy
+        update(record.status, record.score, record.types, record.support,
+               record.browser_valid, record.transparent)
+        self._stats_dirty = True
+
+    def _set_status(self, record: ProxyRecord, new_status: str):
+        """修改代理状态并更新计数器(调用方需持有锁)"""
+        self.counters.change_status(record.status, new_status, record.types, record.regions)
+        record.status = new_status
+        self._stats_dirty = True
+        self._touch(record.proxy)
+
+    def start(self):
+        """启动后台写线程和变更同步线程"""
+        self.writer.start()
+        self.change_feed.start()
+
+    def close(self):
+        """关闭时把未落盘的状态写入数据库"""
+        self.change_feed.stop()
+        self.writer.stop()
+        self.db_manager.close()
+
+    def _install_state(self, state: PoolState):
+        """替换当前的代理记录和索引(调用方需持有锁, 初始化时除外)"""
+        self.proxies = state.proxies
+        self.score_index = state.score_index
+        self.idle_index = state.idle_index
+        # 全部代理的一致性哈希环, 第一次粘性获取时才在锁外建立(见 _ensure_affinity_ring)
+        self._affinity_ring: Optional[HashRing] = None
+        self._ring_pending: Optional[Set[str]] = None  # 正在建立哈希环时, 期间加入/移除过的代理
+        self.lease_expiry = state.lease_expiry
+        self.quarantine = state.quarantine
+        self.counters = state.counters
+        self._stats_dirty = True
+
+    def _touch(self, proxy: str):
+        """记录重新加载期间发生变化的代理, 替换数据时以内存中的状态为准"""
+        if self._reload_touched is not None:
+            self._reload_touched.add(proxy)
+
+    def _build_state(self, leased: Optional[Set[str]] = None) -> PoolState:
+        """
+        从数据库构建一份新的代理记录和索引(LEFT JOIN 单次查询, fetchmany 分批流式构建), 不访问当前数据
+        leased 是内存中正在占用的代理, 不放进空闲索引, 替换时再迁移占用状态
+        """
+        start_time = time.perf_counter()
+        state = PoolState(self.max_score)
+        proxies = state.proxies
+        score_index = state.score_index
+        counters = state.counters
+        lease_expiry = state.lease_expiry
+        idle_items = []
+
+        # 大量创建对象时暂停分代GC, 避免反复扫描
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self.db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None  # 按位置解包, 比 sqlite3.Row 按列名取值快得多
+
+                # 只查热数据列, 冷数据在查询详情时按需读取
+                cursor.execute('''
+                SELECT 
+                    p.proxy, p.score, p.types, p.support_china, p.support_international,
+                    p.transparent, p.browser_valid, p.avg_response_time,
+                    p.success_rate, p.last_checked,
+                    s.status, s.task_id, s.acquire_time, s.heartbeat_time
+                FROM proxies p
+                LEFT JOIN proxy_status s ON s.proxy = p.proxy
+                ''')
+
+                while True:
+                    rows = cursor.fetchmany(self.LOAD_BATCH_SIZE)
+                    if not rows:
+                        break
+
+                    for (proxy, score, types_json, support_china, support_international,
+                         transparent, browser_valid, avg_response_time,
+                         success_rate, last_checked,
+                         status, task_id, acquire_time, heartbeat_time) in rows:
+
+                        proxy_types = intern_types(types_json)
+                        status = intern_status(status)
+                        record = ProxyRecord(
+                            proxy, score, proxy_types,
+                            make_flags(support_china, support_international, transparent, browser_valid),
+                            status, task_id, acquire_time, heartbeat_time,
+                            avg_response_time, success_rate,
+                            sys.intern(last_checked) if last_checked else last_checked
+                        )
+                        proxies[proxy] = record
 
-                candidates.append((proxy_data["score"], proxy))
+                        support = record.support
+                        counters.add_proxy(status, score, proxy_types, support,
+                                           record.browser_valid, record.transparent)
 
-            if not candidates:
-                return None
+                        if status == IDLE and not (leased and proxy in leased):
+                            idle_items.append((proxy, score, proxy_types, support))
+                        elif status == BUSY:
+                            last_seen = heartbeat_time or acquire_time or time.time()
+                            lease_expiry.schedule(proxy, last_seen + self.lease_timeout)
 
-            # 按分数排序并选择最高分的代理
-            candidates.sort(reverse=True)
-            selected_proxy = candidates[0][1]
+            # 分数索引和空闲索引都按桶整体填充
+            score_index.add_many((proxy, record.score) for proxy, record in proxies.items())
+            state.idle_index.add_many(idle_items)
+        finally:
+            if gc_enabled:
+                gc.enable()
 
-            # 更新状态
-            self.status[selected_proxy].status = "busy"
-            self.status[selected_proxy].task_id = request.task_id
-            self.status[selected_proxy].acquire_time = time.time()
-            self.status[selected_proxy].heartbeat_time = time.time()
+        elapsed = time.perf_counter() - start_time
+        rate = len(proxies) / elapsed if elapsed > 0 else 0
+        logger.info(f"成功加载 {len(proxies)} 个代理, 耗时 {elapsed:.3f} 秒 ({rate:.0f} 行/秒)")
+        return state
 
-            # 更新统计
-            self.stats["idle"] -= 1
-            self.stats["busy"] += 1
+    def load_proxies(self) -> bool:
+        """从数据库加载代理数据, 替换当前内存中的代理池"""
+        try:
+            state = self._build_state()
+        except Exception as e:
+            logger.error(f"加载代理数据失败: {e}")
+            return False
 
+        with self.lock:
+            self._install_state(state)
+            self.last_updated = datetime.now().isoformat()
+        return True
+
+    def _update_proxy_score(self, proxy: str, score_delta: int, success: bool,
+                            response_time: Optional[float] = None):
+        """更新内存中的分数/成功率/平均响应时间, 并把增量交给后写队列(调用方需持有锁)"""
+        record = self.proxies.get(proxy)
+        if record is None:
+            return
+        self._touch(proxy)
+
+        # 更新分数
+        current_score = record.score
+        new_score = max(0, min(self.max_score, current_score + score_delta))
+
+        # 更新成功率
+        current_success = record.success_rate or 0.0
+        if success:
+            new_success = min(1.0, round(current_success + 0.1, 2))
+        else:
+            new_success = max(0.0, round(current_success - 0.1, 2))
+
+        logger.debug(f"代理 {proxy} 成功率 {current_success:.2f} -> {new_success:.2f}")
+
+        # 更新平均响应时间（如果有response_time）
+        current_avg = record.avg_response_time or 0.0
+        if response_time is not None:
+            rt_decay, rt_add = 0.7, response_time * 0.3
+        else:
+            rt_decay, rt_add = 1.0, 0.0
+
+        # 更新内存缓存
+        record.score = new_score
+        record.avg_response_time = round(current_avg * rt_decay + rt_add, 3)
+        record.success_rate = new_success
+        record.last_checked = sys.intern(datetime.now().strftime("%Y-%m-%d"))
+
+        # 更新索引
+        if new_score != current_score:
+            self.counters.change_score(current_score, new_score)
+            self._stats_dirty = True
+            self.score_index.move(proxy, new_score)
+            self.idle_index.update_score(proxy, new_score)
+
+        # 记录实际生效的增量, 由写线程合并后批量落盘
+        self.writer.record_score(proxy, new_score - current_score, new_success - current_success,
+                                 rt_decay, rt_add)
+
+    @staticmethod
+    def _new_task_id() -> str:
+        """生成任务ID"""
+        return f"task_{int(time.time())}_{random.randint(1000, 9999)}"
+
+    def _lease_capacity(self, record: ProxyRecord) -> int:
+        """代理同时允许的租约数, 断路器半开时只允许一个试用租约"""
+        if record.failures:
+            return 1
+        if self.max_leases == 1 or self.lease_capacity_mode == "fixed":
+            return self.max_leases
+        # 成功率越高、响应越快, 允许的并发越多, 至少为1
+        latency = record.avg_response_time or self.DEFAULT_RESPONSE_TIME
+        ratio = (record.success_rate or 0.0) * min(1.0, self.FAST_RESPONSE_TIME / latency)
+        return max(1, min(self.max_leases, int(self.max_leases * ratio + 0.5)))
+
+    def _has_capacity(self, record: ProxyRecord) -> bool:
+        return record.status != DEAD and record.status != QUARANTINE and record.lease_count < self._lease_capacity(record)
+
+    def _index_idle(self, record: ProxyRecord):
+        """按剩余容量把代理放入或移出空闲索引(调用方需持有锁)"""
+        if self._has_capacity(record):
+            self.idle_index.add(record.proxy, record.score, record.types, record.support)
+        else:
+            self.idle_index.remove(record.proxy)
+
+    def _schedule_expiry(self, record: ProxyRecord, deadline: Optional[float] = None):
+        """按最早的租约安排到期时间, 没有租约时取消(调用方需持有锁)"""
+        if record.lease_count:
+            self.lease_expiry.schedule(record.proxy,
+                                       deadline or record.earliest_seen(time.time()) + self.lease_timeout)
+        else:
+            self.lease_expiry.cancel(record.proxy)
+
+    def _schedule_quarantine(self, record: ProxyRecord):
+        """隔离中的代理按 retry_at 安排恢复, 其他状态取消(调用方需持有锁)"""
+        if record.status == QUARANTINE and record.retry_at is not None:
+            self.quarantine.schedule(record.proxy, record.retry_at)
+        else:
+            self.quarantine.cancel(record.proxy)
+
+    def _trip_breaker(self, record: ProxyRecord, now: float) -> str:
+        """记一次连续失败, 返回新状态: 没到上限时隔离(指数退避), 到上限时死亡(调用方需持有锁)"""
+        record.failures += 1
+        if record.failures >= self.breaker_max_failures:
+            record.retry_at = None
+            return DEAD
+        backoff = min(self.breaker_max_backoff, self.breaker_base_backoff * 2 ** (record.failures - 1))
+        record.retry_at = now + backoff
+        return QUARANTINE
+
+    def _selection_cost(self, proxy: str) -> float:
+        """p2c 策略比较用的代价(越小越好): 响应时间越长、成功率越低、分数越低、已有租约越多代价越高"""
+        record = self.proxies[proxy]
+        latency = record.avg_response_time or self.DEFAULT_RESPONSE_TIME
+        success = record.success_rate if record.success_rate is not None else 0.5
+        return latency / (success + 0.1) * (2 - record.score / self.max_score) * (1 + record.lease_count)
+
+    def _make_accept(self, exclude: Optional[set], gate: Optional[DomainGate] = None) -> Optional[Callable[[str], bool]]:
+        """把获取请求的筛选条件组合成选择代理时的判断函数, 没有条件时返回 None"""
+        if not exclude:
+            return gate
+        if gate is None:
+            return lambda proxy: proxy not in exclude
+        # 先看排除列表, 被排除的代理不参与计算最早可用时间
+        return lambda proxy: proxy not in exclude and gate(proxy)
+
+    def domain_gate(self, target_domain: Optional[str]) -> Optional[DomainGate]:
+        """获取请求的域名限速判断, 没有指定域名或未启用限速时返回 None"""
+        return self.rate_limiter.gate(target_domain)
+
+    def _domain_ready(self, proxy: str, domain: str) -> bool:
+        """代理现在能否用于该域名(分配给排队的请求时用)"""
+        now = time.time()
+        return self.rate_limiter.available_at(proxy, domain, now) <= now
+
+    def _ring_changed(self, proxy: str):
+        """代理加入或移除后同步哈希环(调用方需持有锁), 正在锁外建立哈希环时先记下来"""
+        if self._affinity_ring is not None:
+            if proxy in self.proxies:
+                self._affinity_ring.add(proxy)
+            else:
+                self._affinity_ring.remove(proxy)
+        if self._ring_pending is not None:
+            self._ring_pending.add(proxy)
+
+    def _ensure_affinity_ring(self):
+        """
+        第一次粘性获取时在锁外建立哈希环(不持有代理池锁), 建立期间加入/移除的代理替换时补上
+        建立期间代理池被重新加载的话丢弃结果, 下次使用时重新建立
+        """
+        with self._index_guard:
+            with self.lock:
+                if self._affinity_ring is not None:
+                    return
+                proxies = self.proxies
+                members = list(proxies)
+                self._ring_pending = set()
+
+            ring = HashRing()
+            ring.add_many(members)
+
+            with self.lock:
+                if self.proxies is not proxies:
+                    return
+                pending, self._ring_pending = self._ring_pending, None
+                for proxy in pending:
+                    if proxy in proxies:
+                        ring.add(proxy)
+                    else:
+                        ring.remove(proxy)
+                self._affinity_ring = ring
+
+    def _ensure_latency_index(self):
+        """第一次使用 fastest 时在锁外建立空闲索引的响应时间桶(见 IdleProxyIndex.latency_snapshot)"""
+        with self._index_guard:
+            with self.lock:
+                index = self.idle_index
+                if index.latency_ready:
+                    return
+                snapshot = index.latency_snapshot()
+
+            latency = index.build_latency(snapshot)
+
+            with self.lock:
+                if self.idle_index is index:
+                    index.install_latency(latency)
+
+    def _prepare_indexes(self, strategy: str, affinity_key: Optional[str]):
+        """获取前确保请求用到的按需索引已经建立, 在加锁之前调用"""
+        if affinity_key is not None and self._affinity_ring is None:
+            self._ensure_affinity_ring()
+        if strategy == "fastest" and not self.idle_index.latency_ready:
+            self._ensure_latency_index()
+
+    def _select_affinity(self, key: tuple, affinity_key: str, min_score: int,
+                         accept: Optional[Callable[[str], bool]]) -> Optional[str]:
+        """
+        从 affinity_key 在哈希环上的位置顺时针找第一个可用的代理并移出空闲索引(调用方需持有锁)
+        环上是全部代理, 死亡或占满的代理只是被跳过, 恢复后原来的键会回到它身上
+        """
+        bucket = self.idle_index.bucket(key)
+        if not bucket or self._affinity_ring is None:
+            return None
+        for probes, proxy in enumerate(self._affinity_ring.walk(affinity_key)):
+            if probes >= self.AFFINITY_MAX_PROBES:
+                break
+            if proxy in bucket and bucket.score_of(proxy) >= min_score and (accept is None or accept(proxy)):
+                self.idle_index.remove(proxy)
+                return proxy
+        return None
+
+    def _acquire_locked(self, key: tuple, min_score: int, exclude: Optional[set], task_id: str,
+                        strategy: str = "best", fields: Optional[tuple] = None,
+                        affinity_key: Optional[str] = None,
+                        gate: Optional[DomainGate] = None) -> Optional[Dict[str, Any]]:
+        """
+        从空闲索引中按策略(有 affinity_key 时先按哈希环)取出一个代理并标记为占用(调用方需持有锁)
+        gate 为目标域名的限速判断, 选中后消耗该代理的一个令牌; 没有选中时 gate.earliest 是最早有令牌的时间
+        (检查过的空闲代理和整个域名中较早的一个, 见 DomainGate.settle)
+        """
+        accept = self._make_accept(exclude, gate)
+        selected_proxy = None
+        if affinity_key is not None:
+            selected_proxy = self._select_affinity(key, affinity_key, min_score, accept)
+        if selected_proxy is None:
+            selected_proxy = self.idle_index.select(key, strategy, min_score, accept, self._selection_cost)
+        if selected_proxy is None:
+            if gate is not None:
+                gate.settle()
+            return None
+        if gate is not None:
+            gate.consume(selected_proxy)
+        return self._lease(self.proxies[selected_proxy], task_id, fields, key[0])
+
+    def _lease(self, record: ProxyRecord, task_id: str, fields: Optional[tuple] = None,
+               proxy_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        给代理新增一个租约并标记为占用, 还有剩余容量时留在空闲索引中(调用方需持有锁)
+        fields 为 None 时返回完整结果, 否则只返回 proxy、task_id 和 fields 中的字段
+        """
+        now = time.time()
+        self._set_status(record, BUSY)
+        record.add_lease(task_id, now)
+        self._schedule_expiry(record)
+        self._index_idle(record)
+        self.events.publish("acquire", record.proxy, task_id)
+
+        if fields is None:
             return {
-                "proxy": selected_proxy,
-                "task_id": request.task_id,
-                "proxy_info": self.proxies[selected_proxy]
+                "proxy": record.proxy,
+                "task_id": task_id,
+                "proxy_info": {"score": record.score, "info": record.hot_info()}
             }
+        result = {"proxy": record.proxy, "task_id": task_id}
+        for field in fields:
+            result[field] = LEASE_FIELDS[field](record, proxy_type)
+        return result
+
+    def _hand_off(self, record: ProxyRecord) -> bool:
+        """代理有空余容量时, 按先后顺序直接分配给匹配的等待者, 直到容量用完(调用方需持有锁)"""
+        handed = False
+        while self.waiters and self._has_capacity(record):
+            keys = IdleProxyIndex.bucket_keys(record.types, record.support)
+            waiter = self.waiters.match(record.proxy, record.score, keys, self._domain_ready)
+            if waiter is None:
+                break
+            if waiter.domain is not None:
+                self.rate_limiter.consume(record.proxy, waiter.domain, time.time())
+            waiter.deliver(self._lease(record, waiter.task_id, waiter.fields, waiter.key[0]),
+                           self._return_orphan)
+            handed = True
+        return handed
+
+    def _serve_waiters(self):
+        """按先后顺序给等待者分配空闲代理, 用于一次有大量代理变为空闲的情况(调用方需持有锁)"""
+        for waiter in self.waiters.waiting():
+            gate = self.domain_gate(waiter.domain)
+            result = self._acquire_locked(waiter.key, waiter.min_score, waiter.exclude, waiter.task_id,
+                                          fields=waiter.fields, gate=gate)
+            if result is not None:
+                self.waiters.remove(waiter)
+                waiter.deliver(result, self._return_orphan)
+
+    def _return_orphan(self, result: Dict[str, Any]):
+        """等待者已经超时, 把分配给它的代理还回去(不影响分数)"""
+        self.release_proxy(result["proxy"], result["task_id"], success=True)
+
+    async def wait_for_proxy(self, request: AcquireRequest, timeout: float,
+                             gate: Optional[DomainGate] = None) -> Optional[Dict[str, Any]]:
+        """
+        排队等待符合条件的代理, 超时或等待队列已满返回 None
+        有 gate 时, 空闲代理只是令牌用完的话, 到最早有令牌的时间再自己重试一次
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._prepare_indexes(request.strategy, request.affinity_key)
+        with self.lock:
+            if not request.task_id:
+                request.task_id = self._new_task_id()
+            key = self.idle_index.request_key(request.proxy_type, request.support_region)
+            exclude = set(request.exclude_proxies) if request.exclude_proxies else None
+
+            fields = request.lease_fields()
+
+            # 加锁后再试一次, 避免错过刚刚释放的代理
+            if gate is not None:
+                gate.refresh()
+            result = self._acquire_locked(key, request.min_score, exclude, request.task_id, request.strategy,
+                                          fields, request.affinity_key, gate)
+            if result is not None:
+                return result
+            waiter = self.waiters.add(key, request.min_score, exclude, request.task_id, loop, fields,
+                                      gate.domain if gate is not None else None)
+            if waiter is None:
+                logger.warning("等待获取代理的请求过多")
+                return None
 
-    def release_proxy(self, proxy: str, task_id: str, success: bool = True):
-        """释放代理并更新状态"""
+        try:
+            while True:
+                wake = deadline
+                if gate is not None and gate.earliest is not None:
+                    wake = min(deadline, loop.time() + max(0.0, gate.earliest - time.time()))
+                try:
+                    # shield: 中途醒来重试时不能取消 future, 否则已经分配的代理会被当成孤儿还回去
+                    return await asyncio.wait_for(asyncio.shield(waiter.future), wake - loop.time())
+                except asyncio.TimeoutError:
+                    if loop.time() >= deadline:
+                        return None
+
+                with self.lock:
+                    if waiter not in self.waiters:
+                        gate = None  # 已经分配了代理, 只需等结果送达
+                        continue
+                    gate.refresh()
+                    result = self._acquire_locked(key, request.min_score, exclude, request.task_id,
+                                                  request.strategy, fields, request.affinity_key, gate)
+                    if result is not None:
+                        self.waiters.remove(waiter)
+                        return result
+        finally:
+            if not waiter.future.done():
+                waiter.future.cancel()
+            with self.lock:
+                self.waiters.remove(waiter)
+
+    def acquire_proxy(self, request: AcquireRequest, gate: Optional[DomainGate] = None) -> Optional[Dict[str, Any]]:
+        """获取一个代理, gate 为目标域名的限速判断(见 domain_gate)"""
+        self._prepare_indexes(request.strategy, request.affinity_key)
         with self.lock:
-            if proxy not in self.status:
+            # 生成任务ID
+            if not request.task_id:
+                request.task_id = self._new_task_id()
+
+            # 从空闲索引中取符合条件的最高分代理
+            key = self.idle_index.request_key(request.proxy_type, request.support_region)
+            exclude = set(request.exclude_proxies) if request.exclude_proxies else None
+            result = self._acquire_locked(key, request.min_score, exclude, request.task_id, request.strategy,
+                                          request.lease_fields(), request.affinity_key, gate)
+            if result is None:
+                self.metrics.record_miss(key, request.min_score, exclude is not None)
+                if gate is not None and gate.earliest is not None:
+                    self.metrics.rate_limited += 1
+            return result
+
+    def acquire_proxies(self, request: AcquireBatchRequest,
+                        gate: Optional[DomainGate] = None) -> List[Dict[str, Any]]:
+        """一次加锁批量获取多个不同的代理, 可用代理不足时返回能拿到的部分"""
+        task_ids = list(request.task_ids or [])
+        results = []
+
+        fields = request.lease_fields()
+
+        self._prepare_indexes(request.strategy, request.affinity_key)
+        with self.lock:
+            key = self.idle_index.request_key(request.proxy_type, request.support_region)
+            # 已取出的代理加入排除集合, 还有剩余容量的代理也不会在同一批里重复出现
+            exclude = set(request.exclude_proxies or ())
+
+            for i in range(request.count):
+                if i < len(task_ids) and task_ids[i]:
+                    task_id = task_ids[i]
+                elif request.task_id:
+                    task_id = f"{request.task_id}_{i}"
+                else:
+                    task_id = f"{self._new_task_id()}_{i}"
+
+                result = self._acquire_locked(key, request.min_score, exclude, task_id, request.strategy, fields,
+                                              request.affinity_key, gate)
+                if result is None:
+                    # 没拿够也算一次未命中
+                    self.metrics.record_miss(key, request.min_score, bool(request.exclude_proxies))
+                    if gate is not None and gate.earliest is not None:
+                        self.metrics.rate_limited += 1
+                    break
+                results.append(result)
+                exclude.add(result["proxy"])
+
+        return results
+
+    def release_proxy(self, proxy: str, task_id: str, success: bool = True,
+                      response_time: Optional[float] = None, update_score: bool = False):
+        """
+        释放代理并更新断路器和状态, update_score 为真时按结果调整分数
+        成功+2; 失败只有在断路器半开试用时(连续第二次及以后)才算持续故障, 扣1分
+        """
+        with self.lock:
+            record = self.proxies.get(proxy)
+            if record is None:
                 return False
 
-            status = self.status[proxy]
-
             # 检查任务ID是否匹配
-            if status.task_id != task_id:
-                logger.warning(f"任务ID不匹配: 预期 {status.task_id}, 实际 {task_id}")
-                # 但还是释放，防止代理被永久占用
-
-            # 更新状态
-            old_status = status.status
-            status.status = "idle" if success else "dead"
-            status.task_id = None
-            status.acquire_time = None
-
-            # 更新统计
-            if old_status == "busy":
-                self.stats["busy"] -= 1
-                if success:
-                    self.stats["idle"] += 1
-                else:
-                    self.stats["dead"] += 1
-
-            # 保存状态到数据库
-            try:
-                with self.db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    if success:
-                        cursor.execute('''
-                        INSERT OR REPLACE INTO proxy_status (proxy, status, task_id, acquire_time, heartbeat_time)
-                        VALUES (?, 'idle', NULL, NULL, NULL)
-                        ''', (proxy,))
-                    else:
-                        cursor.execute('''
-                        INSERT OR REPLACE INTO proxy_status (proxy, status, task_id, acquire_time, heartbeat_time)
-                        VALUES (?, 'dead', NULL, NULL, NULL)
-                        ''', (proxy,))
-                    conn.commit()
-            except Exception as e:
-                logger.error(f"保存代理状态失败: {e}")
+            released = record.remove_lease(task_id)
+            if not released:
+                logger.warning(f"任务ID不匹配: 预期 {record.task_id}, 实际 {task_id}")
+                # 只有一个租约时还是释放，防止代理被永久占用; 有多个租约时不动别的任务的租约
+                if record.lease_count == 1:
+                    released = record.remove_lease(record.task_id)
+
+            # 更新状态: 已经死亡的代理保持死亡; 隔离期间归还的租约(隔离前发出的)不改变断路器;
+            # 失败时断路器打开(隔离或连续失败太多次后死亡); 成功时断路器关闭
+            persistent = False
+            if record.status == DEAD and (released or not success):
+                new_status = DEAD
+            elif record.status == QUARANTINE:
+                new_status = QUARANTINE
+            elif not success:
+                persistent = record.failures > 0
+                new_status = self._trip_breaker(record, time.time())
+            else:
+                record.failures = 0
+                new_status = BUSY if record.lease_count else IDLE
+            self._set_status(record, new_status)
+            self._schedule_expiry(record)
+            self._schedule_quarantine(record)
+
+            if update_score:
+                score_delta = 2 if success else (-1 if persistent else 0)
+                self._update_proxy_score(proxy, score_delta, success, response_time)
+
+            # 更新空闲索引(分数更新之后)
+            self._index_idle(record)
+
+            # 状态交给后写队列落盘(还有其他租约时和获取代理一样不落盘);
+            # 隔离只在内存中, 数据库里记为空闲, 重启后断路器重新关闭
+            if record.status != BUSY:
+                self.writer.record_status(proxy, IDLE if record.status == QUARANTINE else record.status)
+            if success:
+                self.events.publish("release", proxy, task_id)
+            else:
+                self.events.publish("dead" if record.status == DEAD else "quarantine", proxy, task_id)
+
+            # 有排队的请求时直接交给它
+            self._hand_off(record)
 
             return True
 
     def heartbeat(self, proxy: str, task_id: str) -> bool:
         """更新心跳"""
         with self.lock:
-            if proxy not in self.status:
-                return False
-
-            status = self.status[proxy]
-            if status.task_id != task_id:
+            record = self.proxies.get(proxy)
+            now = time.time()
+            if record is None or not record.touch_lease(task_id, now):
                 return False
 
-            status.heartbeat_time = time.time()
+            self._touch(proxy)
+            self._schedule_expiry(record)
 
-            # 保存心跳到数据库
-            try:
-                with self.db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                    UPDATE proxy_status SET heartbeat_time = ? WHERE proxy = ?
-                    ''', (status.heartbeat_time, proxy))
-                    conn.commit()
-            except Exception as e:
-                logger.error(f"保存心跳失败: {e}")
+            # 心跳交给后写队列落盘
+            self.writer.record_heartbeat(proxy, now)
 
             return True
 
+    def heartbeat_many(self, items: List[Tuple[str, str]]) -> List[bool]:
+        """一次加锁批量更新心跳 [(代理, 任务ID)], 返回每一项是否成功; 这批记录在同一个事务里落盘"""
+        with self.lock, self.writer.batch():
+            return [self.heartbeat(proxy, task_id) for proxy, task_id in items]
+
+    def release_many(self, items: List[Tuple[str, str, Optional[bool], Optional[float]]]) -> List[bool]:
+        """
+        一次加锁批量释放 [(代理, 任务ID, 是否成功, 响应时间)], 返回每一项是否成功; 这批记录在同一个事务里落盘
+        是否成功为 None 表示租约没有用过(比如客户端预取后没用完), 和等待者超时退回的代理一样按成功归还, 不调整分数
+        """
+        with self.lock, self.writer.batch():
+            return [
+                self.release_proxy(proxy, task_id, success=success is not False, response_time=response_time,
+                                   update_score=success is not None)
+                for proxy, task_id, success, response_time in items
+            ]
+
+    def reap_expired_leases(self, now: Optional[float] = None) -> int:
+        """回收心跳超时的占用, 只处理到期堆里真正到期的代理, 状态变化一次性交给写线程落盘"""
+        now = now or time.time()
+        released = 0
+        with self.lock:
+            cutoff = now - self.lease_timeout
+            for proxy in self.lease_expiry.pop_expired(now):
+                record = self.proxies.get(proxy)
+                if record is None or not record.lease_count:
+                    continue
+                expired = [task_id for task_id, acquire_time, heartbeat_time in record.leases()
+                           if (heartbeat_time or acquire_time or 0) <= cutoff]
+                if not expired:
+                    # 最早的租约已经归还, 按剩下的租约重新安排
+                    self._schedule_expiry(record)
+                    continue
+                for task_id in expired:
+                    logger.warning(f"代理 {proxy} 超时，自动释放")
+                    self.release_proxy(proxy, task_id or "timeout", success=False)
+                    released += 1
+
+        if released:
+            self.writer.request_flush()
+        return released
+
+    def prune_rate_limits(self) -> int:
+        """删除已经补满的域名限速桶, 满的桶和不存在的桶等价"""
+        with self.lock:
+            return self.rate_limiter.prune()
+
+    def next_lease_deadline(self) -> Optional[float]:
+        return self.lease_expiry.next_deadline()
+
+    def recover_quarantined(self, now: Optional[float] = None) -> int:
+        """隔离到期的代理恢复为半开: 重新放回空闲索引, 只允许一个试用租约"""
+        now = now or time.time()
+        recovered = 0
+        with self.lock:
+            for proxy in self.quarantine.pop_expired(now):
+                record = self.proxies.get(proxy)
+                if record is None or record.status != QUARANTINE:
+                    continue
+                record.retry_at = None
+                self._set_status(record, BUSY if record.lease_count else IDLE)
+                self._index_idle(record)
+                self.events.publish("recover", proxy)
+                self._hand_off(record)
+                recovered += 1
+        return recovered
+
+    def next_quarantine_deadline(self) -> Optional[float]:
+        return self.quarantine.next_deadline()
+
     def get_stats(self) -> Dict[str, Any]:
-        """获取统计信息"""
+        """获取统计信息(读快照, 不加锁, O(1))"""
+        return {
+            **self.stats_snapshot,
+            "timestamp": datetime.now().isoformat(),
+            "lock": self.lock.stats()
+        }
+
+    def render_metrics(self) -> str:
+        """Prometheus 文本格式的指标"""
         with self.lock:
-            return {
-                **self.stats,
-                "timestamp": datetime.now().isoformat(),
-                "memory_usage": len(str(self.proxies)) + len(str(self.status))
+            by_type, by_region = self.counters.status_breakdown()
+            totals = dict(self.counters.status)
+            waiters = len(self.waiters)
+        return self.metrics.render(by_type, by_region, totals, waiters, self.lock.contended,
+                                   self.writer.pending_count())
+
+    def get_memory_usage(self) -> Dict[str, Any]:
+        """
+        内存占用明细(字节), 用于估算大代理池需要的内存
+        需要遍历整个代理池, 只在诊断时调用; 锁内只取各结构的引用, 遍历时每处理一小批对象释放一次锁,
+        不会长时间阻塞获取/释放(遍历期间代理池可能变化, 结果是近似值)
+        """
+        with self.lock:
+            structures = {
+                "proxies": self.proxies,
+                "score_index": self.score_index,
+                "idle_index": self.idle_index,
+                "affinity_ring": self._affinity_ring,
+                "lease_expiry": self.lease_expiry,
+                "quarantine": self.quarantine,
+                "domain_limits": self.rate_limiter
             }
+            count = len(self.proxies)
+
+        seen = set()
+        breakdown = {name: deep_getsizeof(obj, seen, self.lock) for name, obj in structures.items()}
+        total = sum(breakdown.values())
+
+        return {
+            "total": total,
+            "per_proxy": round(total / count, 1) if count else 0,
+            "proxies": count,
+            "breakdown": breakdown,
+            "tracemalloc": tracemalloc_summary()
+        }
+
+    def _drop_proxy(self, proxy: str):
+        """把代理从内存缓存和所有索引中移除, 每个索引都是 O(1)(调用方需持有锁)"""
+        if proxy in self.proxies:
+            self._count_proxy(proxy, -1)
+        self.proxies.pop(proxy, None)
+        self._touch(proxy)
+
+        self.idle_index.remove(proxy)
+        self.score_index.remove(proxy)
+        self.lease_expiry.cancel(proxy)
+        self.quarantine.cancel(proxy)
+        self._ring_changed(proxy)
+
+    def _add_record(self, record: ProxyRecord, deadline: Optional[float] = None):
+        """把代理记录加入内存缓存和所有索引, _drop_proxy 的逆操作(调用方需持有锁)"""
+        proxy = record.proxy
+        self.proxies[proxy] = record
+        self._count_proxy(proxy, 1)
+        self._touch(proxy)
+
+        self.score_index.add(proxy, record.score)
+        self._ring_changed(proxy)
+
+        self._index_idle(record)
+        self._schedule_expiry(record, deadline)
+        self._schedule_quarantine(record)
+        self._hand_off(record)
+
+    def apply_changes(self, rows: List[tuple], deleted: List[str]) -> int:
+        """
+        应用数据库中有变化的代理(来自变更订阅), 只更新这些代理的记录和索引
+        rows 按 ChangeFeed.ROW_COLUMNS 的列顺序; 占用中的代理保留占用状态和断路器状态,
+        死亡代理重新通过验证(分数大于0)后恢复为空闲, 断路器关闭
+        读取这些行之后释放/反馈的分数更新还在后写队列里(读取期间暂停落盘), 叠加到数据库的值上,
+        和这些更新落盘后数据库里的值一致, 不会丢掉内存中的分数
+        """
+        with self.lock:
+            for proxy in deleted:
+                if proxy in self.proxies:
+                    self._drop_proxy(proxy)
+                    self.events.publish("remove", proxy)
+
+            for (proxy, score, types_json, support_china, support_international, transparent,
+                 browser_valid, avg_response_time, success_rate, last_checked) in rows:
+                pending = self.writer.pending_score(proxy)
+                if pending is not None:
+                    score_delta, success_delta, rt_decay, rt_add = pending
+                    score = max(0, min(self.max_score, score + score_delta))
+                    success_rate = max(0.0, min(1.0, round((success_rate or 0) + success_delta, 2)))
+                    avg_response_time = round((avg_response_time or 0) * rt_decay + rt_add, 3)
+                old = self.proxies.get(proxy)
+                deadline = self.lease_expiry.deadline_of(proxy)
+                if old is not None:
+                    self._drop_proxy(proxy)
+
+                record = ProxyRecord(
+                    proxy, score, intern_types(types_json),
+                    make_flags(support_china, support_international, transparent, browser_valid),
+                    IDLE, None, None, None, avg_response_time, success_rate,
+                    sys.intern(last_checked) if last_checked else last_checked
+                )
+                if old is not None:
+                    record.copy_leases(old)
+                    if old.status == DEAD and score <= 0:
+                        record.status = DEAD
+                    elif old.status == QUARANTINE:
+                        record.status = QUARANTINE
+                    elif record.lease_count:
+                        record.status = BUSY
+                    if old.status == DEAD and record.status != DEAD:
+                        self.writer.record_status(proxy, IDLE)
+                    else:
+                        record.copy_breaker(old)
+                self._add_record(record, deadline)
+                self.events.publish("update", proxy, record.task_id)
+
+            if rows or deleted:
+                self.last_updated = datetime.now().isoformat()
+        return len(rows) + len(deleted)
 
     def cleanup_dead_proxies(self):
         """清理死亡代理"""
         with self.lock:
             dead_proxies = []
-            for proxy, status in self.status.items():
-                if status.status == "dead":
+            for proxy, record in self.proxies.items():
+                # 还有租约没归还的等归还后再清理
+                if record.status == DEAD and not record.lease_count:
                     dead_proxies.append(proxy)
 
             for proxy in dead_proxies:
@@ -484,23 +1161,8 @@ class ProxyPoolManager:
                 # except Exception as e:
                 #     logger.error(f"从数据库删除代理 {proxy} 失败: {e}")
 
-                # 从内存缓存中删除
-                if proxy in self.proxies:
-                    del self.proxies[proxy]
-                if proxy in self.status:
-                    del self.status[proxy]
-
-                # 从索引中移除
-                for index in [self.type_index, self.region_index]:
-                    for key in index:
-                        if proxy in index[key]:
-                            index[key].remove(proxy)
-
-                # 从分数索引中移除
-                self.score_index = [(score, p) for score, p in self.score_index if p != proxy]
-
-            self.stats["total"] = len(self.proxies)
-            self.stats["dead"] = 0
+                # 从内存缓存和索引中删除
+                self._drop_proxy(proxy)
 
             logger.info(f"清理了 {len(dead_proxies)} 个死亡代理")
             return len(dead_proxies)
@@ -509,7 +1171,7 @@ class ProxyPoolManager:
         """清理数据库中分数为0的代理"""
         with self.lock:
             try:
-                with self.db_manager.get_connection() as conn:
+                with self.db_manager.get_writer() as conn:
                     cursor = conn.cursor()
 
                     # 查询0分代理数量
@@ -538,22 +1200,7 @@ class ProxyPoolManager:
 
                     # 更新内存缓存
                     for proxy in dead_proxies:
-                        if proxy in self.proxies:
-                            del self.proxies[proxy]
-                        if proxy in self.status:
-                            del self.status[proxy]
-
-                        # 从索引中移除
-                        for index in [self.type_index, self.region_index]:
-                            for key in index:
-                                if proxy in index[key]:
-                                    index[key].remove(proxy)
-
-                        # 从分数索引中移除
-                        self.score_index = [(score, p) for score, p in self.score_index if p != proxy]
-
-                    # 更新统计
-                    self.stats["total"] = len(self.proxies)
+                        self._drop_proxy(proxy)
 
                     logger.info(f"清理了 {deleted_count} 个0分代理")
                     return deleted_count
@@ -562,66 +1209,242 @@ class ProxyPoolManager:
                 logger.error(f"清理0分代理失败: {e}")
                 return 0
 
+    def _read_proxy_info(self, proxy: str) -> Optional[Dict[str, Any]]:
+        record = self.proxies.get(proxy)
+        if record is None:
+            return None
+
+        return {
+            "proxy": proxy,
+            "score": record.score,
+            "record": record,
+            "status": record.status,
+            "task_id": record.task_id,
+            "acquire_time": record.acquire_time,
+            "heartbeat_time": record.heartbeat_time,
+            "leases": [{"task_id": task_id, "acquire_time": acquire_time, "heartbeat_time": heartbeat_time}
+                       for task_id, acquire_time, heartbeat_time in record.leases()],
+            "max_leases": self._lease_capacity(record),
+            "failures": record.failures,
+            "retry_at": record.retry_at,
+            "performance": record.performance()
+        }
+
+    def _load_cold_info(self, proxy: str) -> Optional[Dict[str, Any]]:
+        """从数据库读取代理的冷数据(位置、浏览器检测、安全检测)"""
+        try:
+            with self.db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                cursor.execute(f"SELECT {COLD_COLUMNS} FROM proxies WHERE proxy = ?", (proxy,))
+                row = cursor.fetchone()
+            return cold_info_from_row(row) if row else None
+        except Exception as e:
+            logger.error(f"读取代理 {proxy} 详细信息失败: {e}")
+            return None
+
+    def attach_cold_info(self, results: List[Dict[str, Any]]):
+        """
+        给完整的获取结果(不带 fields/compact 时)补上位置、浏览器检测和安全检测等冷数据,
+        和以前的获取结果字段一致; 在锁外按主键批量读取, 只需要热数据的客户端用 fields/compact 可以省掉这次查询
+        """
+        infos: Dict[str, List[Dict[str, Any]]] = {}
+        for result in results:
+            if "proxy_info" in result:
+                infos.setdefault(result["proxy"], []).append(result["proxy_info"]["info"])
+        if not infos:
+            return
+
+        proxies = list(infos)
+        try:
+            with self.db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                for i in range(0, len(proxies), ChangeFeed.QUERY_CHUNK):
+                    chunk = proxies[i:i + ChangeFeed.QUERY_CHUNK]
+                    placeholders = ", ".join("?" * len(chunk))
+                    cursor.execute(f"SELECT proxy, {COLD_COLUMNS} FROM proxies WHERE proxy IN ({placeholders})",
+                                   chunk)
+                    for row in cursor.fetchall():
+                        cold = cold_info_from_row(row[1:])
+                        for info in infos[row[0]]:
+                            info["detected_ip"] = cold["detected_ip"]
+                            info["location"] = cold["location"]
+                            info["browser"].update(cold["browser"])
+                            info["security"] = cold["security"]
+        except Exception as e:
+            logger.error(f"读取获取结果的详细信息失败: {e}")
+
     def get_proxy_info(self, proxy: str) -> Optional[Dict[str, Any]]:
-        """获取代理详细信息"""
-        with self.lock:
-            if proxy not in self.proxies:
-                return None
+        """
+        获取代理详细信息
+        热数据用 seqlock 方式不加锁读取(多次遇到写操作才退回加锁读取), 冷数据在锁外从数据库读取
+        """
+        result = None
+        for _ in range(3):
+            version = self.lock.version
+            if version % 2:
+                # 有写操作正在进行
+                time.sleep(0)
+                continue
+            try:
+                result = self._read_proxy_info(proxy)
+            except RuntimeError:
+                # 读取途中租约表被并发修改(字典大小变化), 重试
+                continue
+            if self.lock.version == version:
+                break
+        else:
+            with self.lock:
+                result = self._read_proxy_info(proxy)
+
+        if result is None:
+            return None
+
+        info = result.pop("record").full_info(self._load_cold_info(proxy))
+        info["performance"] = result.pop("performance")
+        return {"proxy": result.pop("proxy"), "score": result.pop("score"), "info": info, **result}
+
+    def _carry_over(self, old: ProxyRecord, deadline: Optional[float]):
+        """把旧记录的分数、占用状态和断路器状态迁移到新加载的同名记录上(调用方需持有锁, 新数据已替换)"""
+        record = self.proxies.get(old.proxy)
+        if record is None:
+            if old.lease_count:
+                logger.warning(f"代理 {old.proxy} 已不在数据库中, 丢弃其占用")
+            return
+
+        if record.score != old.score:
+            self.counters.change_score(record.score, old.score)
+            self.score_index.move(old.proxy, old.score)
+            record.score = old.score
+        record.avg_response_time = old.avg_response_time
+        record.success_rate = old.success_rate
+        record.last_checked = old.last_checked
+
+        self._set_status(record, old.status)
+        record.copy_leases(old)
+        record.copy_breaker(old)
+
+        self._index_idle(record)
+        self._schedule_expiry(record, deadline)
+        self._schedule_quarantine(record)
+
+    def reload_proxies(self) -> bool:
+        """
+        重新加载代理池(双缓冲)
+        先把未落盘的变化写入数据库, 在锁外构建新的代理记录和索引, 再加锁迁移占用中的租约
+        和构建期间有变化的代理, 整体替换; 构建期间获取/释放代理不受影响
+        """
+        if not self._reload_guard.acquire(blocking=False):
+            logger.warning("代理池正在重新加载, 忽略本次请求")
+            return False
 
-            proxy_data = self.proxies[proxy]
-            status = self.status.get(proxy)
+        try:
+            with self.lock:
+                self._reload_touched = set()
+                # 占用中和隔离中的代理都不放进新的空闲索引
+                leased = set(self.lease_expiry.keys())
+                leased.update(self.quarantine.keys())
+            self.writer.flush()
 
-            return {
-                "proxy": proxy,
-                "score": proxy_data["score"],
-                "info": proxy_data["info"],
-                "status": status.status if status else "unknown",
-                "task_id": status.task_id if status else None,
-                "acquire_time": status.acquire_time if status else None,
-                "heartbeat_time": status.heartbeat_time if status else None
-            }
+            try:
+                state = self._build_state(leased)
+            except Exception as e:
+                logger.error(f"重新加载代理失败: {e}")
+                return False
 
-    def reload_proxies(self):
-        """重新加载代理"""
-        with self.lock:
-            # 清空缓存
-            self.proxies.clear()
-            self.status.clear()
-            self.type_index.clear()
-            self.score_index.clear()
-            self.region_index["china"].clear()
-            self.region_index["international"].clear()
-
-            # 重新加载
-            self.load_proxies()
+            with self.lock:
+                # 占用中的租约、隔离中的代理和构建期间有变化的代理以内存为准
+                carry = set(self.lease_expiry.keys())
+                carry.update(self.quarantine.keys())
+                carry.update(self._reload_touched)
+                old_proxies = self.proxies
+                deadlines = {proxy: self.lease_expiry.deadline_of(proxy) for proxy in carry}
+                self._reload_touched = None
+
+                # 旧数据留到释放锁之后再回收, 大代理池的回收也要不少时间
+                old_state = (self.score_index, self.idle_index, self._affinity_ring,
+                             self.lease_expiry, self.quarantine, self.counters)
+                self._install_state(state)
+                for proxy in carry:
+                    old = old_proxies.get(proxy)
+                    if old is None:
+                        # 构建期间被清理的代理
+                        if proxy in self.proxies:
+                            self._drop_proxy(proxy)
+                        continue
+                    self._carry_over(old, deadlines[proxy])
+
+                self._serve_waiters()
+                self.last_updated = datetime.now().isoformat()
+                self.events.publish("reload")
+                logger.info(f"代理池已替换, 迁移了 {len(carry)} 个代理的状态")
+            del old_state, old_proxies
             return True
+        finally:
+            with self.lock:
+                self._reload_touched = None
+            self._reload_guard.release()
 
 # 全局代理池实例
 proxy_pool: Optional[ProxyPoolManager] = None
+# 转发代理网关(配置 gateway_enabled 时启动)
+gateway: Optional[ProxyGateway] = None
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    global proxy_pool
+    global proxy_pool, gateway
 
     db_path = os.path.join(BASE_DIR, "data/proxies.db")
 
+    api_config = load_api_config()
+    if api_config.get("tracemalloc") and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
     # 启动时
-    proxy_pool = ProxyPoolManager(db_path)
+    proxy_pool = ProxyPoolManager(db_path, api_config)
+    proxy_pool.start()
 
     # 启动后台任务
     background_tasks = asyncio.create_task(run_background_tasks())
+    lease_reaper = asyncio.create_task(run_lease_reaper())
+    event_broadcaster = asyncio.create_task(proxy_pool.events.run())
+
+    # 转发代理网关: 客户端直接把它当代理用, 由网关负责获取/心跳/释放
+    if api_config.get("gateway_enabled"):
+        gateway = ProxyGateway(
+            proxy_pool, AcquireRequest,
+            host=api_config.get("gateway_host", "127.0.0.1"),
+            port=api_config.get("gateway_port", 8001),
+            password=api_config.get("gateway_password"),
+            max_retries=api_config.get("gateway_max_retries", 3),
+            connect_timeout=api_config.get("gateway_connect_timeout", 10),
+            idle_timeout=api_config.get("gateway_idle_timeout", 300),
+            max_connections=api_config.get("gateway_max_connections", 1000)
+        )
+        try:
+            await gateway.start()
+        except OSError as e:
+            logger.error(f"代理网关启动失败: {e}")
+            gateway = None
 
     yield
 
     # 关闭时
-    background_tasks.cancel()
-    try:
-        await background_tasks
-    except asyncio.CancelledError:
-        pass
+    if gateway is not None:
+        await gateway.stop()
+        gateway = None
+    for task in (background_tasks, lease_reaper, event_broadcaster):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    proxy_pool.close()
 
 async def run_background_tasks():
     """运行后台任务"""
@@ -634,21 +1457,10 @@ async def run_background_tasks():
             if not proxy_pool:
                 continue
 
-            # 每次执行清理超时占用
-            timeout_threshold = time.time() - 1800  # 30分钟
-            released_count = 0
+            # 超时占用由 run_lease_reaper 按到期时间回收
 
-            with proxy_pool.lock:
-                for proxy, status in proxy_pool.status.items():
-                    if (status.status == "busy" and
-                            status.heartbeat_time and
-                            status.heartbeat_time < timeout_threshold):
-                        logger.warning(f"代理 {proxy} 超时，自动释放")
-                        proxy_pool.release_proxy(proxy, status.task_id or "timeout", success=False)
-                        released_count += 1
-
-            if released_count > 0:
-                logger.info(f"自动释放了 {released_count} 个超时代理")
+            # 删除已经补满的域名限速桶
+            proxy_pool.prune_rate_limits()
 
             # 每6次（30分钟）清理一次死亡代理
             if cleanup_counter % 6 == 0:
@@ -675,6 +1487,34 @@ async def run_background_tasks():
             await asyncio.sleep(60)
 
 
+async def run_lease_reaper():
+    """按到期堆回收超时占用、恢复隔离到期的代理, 精度为秒级"""
+    while True:
+        try:
+            await asyncio.sleep(1)
+
+            if not proxy_pool:
+                continue
+
+            now = time.time()
+            next_deadline = proxy_pool.next_lease_deadline()
+            if next_deadline is not None and next_deadline <= now:
+                released_count = proxy_pool.reap_expired_leases()
+                if released_count > 0:
+                    logger.info(f"自动释放了 {released_count} 个超时代理")
+
+            # 隔离到期的代理恢复为半开
+            next_retry = proxy_pool.next_quarantine_deadline()
+            if next_retry is not None and next_retry <= now:
+                recovered_count = proxy_pool.recover_quarantined()
+                if recovered_count > 0:
+                    logger.info(f"{recovered_count} 个隔离代理恢复试用")
+
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"回收超时占用异常: {e}")
+
 
 # 创建FastAPI应用
 app = FastAPI(title="代理池API", lifespan=lifespan)
@@ -689,6 +1529,44 @@ app.add_middleware(
 )
 
 
+def timed(operation: str):
+    """记录接口耗时和失败次数(抛出异常即算失败, 包括 HTTPException)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                if proxy_pool:
+                    proxy_pool.metrics.observe_request(operation, time.perf_counter() - start, failed)
+        return wrapper
+    return decorator
+
+
+def no_proxy_error(gate: Optional[DomainGate]) -> HTTPException:
+    """
+    没有拿到代理时的错误: 有代理对目标域名的令牌用完时(不论是空闲还是占用中)返回 429,
+    带上最早有令牌的时间(Unix 时间戳)和 Retry-After, 否则返回 404
+    """
+    if gate is None or gate.earliest is None:
+        return HTTPException(status_code=404, detail="没有可用的代理")
+    retry_after = max(0.0, gate.earliest - time.time())
+    return HTTPException(
+        status_code=429,
+        detail={
+            "message": "代理对目标域名的请求过于频繁",
+            "target_domain": gate.domain,
+            "available_at": round(gate.earliest, 3),
+            "retry_after": round(retry_after, 3)
+        },
+        headers={"Retry-After": str(math.ceil(retry_after))}
+    )
+
+
 # API路由
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -727,48 +1605,83 @@ async def root():
         """, status_code=500)
 
 
-@app.post("/proxy/acquire")
-async def acquire_proxy(request: AcquireRequest, background_tasks: BackgroundTasks):
+@app.post("/proxy/acquire", response_class=FastJSONResponse)
+@timed("acquire")
+async def acquire_proxy(request: AcquireRequest):
     """获取代理"""
     if not proxy_pool:
         raise HTTPException(status_code=503, detail="代理池未初始化")
 
-    result = proxy_pool.acquire_proxy(request)
+    gate = proxy_pool.domain_gate(request.target_domain)
+    result = proxy_pool.acquire_proxy(request, gate)
+    if not result and request.wait_timeout:
+        # 排队等待有代理被释放或加入
+        result = await proxy_pool.wait_for_proxy(request, request.wait_timeout, gate)
     if not result:
-        raise HTTPException(status_code=404, detail="没有可用的代理")
+        raise no_proxy_error(gate)
+    if request.lease_fields() is None:
+        proxy_pool.attach_cold_info([result])
 
-    return {
+    # 结果只有基本类型, 直接返回响应, 不经过 jsonable_encoder
+    return FastJSONResponse({
         "code": 200,
         "message": "成功获取代理",
         "data": result
-    }
+    })
+
+
+@app.post("/proxy/acquire_batch", response_class=FastJSONResponse)
+@timed("acquire_batch")
+async def acquire_proxy_batch(request: AcquireBatchRequest):
+    """批量获取代理"""
+    if not proxy_pool:
+        raise HTTPException(status_code=503, detail="代理池未初始化")
+
+    gate = proxy_pool.domain_gate(request.target_domain)
+    results = proxy_pool.acquire_proxies(request, gate)
+    if not results and request.wait_timeout:
+        # 一个都没有时排队等待第一个
+        single = AcquireRequest(**request.model_dump(exclude={"count", "task_ids"}))
+        if request.task_ids and request.task_ids[0]:
+            single.task_id = request.task_ids[0]
+        elif request.task_id:
+            single.task_id = f"{request.task_id}_0"
+        result = await proxy_pool.wait_for_proxy(single, request.wait_timeout, gate)
+        results = [result] if result else []
+    if not results:
+        raise no_proxy_error(gate)
+    if request.lease_fields() is None:
+        proxy_pool.attach_cold_info(results)
+
+    return FastJSONResponse({
+        "code": 200,
+        "message": f"成功获取 {len(results)}/{request.count} 个代理",
+        "data": {
+            "count": len(results),
+            "proxies": results
+        }
+    })
 
 
 @app.post("/proxy/release")
-async def release_proxy(request: ReleaseRequest, background_tasks: BackgroundTasks):
+@timed("release")
+async def release_proxy(request: ReleaseRequest):
     """释放代理"""
     if not proxy_pool:
         raise HTTPException(status_code=503, detail="代理池未初始化")
 
-    # 先更新内存状态
+    # 更新内存状态和分数, 数据库由后写队列批量更新
     success = proxy_pool.release_proxy(
         proxy=request.proxy,
         task_id=request.task_id,
-        success=request.success
+        success=request.success,
+        response_time=request.response_time,
+        update_score=True
     )
 
     if not success:
         raise HTTPException(status_code=400, detail="代理释放失败")
 
-    # 异步更新CSV文件
-    score_delta = 2 if request.success else -1
-    background_tasks.add_task(
-        proxy_pool.save_proxy_update,
-        request.proxy,
-        score_delta,
-        request.response_time
-    )
-
     return {
         "code": 200,
         "message": "代理已释放",
@@ -780,6 +1693,7 @@ async def release_proxy(request: ReleaseRequest, background_tasks: BackgroundTas
 
 
 @app.post("/proxy/heartbeat")
+@timed("heartbeat")
 async def proxy_heartbeat(request: HealthCheckRequest):
     """代理心跳"""
     if not proxy_pool:
@@ -803,6 +1717,49 @@ async def proxy_heartbeat(request: HealthCheckRequest):
     }
 
 
+@app.post("/proxy/heartbeat_batch")
+@timed("heartbeat_batch")
+async def proxy_heartbeat_batch(request: HeartbeatBatchRequest):
+    """批量心跳, 一次加锁处理全部租约, 返回每一项是否成功"""
+    if not proxy_pool:
+        raise HTTPException(status_code=503, detail="代理池未初始化")
+
+    results = proxy_pool.heartbeat_many([(item.proxy, item.task_id) for item in request.items])
+
+    return {
+        "code": 200,
+        "message": f"心跳已更新 {sum(results)}/{len(results)}",
+        "data": {
+            "updated": sum(results),
+            "failed": [item.proxy for item, ok in zip(request.items, results) if not ok],
+            "results": results,
+            "heartbeat_time": time.time()
+        }
+    }
+
+
+@app.post("/proxy/release_batch")
+@timed("release_batch")
+async def release_proxy_batch(request: ReleaseBatchRequest):
+    """批量释放, 一次加锁处理全部租约, 返回每一项是否成功"""
+    if not proxy_pool:
+        raise HTTPException(status_code=503, detail="代理池未初始化")
+
+    results = proxy_pool.release_many([
+        (item.proxy, item.task_id, item.success, item.response_time) for item in request.items
+    ])
+
+    return {
+        "code": 200,
+        "message": f"代理已释放 {sum(results)}/{len(results)}",
+        "data": {
+            "released": sum(results),
+            "failed": [item.proxy for item, ok in zip(request.items, results) if not ok],
+            "results": results
+        }
+    }
+
+
 @app.get("/proxy/stats")
 async def get_proxy_stats():
     """获取代理池统计"""
@@ -810,6 +1767,8 @@ async def get_proxy_stats():
         raise HTTPException(status_code=503, detail="代理池未初始化")
 
     stats = proxy_pool.get_stats()
+    if gateway is not None:
+        stats["gateway"] = gateway.stats()
     return {
         "code": 200,
         "message": "成功获取统计信息",
@@ -817,6 +1776,53 @@ async def get_proxy_stats():
     }
 
 
+@app.get("/proxy/events")
+async def proxy_events(request: Request):
+    """
+    代理池事件流(Server-Sent Events)
+    连接后先发送一份完整统计(snapshot), 之后每隔一段时间推送合并后的事件和统计变化(pool)
+    """
+    if not proxy_pool:
+        raise HTTPException(status_code=503, detail="代理池未初始化")
+
+    events = proxy_pool.events
+    queue = events.subscribe()
+    if queue is None:
+        raise HTTPException(status_code=503, detail="事件订阅数已达上限")
+
+    async def stream():
+        try:
+            yield events.snapshot_message()
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    message = ": keepalive\n\n"  # 注释行, 防止代理服务器断开空闲连接
+                if await request.is_disconnected():
+                    break
+                yield message
+        finally:
+            events.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/proxy/memory")
+async def get_proxy_memory():
+    """获取代理池内存占用明细"""
+    if not proxy_pool:
+        raise HTTPException(status_code=503, detail="代理池未初始化")
+
+    # 需要遍历整个代理池, 放到线程池里执行, 不阻塞事件循环
+    memory = await asyncio.to_thread(proxy_pool.get_memory_usage)
+    return {
+        "code": 200,
+        "message": "成功获取内存占用",
+        "data": memory
+    }
+
+
 @app.get("/proxy/info_{proxy}")   # 前面的info_是为了防止与其他url混了,例如stats被识别为{proxy}
 async def get_proxy_info(proxy: str):
     """获取代理详细信息"""
@@ -840,14 +1846,15 @@ async def reload_proxies():
     if not proxy_pool:
         raise HTTPException(status_code=503, detail="代理池未初始化")
 
-    success = proxy_pool.reload_proxies()
+    # 在线程中构建新数据, 不阻塞事件循环和其他请求
+    success = await asyncio.to_thread(proxy_pool.reload_proxies)
 
     return {
         "code": 200 if success else 500,
         "message": "代理池已重新加载" if success else "重新加载失败",
         "data": {
             "success": success,
-            "total": proxy_pool.stats["total"]
+            "total": proxy_pool.stats_snapshot["total"]
         }
     }
 
@@ -858,16 +1865,34 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "proxies_loaded": proxy_pool.stats["total"] if proxy_pool else 0
+        "proxies_loaded": proxy_pool.stats_snapshot["total"] if proxy_pool else 0
     }
-def load_settings():
-    """加载端口"""
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指标"""
+    if not proxy_pool:
+        raise HTTPException(status_code=503, detail="代理池未初始化")
+
+    return PlainTextResponse(proxy_pool.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def load_api_config() -> Dict[str, Any]:
+    """加载api配置(附带 main.max_score)"""
     try:
-        with open("data/config.json", "r", encoding="utf-8") as f:
+        with open(os.path.join(BASE_DIR, "data/config.json"), "r", encoding="utf-8") as f:
             config = json.loads(f.read())
-        return config.get("api",{"host":"0.0.0.0"}).get("host","0.0.0.0"), config.get("api",{"port":8000}).get("port",8000)
+        api_config = dict(config.get("api", {}))
+        api_config.setdefault("max_score", config.get("main", {}).get("max_score", 100))
+        return api_config
     except:
-        return "0.0.0.0", 8000
+        return {}
+
+def load_settings():
+    """加载端口"""
+    api_config = load_api_config()
+    return api_config.get("host", "0.0.0.0"), api_config.get("port", 8000)
 
 def api_main():
     """主函数"""
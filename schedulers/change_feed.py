@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# API服务的数据库变更订阅
+
+import sqlite3
+import threading
+import logging
+from contextlib import nullcontext
+from typing import Callable, ContextManager, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """
+    proxies 表的变更订阅, 把CLI验证器写入的新结果增量同步到运行中的API服务
+    - 触发器把 proxies 的插入、删除和验证器的完整更新记录到 proxy_changelog(只记代理名)
+      API 自己的后写队列只增量更新 score/success_rate/avg_response_time/last_checked, 不会被记录
+    - 轮询线程先在写连接上看 PRAGMA data_version(只在其他连接提交时变化, API 自己的落盘不算),
+      数据库没被其他进程修改过就不查询
+    - 只读取有变化的代理行交给回调更新内存, 处理完的记录随后删除
+    - API 没有运行时触发器照样记录, 触发器只保留最新的 max_backlog 条;
+      启动时全量加载已经包含之前的变化, 积压的记录直接清空;
+      运行中发现记录被触发器截断(序号不连续)时改为全量重新加载(on_overflow)
+    """
+
+    # 验证器保存结果时一定会写的列(API的增量更新不包含这些列)
+    WATCH_COLUMNS = ("types", "support_china", "support_international", "transparent",
+                     "browser_valid", "detected_ip", "security_check_date")
+
+    # 交给回调的行, 列顺序和 API 加载代理时的热数据一致
+    ROW_COLUMNS = ("proxy, score, types, support_china, support_international, transparent, "
+                   "browser_valid, avg_response_time, success_rate, last_checked")
+
+    QUERY_CHUNK = 500  # IN 查询每次最多的参数个数
+
+    def __init__(self, db_manager, on_changes: Callable[[List[tuple], List[str]], object],
+                 interval: float = 3.0, batch_size: int = 1000,
+                 before_poll: Optional[Callable[[], object]] = None,
+                 max_backlog: int = 100000, on_overflow: Optional[Callable[[], object]] = None,
+                 pause_writes: Optional[Callable[[], ContextManager]] = None):
+        self.db_manager = db_manager
+        self.on_changes = on_changes  # (变化的代理行, 删除的代理)
+        self.interval = interval
+        self.batch_size = max(batch_size, 1)
+        self.before_poll = before_poll  # 读取变化前调用, 用于先把后写队列落盘
+        self.max_backlog = int(max_backlog)  # 变更表最多保留的记录数, 不大于0时不限制
+        self.on_overflow = on_overflow  # 变更记录被截断时调用, 用于全量重新加载
+        # 从读取变化行到回调完成期间暂停后写队列落盘, 回调里未落盘的变化正好是读取的行里没有的
+        self.pause_writes = pause_writes
+        self.last_seq = 0  # 已处理到的变更序号
+        self.applied = 0  # 累计应用的代理数
+
+        self._installed = False
+        self._data_version: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def install(self) -> bool:
+        """
+        创建变更表和触发器(重新创建, 让 max_backlog 的修改生效), 水位设为当前最新的记录并清空积压的记录
+        需要在全量加载代理之前调用, 之前的变化已经包含在全量数据里
+        """
+        watch = ", ".join(self.WATCH_COLUMNS)
+        # 每条记录写入后删除超出上限的最早记录(按主键范围删除, O(log n))
+        cap = (f"DELETE FROM proxy_changelog WHERE seq <= (SELECT MAX(seq) FROM proxy_changelog) - "
+               f"{self.max_backlog};" if self.max_backlog > 0 else "")
+        try:
+            with self.db_manager.get_writer() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                CREATE TABLE IF NOT EXISTS proxy_changelog (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    proxy TEXT NOT NULL,
+                    op TEXT NOT NULL
+                )
+                ''')
+                cursor.execute("DROP TRIGGER IF EXISTS proxies_changelog_insert")
+                cursor.execute(f'''
+                CREATE TRIGGER proxies_changelog_insert AFTER INSERT ON proxies
+                BEGIN
+                    INSERT INTO proxy_changelog (proxy, op) VALUES (NEW.proxy, 'upsert');
+                    {cap}
+                END
+                ''')
+                cursor.execute("DROP TRIGGER IF EXISTS proxies_changelog_update")
+                cursor.execute(f'''
+                CREATE TRIGGER proxies_changelog_update AFTER UPDATE OF {watch} ON proxies
+                BEGIN
+                    INSERT INTO proxy_changelog (proxy, op) VALUES (NEW.proxy, 'upsert');
+                    {cap}
+                END
+                ''')
+                cursor.execute("DROP TRIGGER IF EXISTS proxies_changelog_delete")
+                cursor.execute(f'''
+                CREATE TRIGGER proxies_changelog_delete AFTER DELETE ON proxies
+                BEGIN
+                    INSERT INTO proxy_changelog (proxy, op) VALUES (OLD.proxy, 'delete');
+                    {cap}
+                END
+                ''')
+                self.last_seq = self._current_seq(cursor)
+                cursor.execute("DELETE FROM proxy_changelog WHERE seq <= ?", (self.last_seq,))
+                conn.commit()
+            self._installed = True
+        except sqlite3.Error as e:
+            logger.error(f"创建变更记录触发器失败: {e}")
+            self._installed = False
+        return self._installed
+
+    @staticmethod
+    def _current_seq(cursor: sqlite3.Cursor) -> int:
+        """最后分配的变更序号(AUTOINCREMENT 的计数, 记录被删除后也不会回退)"""
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'proxy_changelog'")
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM proxy_changelog")
+        return cursor.fetchone()[0]
+
+    def poll(self) -> int:
+        """处理所有未处理的变化, 返回应用的代理数"""
+        if not self._installed:
+            return 0
+
+        # 写连接自己提交(后写队列落盘、清理变更记录)不改变它看到的 data_version
+        with self.db_manager.get_writer() as conn:
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return 0
+
+        if self.before_poll is not None:
+            self.before_poll()
+
+        total = 0
+        overflow = False
+        while True:
+            with self._paused(), self.db_manager.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                cursor.execute(
+                    "SELECT seq, proxy, op FROM proxy_changelog WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (self.last_seq, self.batch_size)
+                )
+                entries = cursor.fetchall()
+                if not entries:
+                    break
+                if entries[0][0] > self.last_seq + 1 and self.on_overflow is not None:
+                    # 积压超过 max_backlog, 未处理的记录已被触发器删除, 增量同步不完整
+                    self.last_seq = self._current_seq(cursor)
+                    overflow = True
+                    break
+
+                # 同一代理多次变化以最后一次为准
+                ops = {}
+                for _, proxy, op in entries:
+                    ops[proxy] = op
+                changed = [proxy for proxy, op in ops.items() if op != "delete"]
+                deleted = [proxy for proxy, op in ops.items() if op == "delete"]
+
+                rows = []
+                for i in range(0, len(changed), self.QUERY_CHUNK):
+                    chunk = changed[i:i + self.QUERY_CHUNK]
+                    placeholders = ", ".join("?" * len(chunk))
+                    cursor.execute(f"SELECT {self.ROW_COLUMNS} FROM proxies WHERE proxy IN ({placeholders})",
+                                   chunk)
+                    rows.extend(cursor.fetchall())
+
+                self.on_changes(rows, deleted)
+            self.last_seq = entries[-1][0]
+            total += len(ops)
+            self._prune()
+
+            if len(entries) < self.batch_size:
+                break
+
+        if overflow:
+            logger.warning("数据库变更记录积压超过上限, 全量重新加载代理池")
+            self._prune()
+            self.on_overflow()
+
+        self._data_version = version  # 出错时不更新, 下次重新检查
+        if total:
+            self.applied += total
+            logger.info(f"从数据库同步了 {total} 个代理的变化")
+        return total
+
+    def _paused(self) -> ContextManager:
+        return self.pause_writes() if self.pause_writes is not None else nullcontext()
+
+    def _prune(self):
+        """删除已处理的变更记录"""
+        try:
+            with self.db_manager.get_writer() as conn:
+                conn.execute("DELETE FROM proxy_changelog WHERE seq <= ?", (self.last_seq,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"清理变更记录失败: {e}")
+
+    def start(self):
+        """启动轮询线程, interval 不大于0时不启动"""
+        if not self._installed or self.interval <= 0 or self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"同步数据库变化失败: {e}")
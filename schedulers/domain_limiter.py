@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# 按目标域名限制每个代理的请求速率
+
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+class DomainRateLimiter:
+    """
+    按 (代理, 目标域名) 的令牌桶
+    - 每个桶只存一个浮点数: 令牌刚好用完的理论时间 TAT(GCRA 形式的令牌桶),
+      令牌按经过的时间惰性补充, 不需要定时器; TAT 已经过去的桶是满的, 可以直接删掉
+    - 按域名分表 {域名: {代理: TAT}}, 代理字符串复用代理记录里的对象
+    - 容量为 burst, 每 interval 秒补充一个令牌; 每分配一次租约消耗一个令牌
+    - 每个域名另有一个 (有令牌的时间, 代理) 的最小堆(惰性删除), 用来给出整个域名最早有令牌的时间,
+      拿不到代理又没有检查到被限速的空闲代理(比如快有令牌的代理都被占用)时告诉客户端何时重试
+    调用方需持有代理池的锁
+    """
+
+    MAX_DOMAIN_LENGTH = 253
+
+    def __init__(self, rate_per_minute: float = 0, burst: int = 1):
+        self.enabled = rate_per_minute > 0
+        self.interval = 60.0 / rate_per_minute if self.enabled else 0.0
+        self.burst = max(1, int(burst))
+        # 桶里还剩 1 个令牌时 TAT 比现在晚 (burst - 1) 个间隔
+        self.tolerance = (self.burst - 1) * self.interval
+        self._tables: Dict[str, Dict[str, float]] = {}
+        self._ready: Dict[str, List[Tuple[float, str]]] = {}
+
+    def __len__(self):
+        """正在补充令牌的桶数(满的桶不占内存)"""
+        return sum(len(table) for table in self._tables.values())
+
+    @classmethod
+    def normalize(cls, domain: Optional[str]) -> Optional[str]:
+        """统一域名写法(小写, 去掉协议、端口和路径), 为空时返回 None"""
+        if not domain:
+            return None
+        domain = domain.strip().lower()
+        if "://" in domain:
+            domain = urlsplit(domain).hostname or ""
+        else:
+            domain = domain.split("/", 1)[0].rsplit("@", 1)[-1]
+            if not domain.startswith("["):
+                domain = domain.split(":", 1)[0]
+        domain = domain.rstrip(".")
+        if not domain or len(domain) > cls.MAX_DOMAIN_LENGTH:
+            return None
+        return domain
+
+    def available_at(self, proxy: str, domain: str, now: float) -> float:
+        """代理对该域名有令牌的最早时间, 不晚于 now 表示现在就有"""
+        table = self._tables.get(domain)
+        tat = table.get(proxy) if table else None
+        return now if tat is None else tat - self.tolerance
+
+    def consume(self, proxy: str, domain: str, now: float):
+        """消耗一个令牌(调用方已确认有令牌)"""
+        table = self._tables.get(domain)
+        if table is None:
+            table = self._tables[domain] = {}
+        tat = table.get(proxy)
+        tat = table[proxy] = (now if tat is None or tat < now else tat) + self.interval
+        if tat - self.tolerance > now:
+            heapq.heappush(self._ready.setdefault(domain, []), (tat - self.tolerance, proxy))
+
+    def earliest(self, domain: str, now: float) -> Optional[float]:
+        """
+        该域名下令牌用完的代理中最早有令牌的时间, 没有这样的代理时返回 None
+        不区分代理的类型、状态等, 只作为重试时间的参考
+        """
+        heap = self._ready.get(domain)
+        table = self._tables.get(domain)
+        while heap:
+            ready, proxy = heap[0]
+            tat = table.get(proxy) if table else None
+            # 已经有令牌的, 或者之后又消耗过令牌(堆里有更新的一项)的, 都是过期的项
+            if ready <= now or tat is None or tat - self.tolerance != ready:
+                heapq.heappop(heap)
+                continue
+            return ready
+        return None
+
+    def gate(self, domain: Optional[str], now: Optional[float] = None) -> Optional["DomainGate"]:
+        """获取请求用的判断函数, 没有域名或未启用限速时返回 None"""
+        domain = self.normalize(domain)
+        if not self.enabled or domain is None:
+            return None
+        return DomainGate(self, domain, now)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """删除已经补满的桶和空的域名表, 返回删除的桶数"""
+        now = now or time.time()
+        removed = 0
+        for domain in list(self._tables):
+            table = self._tables[domain]
+            full = [proxy for proxy, tat in table.items() if tat <= now]
+            for proxy in full:
+                del table[proxy]
+            removed += len(full)
+            if not table:
+                del self._tables[domain]
+
+        # 重建最早时间堆, 去掉过期的项
+        for domain in list(self._ready):
+            table = self._tables.get(domain)
+            heap = [(tat - self.tolerance, proxy) for proxy, tat in table.items()
+                    if tat - self.tolerance > now] if table else []
+            if heap:
+                heapq.heapify(heap)
+                self._ready[domain] = heap
+            else:
+                del self._ready[domain]
+        return removed
+
+
+class DomainGate:
+    """
+    一次获取请求对某个域名的令牌判断, 作为 IdleProxyIndex.select 的 accept 使用
+    被拒绝的代理中最早有令牌的时间记在 earliest, 没有拿到代理时用来告诉客户端何时重试(见 settle)
+    """
+
+    __slots__ = ("limiter", "domain", "now", "earliest")
+
+    def __init__(self, limiter: DomainRateLimiter, domain: str, now: Optional[float] = None):
+        self.limiter = limiter
+        self.domain = domain
+        self.now = now or time.time()
+        self.earliest: Optional[float] = None
+
+    def __call__(self, proxy: str) -> bool:
+        ready = self.limiter.available_at(proxy, self.domain, self.now)
+        if ready <= self.now:
+            return True
+        if self.earliest is None or ready < self.earliest:
+            self.earliest = ready
+        return False
+
+    def consume(self, proxy: str):
+        self.limiter.consume(proxy, self.domain, self.now)
+
+    def settle(self):
+        """
+        没有拿到代理时调用(调用方需持有锁): earliest 只包含检查过的空闲代理,
+        再和整个域名最早有令牌的时间取较早的, 快有令牌的代理都被占用时也能给出重试时间
+        """
+        ready = self.limiter.earliest(self.domain, self.now)
+        if ready is not None and (self.earliest is None or ready < self.earliest):
+            self.earliest = ready
+
+    def refresh(self):
+        """重新判断前(比如排队等待一段时间后)更新当前时间, 清空上次的结果"""
+        self.now = time.time()
+        self.earliest = None
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# 到期时间最小堆
+
+import heapq
+from typing import Dict, Hashable, List, Optional
+
+
+class ExpiryHeap:
+    """
+    到期时间最小堆
+    - schedule 延后到期时间只改字典(O(1)), 堆里的旧条目弹出时再按新时间放回
+    - cancel 只删字典, 堆里的条目惰性失效, 失效条目过多时整体重建
+    - pop_expired 只处理真正到期的键
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []  # (入堆时的到期时间, key)
+        # key -> [当前到期时间, 堆中有效条目的到期时间]
+        self._entries: Dict[Hashable, List[float]] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def schedule(self, key: Hashable, deadline: float):
+        """设置(或刷新)键的到期时间"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [deadline, deadline]
+            heapq.heappush(self._heap, (deadline, key))
+            return
+
+        entry[0] = deadline
+        if deadline < entry[1]:
+            # 提前到期需要重新入堆, 旧条目弹出时会被识别为失效
+            entry[1] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+
+    def cancel(self, key: Hashable) -> bool:
+        if self._entries.pop(key, None) is None:
+            return False
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._rebuild()
+        return True
+
+    def keys(self):
+        """所有已安排到期时间的键"""
+        return self._entries.keys()
+
+    def deadline_of(self, key: Hashable) -> Optional[float]:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def next_deadline(self) -> Optional[float]:
+        """最早的入堆时间(可能早于真实到期时间, 只用于决定下次检查的时间)"""
+        return self._heap[0][0] if self._heap else None
+
+    def clear(self):
+        self._heap.clear()
+        self._entries.clear()
+
+    def pop_expired(self, now: float, limit: Optional[int] = None) -> List[Hashable]:
+        """弹出所有(最多 limit 个)到期的键"""
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            if limit is not None and len(expired) >= limit:
+                break
+            deadline, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != deadline:
+                # 已取消或已重新入堆
+                continue
+            if entry[0] > now:
+                # 到期时间被延后了, 按新时间放回
+                entry[1] = entry[0]
+                heapq.heappush(heap, (entry[0], key))
+                continue
+            del self._entries[key]
+            expired.append(key)
+        return expired
+
+    def _rebuild(self):
+        heap = []
+        for key, entry in self._entries.items():
+            entry[1] = entry[0]
+            heap.append((entry[0], key))
+        heapq.heapify(heap)
+        self._heap = heap
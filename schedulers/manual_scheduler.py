@@ -2,6 +2,7 @@
 from typing import List, Dict, Any, Optional
 from core.config import ConfigManager
 from storage.database import DatabaseManager
+from utils.score_buckets import ScoreBuckets
 
 
 class ManualScheduler:
@@ -18,7 +19,9 @@ class ManualScheduler:
         """
         proxies, proxy_info = self.database.load_proxies_from_db()
 
-        filtered_proxies = []  # 存储 (score, proxy, info, passed_count)
+        # 按分数分桶, 取前num个时不需要整体排序
+        filtered_proxies = ScoreBuckets(self.config.get("main.max_score", 100))
+        filtered_info = {}  # proxy -> (score, info, passed_count)
         for proxy, score in proxies.items():
             info = proxy_info.get(proxy, {})
 
@@ -54,13 +57,14 @@ class ManualScheduler:
             if min_security_passed is not None and passed_count < min_security_passed:
                 continue
 
-            filtered_proxies.append((score, proxy, info, passed_count))
-
-        # 按分数降序排序
-        filtered_proxies.sort(key=lambda x: x[0], reverse=True)
+            filtered_proxies.add(proxy, score)
+            filtered_info[proxy] = (score, info, passed_count)
 
         result = []
-        for score, proxy, info, passed in filtered_proxies[:num]:
+        for _, proxy in filtered_proxies.iter_desc():
+            if len(result) >= num:
+                break
+            score, info, passed = filtered_info[proxy]
             actual_type = info.get("types", ["http"])[0] if info.get("types") else "http"
             china = info.get("support", {}).get("china", False)
             international = info.get("support", {}).get("international", False)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# 代理池事件推送(Server-Sent Events)
+
+import asyncio
+import json
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PoolEventBus:
+    """
+    代理池事件总线
+    - 写路径调用 publish 记录事件(任意线程), 没有订阅者时直接返回
+    - 事件在服务端合并: 按类型计数, 同一代理只保留最后一次事件, 统计只发送变化的字段
+    - run() 在事件循环中每隔 interval 把合并后的事件编码一次, 分发给所有订阅者
+    - 订阅者处理不过来(队列满)时清空它的队列, 改发一份完整快照让它重新同步
+    """
+
+    MAX_PROXY_EVENTS = 200  # 每条消息最多列出的代理事件, 超出的只计数
+    QUEUE_SIZE = 64  # 每个订阅者最多积压的消息数
+
+    def __init__(self, stats_source: Callable[[], Dict[str, Any]], interval_ms: int = 500,
+                 max_subscribers: int = 100):
+        self.stats_source = stats_source
+        self.interval = max(interval_ms, 50) / 1000
+        self.max_subscribers = max_subscribers
+        self.active = False  # 有订阅者时才记录事件
+
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._proxies: Dict[str, Tuple[str, Optional[str]]] = {}  # proxy -> (事件类型, 任务ID)
+        self._dropped = 0
+
+        self._subscribers: List[asyncio.Queue] = []  # 只在事件循环线程中访问
+        self._last_stats: Optional[Dict[str, Any]] = None
+        self._seq = 0
+
+    def publish(self, kind: str, proxy: Optional[str] = None, task_id: Optional[str] = None):
+        """记录一个事件(acquire/release/quarantine/recover/dead/update/remove/reload)"""
+        if not self.active:
+            return
+        with self._lock:
+            self._counts[kind] = self._counts.get(kind, 0) + 1
+            if proxy is None:
+                return
+            if proxy in self._proxies:
+                # 移到末尾, 保持按最后一次事件的先后排列
+                del self._proxies[proxy]
+            elif len(self._proxies) >= self.MAX_PROXY_EVENTS:
+                self._dropped += 1
+                return
+            self._proxies[proxy] = (kind, task_id)
+
+    def subscribe(self) -> Optional[asyncio.Queue]:
+        """新增订阅者, 超过上限返回 None"""
+        if len(self._subscribers) >= self.max_subscribers:
+            return None
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        if not self._subscribers:
+            # 第一个订阅者连接时以当前统计为基准, 它会先收到完整快照
+            self._last_stats = self.stats_source()
+        self._subscribers.append(queue)
+        self.active = True
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+        if not self._subscribers:
+            self.active = False
+            self._take()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    @staticmethod
+    def format(event: str, payload: Dict[str, Any]) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    def snapshot_message(self) -> str:
+        """完整统计快照(新订阅者连接时和重新同步时发送)"""
+        return self.format("snapshot", {
+            "seq": self._seq,
+            "time": datetime.now().isoformat(),
+            "stats": self.stats_source()
+        })
+
+    def _take(self) -> Tuple[Dict[str, int], Dict[str, Tuple[str, Optional[str]]], int]:
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            proxies, self._proxies = self._proxies, {}
+            dropped, self._dropped = self._dropped, 0
+        return counts, proxies, dropped
+
+    def collect(self) -> Optional[str]:
+        """合并这段时间的事件和统计变化, 没有变化时返回 None"""
+        counts, proxies, dropped = self._take()
+
+        stats = self.stats_source()
+        delta = {}
+        if stats is not self._last_stats:
+            last = self._last_stats or {}
+            delta = {key: value for key, value in stats.items() if last.get(key) != value}
+            self._last_stats = stats
+
+        if not counts and not delta:
+            return None
+
+        self._seq += 1
+        return self.format("pool", {
+            "seq": self._seq,
+            "time": datetime.now().isoformat(),
+            "counts": counts,
+            "proxies": [{"proxy": proxy, "event": kind, "task_id": task_id}
+                        for proxy, (kind, task_id) in proxies.items()],
+            "dropped": dropped,
+            "stats": delta
+        })
+
+    def broadcast(self, message: str):
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # 订阅者跟不上, 丢掉积压的消息, 用完整快照重新同步
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot_message())
+
+    async def run(self):
+        """定期合并并分发事件(在事件循环中作为后台任务运行)"""
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._subscribers:
+                continue
+            try:
+                message = self.collect()
+                if message is not None:
+                    self.broadcast(message)
+            except Exception as e:
+                logger.error(f"推送代理池事件失败: {e}")
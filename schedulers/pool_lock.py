@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# 代理池的带统计可重入锁
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class InstrumentedRLock:
+    """
+    带统计的可重入锁, 兼容 `with lock:` 写法
+    - 统计最外层加锁的等待时间和持有时间
+    - version 是 seqlock 风格的版本号: 持有期间为奇数, 释放后为偶数,
+      只读路径可以不加锁读取, 前后版本号相同且为偶数说明读到的是一致的数据
+    - on_release 在最外层释放前(仍持有锁时)调用, 用于发布只读快照
+    - observe_wait/observe_hold 在持有锁时接收每次的等待/持有时间(秒), 用于直方图
+    """
+
+    def __init__(self, on_release: Optional[Callable[[], None]] = None,
+                 observe_wait: Optional[Callable[[float], None]] = None,
+                 observe_hold: Optional[Callable[[float], None]] = None):
+        self._lock = threading.RLock()
+        self._depth = 0  # 只有持有者会修改
+        self._hold_start = 0.0
+        self.version = 0
+        self.on_release = on_release
+        self.observe_wait = observe_wait
+        self.observe_hold = observe_hold
+
+        # 统计
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        if self._depth == 0:
+            now = time.perf_counter()
+            wait = now - start
+            self.acquisitions += 1
+            self.wait_total += wait
+            if wait > 0.0001:
+                self.contended += 1
+            if wait > self.wait_max:
+                self.wait_max = wait
+            if self.observe_wait is not None:
+                self.observe_wait(wait)
+            self._hold_start = now
+            self.version += 1
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            if self.on_release is not None:
+                self.on_release()
+            hold = time.perf_counter() - self._hold_start
+            self.hold_total += hold
+            if hold > self.hold_max:
+                self.hold_max = hold
+            if self.observe_hold is not None:
+                self.observe_hold(hold)
+            self.version += 1
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """锁竞争统计(时间单位: 毫秒)"""
+        count = self.acquisitions or 1
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_total_ms": round(self.wait_total * 1000, 3),
+            "wait_avg_ms": round(self.wait_total * 1000 / count, 4),
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "hold_total_ms": round(self.hold_total * 1000, 3),
+            "hold_avg_ms": round(self.hold_total * 1000 / count, 4),
+            "hold_max_ms": round(self.hold_max * 1000, 3)
+        }
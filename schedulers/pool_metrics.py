@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# API服务的 Prometheus 指标
+
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+# 直方图分桶上限(秒 / 条)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOCK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+FLUSH_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """
+    固定分桶的直方图, 分桶计数在创建时分配好, observe 只做整数累加
+    不加锁: 调用方保证同一个直方图只在一个线程(或持有同一把锁时)更新
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Iterable[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = "") -> List[str]:
+        """输出 Prometheus 文本格式的 _bucket/_sum/_count 行"""
+        prefix = labels + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative + self.counts[-1]}')
+        suffix = "{" + labels + "}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PoolMetrics:
+    """
+    代理池指标
+    - 接口耗时和失败次数(按操作)
+    - 代理池锁的等待/持有时间
+    - 后写队列落盘耗时、每批条数和等待落盘的记录数
+    - 获取失败次数(按类型、地区和额外筛选条件), 因目标域名限速失败的次数
+    所有计数器和直方图都预先分配, 记录时不创建对象;
+    状态分布等 gauge 在抓取时由调用方传入
+    """
+
+    OPERATIONS = ("acquire", "acquire_batch", "release", "release_batch", "heartbeat", "heartbeat_batch")
+    # 获取失败的额外筛选条件, 下标: 有 min_score 为 1, 有 exclude_proxies 为 2
+    MISS_FILTERS = ("none", "min_score", "exclude", "min_score+exclude")
+    MAX_MISS_KEYS = 256  # (类型, 地区) 组合的上限, 超出的计入 other, 防止任意参数撑大指标
+
+    def __init__(self):
+        self.requests: Dict[str, Histogram] = {op: Histogram(LATENCY_BUCKETS) for op in self.OPERATIONS}
+        self.failures: Dict[str, int] = {op: 0 for op in self.OPERATIONS}
+        self.lock_wait = Histogram(LOCK_BUCKETS)
+        self.lock_hold = Histogram(LOCK_BUCKETS)
+        self.flush_latency = Histogram(FLUSH_BUCKETS)
+        self.flush_rows = Histogram(BATCH_BUCKETS)
+        self.acquire_misses: Dict[Tuple[str, str], List[int]] = {}
+        self.rate_limited = 0  # 空闲代理都因目标域名限速被跳过的获取请求
+        self._other_key = ("other", "other")
+
+    def observe_request(self, operation: str, seconds: float, failed: bool):
+        """记录一次接口调用(在事件循环线程中调用)"""
+        self.requests[operation].observe(seconds)
+        if failed:
+            self.failures[operation] += 1
+
+    def observe_flush(self, seconds: float, rows: int):
+        """记录一次落盘(后写队列的落盘锁内调用)"""
+        self.flush_latency.observe(seconds)
+        self.flush_rows.observe(rows)
+
+    def record_miss(self, key: Tuple[str, str], min_score: int, exclude: bool):
+        """记录一次没有拿到代理的获取请求(调用方需持有代理池的锁)"""
+        counts = self.acquire_misses.get(key)
+        if counts is None:
+            if len(self.acquire_misses) >= self.MAX_MISS_KEYS:
+                key = self._other_key
+            counts = self.acquire_misses.setdefault(key, [0] * len(self.MISS_FILTERS))
+        counts[(min_score > 0) | (exclude << 1)] += 1
+
+    def render(self, status_by_type: Dict[str, Dict[str, int]], status_by_region: Dict[str, Dict[str, int]],
+               totals: Dict[str, int], waiters: int, lock_contended: int, pending_writes: int = 0) -> str:
+        """
+        输出 Prometheus 文本格式
+        status_by_type/status_by_region: {类型或地区: {状态: 数量}}, totals: {状态: 数量},
+        pending_writes: 后写队列中等待落盘的记录数(状态和分数分别计数)
+        """
+        lines = [
+            "# HELP proxy_pool_request_duration_seconds API request latency by operation",
+            "# TYPE proxy_pool_request_duration_seconds histogram",
+        ]
+        for op, histogram in self.requests.items():
+            lines.extend(histogram.render("proxy_pool_request_duration_seconds", f'operation="{op}"'))
+
+        lines.append("# HELP proxy_pool_request_failures_total API requests that returned an error")
+        lines.append("# TYPE proxy_pool_request_failures_total counter")
+        for op, count in self.failures.items():
+            lines.append(f'proxy_pool_request_failures_total{{operation="{op}"}} {count}')
+
+        lines.append("# HELP proxy_pool_acquire_misses_total Acquire requests that found no proxy")
+        lines.append("# TYPE proxy_pool_acquire_misses_total counter")
+        for (proxy_type, region), counts in list(self.acquire_misses.items()):
+            for filter_name, count in zip(self.MISS_FILTERS, counts):
+                if count:
+                    lines.append(f'proxy_pool_acquire_misses_total{{type="{_escape(proxy_type)}",'
+                                 f'region="{_escape(region)}",filter="{filter_name}"}} {count}')
+
+        lines.append("# HELP proxy_pool_acquire_rate_limited_total Acquire requests refused by target-domain rate limits")
+        lines.append("# TYPE proxy_pool_acquire_rate_limited_total counter")
+        lines.append(f"proxy_pool_acquire_rate_limited_total {self.rate_limited}")
+
+        lines.append("# HELP proxy_pool_lock_wait_seconds Time spent waiting for the pool lock")
+        lines.append("# TYPE proxy_pool_lock_wait_seconds histogram")
+        lines.extend(self.lock_wait.render("proxy_pool_lock_wait_seconds"))
+        lines.append("# HELP proxy_pool_lock_hold_seconds Time the pool lock was held")
+        lines.append("# TYPE proxy_pool_lock_hold_seconds histogram")
+        lines.extend(self.lock_hold.render("proxy_pool_lock_hold_seconds"))
+        lines.append("# HELP proxy_pool_lock_contended_total Lock acquisitions that had to wait")
+        lines.append("# TYPE proxy_pool_lock_contended_total counter")
+        lines.append(f"proxy_pool_lock_contended_total {lock_contended}")
+
+        lines.append("# HELP proxy_pool_db_flush_duration_seconds Write-behind flush latency")
+        lines.append("# TYPE proxy_pool_db_flush_duration_seconds histogram")
+        lines.extend(self.flush_latency.render("proxy_pool_db_flush_duration_seconds"))
+        lines.append("# HELP proxy_pool_db_flush_rows Rows written per write-behind flush")
+        lines.append("# TYPE proxy_pool_db_flush_rows histogram")
+        lines.extend(self.flush_rows.render("proxy_pool_db_flush_rows"))
+        lines.append("# HELP proxy_pool_db_pending_writes Records waiting in the write-behind queue")
+        lines.append("# TYPE proxy_pool_db_pending_writes gauge")
+        lines.append(f"proxy_pool_db_pending_writes {pending_writes}")
+
+        lines.append("# HELP proxy_pool_proxies Proxies in the pool by status")
+        lines.append("# TYPE proxy_pool_proxies gauge")
+        for status, count in totals.items():
+            lines.append(f'proxy_pool_proxies{{status="{status}"}} {count}')
+        lines.append("# HELP proxy_pool_proxies_by_type Proxies by supported type and status")
+        lines.append("# TYPE proxy_pool_proxies_by_type gauge")
+        for proxy_type, statuses in status_by_type.items():
+            for status, count in statuses.items():
+                lines.append(f'proxy_pool_proxies_by_type{{type="{_escape(proxy_type)}",'
+                             f'status="{status}"}} {count}')
+        lines.append("# HELP proxy_pool_proxies_by_region Proxies by supported region and status")
+        lines.append("# TYPE proxy_pool_proxies_by_region gauge")
+        for region, statuses in status_by_region.items():
+            for status, count in statuses.items():
+                lines.append(f'proxy_pool_proxies_by_region{{region="{region}",status="{status}"}} {count}')
+
+        lines.append("# HELP proxy_pool_acquire_waiters Acquire requests waiting for a proxy")
+        lines.append("# TYPE proxy_pool_acquire_waiters gauge")
+        lines.append(f"proxy_pool_acquire_waiters {waiters}")
+        return "\n".join(lines) + "\n"
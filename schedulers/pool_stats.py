@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# 代理池统计: 增量计数器和内存占用分析
+
+import sys
+import tracemalloc
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class PoolCounters:
+    """
+    代理池分维度计数器
+    每次状态/分数变化时增量更新, 读取统计是 O(1), 不需要遍历代理池
+    """
+
+    STATUSES = ("idle", "busy", "dead", "quarantine")
+    STATUS_INDEX = {status: i for i, status in enumerate(STATUSES)}
+    REGIONS = ("china", "international")
+    SCORE_BAND_WIDTH = 10
+
+    def __init__(self, max_score: int = 100):
+        self.max_score = max_score
+        self.band_labels = []
+        for low in range(0, max_score + 1, self.SCORE_BAND_WIDTH):
+            high = min(low + self.SCORE_BAND_WIDTH - 1, max_score)
+            if high + 1 == max_score:
+                high = max_score  # 满分并入最后一档
+            self.band_labels.append(f"{low}-{high}")
+            if high == max_score:
+                break
+        self.reset()
+
+    def reset(self):
+        self.total = 0
+        self.status: Dict[str, int] = {s: 0 for s in self.STATUSES}
+        self.types: Dict[str, int] = {}
+        self.regions: Dict[str, int] = {r: 0 for r in self.REGIONS}
+        self.score_bands = [0] * len(self.band_labels)
+        self.browser_valid = 0
+        self.transparent = 0
+        # 按类型/地区再按状态细分, 值按 STATUSES 的顺序排列
+        self.type_status: Dict[str, List[int]] = {}
+        self.region_status: Dict[str, List[int]] = {r: [0] * len(self.STATUSES) for r in self.REGIONS}
+
+    def _band(self, score: int) -> int:
+        score = min(max(int(score), 0), self.max_score)
+        return min(score // self.SCORE_BAND_WIDTH, len(self.band_labels) - 1)
+
+    def _apply(self, sign: int, status: str, score: int, types: Iterable[str],
+               support: Dict[str, bool], browser_valid: bool, transparent: bool):
+        self.total += sign
+        if status in self.status:
+            self.status[status] += sign
+        index = self.STATUS_INDEX.get(status)
+        for ptype in types:
+            self.types[ptype] = self.types.get(ptype, 0) + sign
+            if index is not None:
+                counts = self.type_status.get(ptype)
+                if counts is None:
+                    counts = self.type_status[ptype] = [0] * len(self.STATUSES)
+                counts[index] += sign
+        for region in self.REGIONS:
+            if support.get(region):
+                self.regions[region] += sign
+                if index is not None:
+                    self.region_status[region][index] += sign
+        self.score_bands[self._band(score)] += sign
+        if browser_valid:
+            self.browser_valid += sign
+        if transparent:
+            self.transparent += sign
+
+    def add_proxy(self, status: str, score: int, types: Iterable[str], support: Dict[str, bool],
+                  browser_valid: bool = False, transparent: bool = False):
+        self._apply(1, status, score, types, support, browser_valid, transparent)
+
+    def remove_proxy(self, status: str, score: int, types: Iterable[str], support: Dict[str, bool],
+                     browser_valid: bool = False, transparent: bool = False):
+        self._apply(-1, status, score, types, support, browser_valid, transparent)
+
+    def change_status(self, old: str, new: str, types: Iterable[str] = (), regions: Iterable[str] = ()):
+        """状态变化, 传入代理的类型和支持的地区时同时更新细分计数"""
+        if old == new:
+            return
+        if old in self.status:
+            self.status[old] -= 1
+        if new in self.status:
+            self.status[new] += 1
+        old_index, new_index = self.STATUS_INDEX.get(old), self.STATUS_INDEX.get(new)
+        for ptype in types:
+            self._shift(self.type_status.get(ptype), old_index, new_index)
+        for region in regions:
+            self._shift(self.region_status.get(region), old_index, new_index)
+
+    @staticmethod
+    def _shift(counts: Optional[List[int]], old_index: Optional[int], new_index: Optional[int]):
+        if counts is None:
+            return
+        if old_index is not None:
+            counts[old_index] -= 1
+        if new_index is not None:
+            counts[new_index] += 1
+
+    def change_score(self, old: int, new: int):
+        old_band, new_band = self._band(old), self._band(new)
+        if old_band != new_band:
+            self.score_bands[old_band] -= 1
+            self.score_bands[new_band] += 1
+
+    def status_breakdown(self) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[str, int]]]:
+        """按类型和按地区的各状态数量(调用方需持有锁)"""
+        by_type = {ptype: dict(zip(self.STATUSES, counts)) for ptype, counts in self.type_status.items()}
+        by_region = {region: dict(zip(self.STATUSES, counts)) for region, counts in self.region_status.items()}
+        return by_type, by_region
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            **self.status,
+            "by_type": dict(self.types),
+            "by_region": dict(self.regions),
+            "by_score": dict(zip(self.band_labels, self.score_bands)),
+            "browser_valid": self.browser_valid,
+            "transparent": self.transparent
+        }
+
+
+def deep_getsizeof(obj: Any, seen: Optional[set] = None, lock: Optional[Any] = None, chunk: int = 500) -> int:
+    """
+    计算对象及其引用的对象占用的内存(字节), 共享的对象只计算一次
+    用显式栈遍历; 传入 lock 时每处理 chunk 个对象释放一次锁, 遍历大结构时不会长时间阻塞其他线程
+    (遍历期间结构可能被修改, 结果是近似值)
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        with lock if lock is not None else nullcontext():
+            for _ in range(chunk):
+                if not stack:
+                    break
+                obj = stack.pop()
+                obj_id = id(obj)
+                if obj_id in seen:
+                    continue
+                seen.add(obj_id)
+
+                size += sys.getsizeof(obj)
+                if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+                    continue
+                if isinstance(obj, dict):
+                    stack.extend(obj.keys())
+                    stack.extend(obj.values())
+                elif isinstance(obj, (list, tuple, set, frozenset)):
+                    stack.extend(obj)
+                else:
+                    if hasattr(obj, "__dict__"):
+                        stack.append(vars(obj))
+                    for cls in type(obj).__mro__:
+                        for slot in getattr(cls, "__slots__", ()):
+                            if hasattr(obj, slot):
+                                stack.append(getattr(obj, slot))
+    return size
+
+
+def tracemalloc_summary(limit: int = 10) -> Optional[Dict[str, Any]]:
+    """tracemalloc 统计(未开启追踪时返回 None)"""
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    top = tracemalloc.take_snapshot().statistics("filename")[:limit]
+    return {
+        "current": current,
+        "peak": peak,
+        "top": [{"file": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in top]
+    }
@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+# 内置的轮换转发代理网关(HTTP / HTTPS CONNECT / SOCKS5)
+
+import asyncio
+import base64
+import binascii
+import ipaddress
+import itertools
+import logging
+import socket
+import struct
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    from schedulers.api_server import ProxyPoolManager
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayError(Exception):
+    """没法为客户端建立连接(请求格式错误、认证失败、没有可用的上游)"""
+
+    def __init__(self, message: str, http_status: int = 502, socks_reply: int = 0x01):
+        super().__init__(message)
+        self.http_status = http_status
+        self.socks_reply = socks_reply
+
+
+class TargetRefused(GatewayError):
+    """上游代理正常应答, 但目标拒绝连接或不可达(不是上游的问题, 不换上游重试)"""
+
+
+class UpstreamConnection:
+    """通过某个上游代理建立好的连接, 以及它在代理池中的租约"""
+
+    __slots__ = ("proxy", "task_id", "reader", "writer", "forward", "latency")
+
+    def __init__(self, proxy: str, task_id: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 forward: bool, latency: float):
+        self.proxy = proxy
+        self.task_id = task_id
+        self.reader = reader
+        self.writer = writer
+        self.forward = forward  # 为真时上游是 HTTP 代理, 普通请求原样转发给它; 否则是到目标的隧道
+        self.latency = latency  # 建立连接(含握手)耗时, 秒
+
+
+class ProxyGateway:
+    """
+    轮换转发代理网关
+    客户端把它当作普通的 HTTP(含 CONNECT)或 SOCKS5 代理, 同一个端口按第一个字节区分协议;
+    每个客户端连接从代理池获取一个上游代理, 连接结束时自动归还并记录结果和建连耗时,
+    客户端不需要再调用 acquire/heartbeat/release; 只有两个方向都正常结束(对端关闭)时才按成功加分,
+    转发中途连接出错或空闲超时的按成功归还但不调整分数
+    - 粘性会话: 代理认证的用户名作为 affinity_key, 同一用户名尽量走同一个上游
+    - 目标主机作为 target_domain, 受按域名限速约束
+    - 连接上游失败(TCP 连接、超时、应答格式错误)时把该上游记为失败(断路器隔离), 换一个上游重试;
+      上游正常应答但目标连不上时原样把应答码告诉客户端, 上游按成功归还且不调整分数
+    - 转发基于 asyncio streams: 每个方向一次最多读 BUFFER_SIZE, 写入后 drain 等对端消化,
+      写缓冲超过 WRITE_HIGH_WATER 时暂停读取, 慢的一端会反压快的一端
+    普通 HTTP 请求会改成 Connection: close, 一个客户端连接只对应一个目标
+    """
+
+    BUFFER_SIZE = 64 * 1024
+    WRITE_HIGH_WATER = 4 * BUFFER_SIZE
+    HEAD_LIMIT = 64 * 1024  # HTTP 请求头的最大长度
+    # 上游协议的优先顺序: 隧道(CONNECT/SOCKS5 客户端)优先用 socks, 普通 HTTP 请求优先直接转发给 http 上游
+    TUNNEL_TYPES = ("socks5", "socks4", "http", "https")
+    FORWARD_TYPES = ("http", "https", "socks5", "socks4")
+    HOP_HEADERS = {b"proxy-authorization", b"proxy-connection", b"connection", b"keep-alive"}
+    HTTP_REASONS = {400: "Bad Request", 403: "Forbidden", 407: "Proxy Authentication Required",
+                    502: "Bad Gateway", 503: "Service Unavailable", 504: "Gateway Timeout"}
+    # SOCKS4 的拒绝码 -> 给 SOCKS5 客户端的应答码
+    SOCKS4_REPLIES = {0x5B: 0x05, 0x5C: 0x01, 0x5D: 0x01}
+
+    def __init__(self, pool: "ProxyPoolManager", request_class: Callable[..., Any],
+                 host: str = "127.0.0.1", port: int = 8001, password: Optional[str] = None,
+                 max_retries: int = 3, connect_timeout: float = 10, idle_timeout: float = 300,
+                 max_connections: int = 1000):
+        self.pool = pool
+        self.request_class = request_class  # AcquireRequest, 由 api_server 传入(避免循环导入)
+        self.host = host
+        self.port = port
+        self.password = password or None  # 设置后客户端必须用这个密码认证, 用户名仍是粘性会话键
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._leases: Dict[str, str] = {}  # 使用中的租约 task_id -> proxy, 定期心跳
+        self._seq = itertools.count(1)
+        self.counts = {
+            "connections": 0,
+            "rejected": 0,
+            "failed": 0,
+            "upstream_failures": 0,
+            "target_refused": 0,
+            "aborted": 0,  # 转发中途出错或空闲超时结束的连接
+            "bytes_sent": 0,  # 客户端 -> 上游
+            "bytes_received": 0  # 上游 -> 客户端
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"listen": f"{self.host}:{self.port}", "active": len(self._clients), **self.counts}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=self.HEAD_LIMIT)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"代理网关已启动: {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+        # 断开还在转发的连接, 各自的处理协程会归还租约
+        for writer in list(self._clients):
+            writer.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _heartbeat_loop(self):
+        """长连接会超过租约超时, 定期给使用中的租约发心跳"""
+        interval = max(1.0, min(60.0, self.pool.lease_timeout / 3))
+        while True:
+            await asyncio.sleep(interval)
+            for task_id, proxy in list(self._leases.items()):
+                self.pool.heartbeat(proxy, task_id)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self._clients) >= self.max_connections:
+            self.counts["rejected"] += 1
+            writer.close()
+            return
+        self._clients.add(writer)
+        self.counts["connections"] += 1
+        try:
+            first = await asyncio.wait_for(reader.readexactly(1), self.idle_timeout)
+            if first == b"\x05":
+                await self._serve_socks5(reader, writer)
+            else:
+                await self._serve_http(first, reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"代理网关处理连接异常: {e}")
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    # === 客户端协议 ===
+
+    async def _serve_http(self, first: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = first + await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            await self._http_error(writer, GatewayError("请求头过长", 400))
+            return
+
+        try:
+            lines = head[:-4].split(b"\r\n")
+            method, target, version = lines[0].split(b" ", 2)
+            headers = [tuple(line.split(b":", 1)) for line in lines[1:] if line]
+            if any(len(header) != 2 for header in headers):
+                raise ValueError
+            auth = next((value.strip() for name, value in headers
+                         if name.strip().lower() == b"proxy-authorization"), None)
+            user = self._check_http_auth(auth)
+
+            tunnel = method.upper() == b"CONNECT"
+            if tunnel:
+                host, port = self._split_host_port(target.decode("latin-1"), 443)
+            else:
+                url = urlsplit(target.decode("latin-1"))
+                if url.scheme != "http" or not url.hostname:
+                    raise GatewayError("只支持 http:// 的绝对地址, https 请使用 CONNECT", 400)
+                host, port = url.hostname, url.port or 80
+            upstream = await self._connect(host, port, user, forward_ok=not tunnel)
+        except (ValueError, UnicodeError):
+            await self._http_error(writer, GatewayError("请求格式错误", 400))
+            return
+        except GatewayError as e:
+            await self._http_error(writer, e)
+            return
+
+        if tunnel:
+            writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            await self._serve(upstream, reader, writer)
+            return
+
+        # 发给 http 上游的保持绝对地址, 走隧道时改成直接发给目标的路径形式
+        if not upstream.forward:
+            target = (url.path or "/").encode("latin-1") + (b"?" + url.query.encode("latin-1") if url.query else b"")
+        kept = [name + b":" + value for name, value in headers if name.strip().lower() not in self.HOP_HEADERS]
+        upstream.writer.write(b"\r\n".join([method + b" " + target + b" " + version, *kept, b"Connection: close"])
+                              + b"\r\n\r\n")
+        await self._serve(upstream, reader, writer)
+
+    def _check_http_auth(self, auth: Optional[bytes]) -> Optional[str]:
+        """解析 Proxy-Authorization(Basic), 返回用户名(粘性会话键); 密码不对时抛出 407"""
+        user, password = None, None
+        if auth and auth[:6].lower() == b"basic ":
+            try:
+                user, _, password = base64.b64decode(auth[6:].strip()).decode("utf-8").partition(":")
+            except (binascii.Error, UnicodeError):
+                pass
+        if self.password is not None and password != self.password:
+            raise GatewayError("代理认证失败", 407)
+        return user or None
+
+    async def _http_error(self, writer: asyncio.StreamWriter, error: GatewayError):
+        status = error.http_status
+        extra = 'Proxy-Authenticate: Basic realm="proxy-pool"\r\n' if status == 407 else ""
+        body = str(error).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {self.HTTP_REASONS.get(status, 'Error')}\r\n{extra}"
+                     f"Content-Type: text/plain; charset=utf-8\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def _serve_socks5(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # 认证方法协商: 有密码时必须用户名/密码认证; 没有密码时客户端愿意就也用它传粘性会话键
+        methods = await reader.readexactly((await reader.readexactly(1))[0])
+        if 0x02 in methods:
+            method = 0x02
+        elif self.password is None and 0x00 in methods:
+            method = 0x00
+        else:
+            writer.write(b"\x05\xff")
+            await writer.drain()
+            return
+        writer.write(bytes((0x05, method)))
+
+        user = None
+        if method == 0x02:
+            version = (await reader.readexactly(1))[0]
+            user = (await reader.readexactly((await reader.readexactly(1))[0])).decode("utf-8", "replace")
+            password = (await reader.readexactly((await reader.readexactly(1))[0])).decode("utf-8", "replace")
+            if version != 0x01 or (self.password is not None and password != self.password):
+                writer.write(b"\x01\x01")
+                await writer.drain()
+                return
+            writer.write(b"\x01\x00")
+
+        version, command, _, address_type = await reader.readexactly(4)
+        if address_type == 0x01:
+            host = socket.inet_ntop(socket.AF_INET, await reader.readexactly(4))
+        elif address_type == 0x03:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode("latin-1")
+        elif address_type == 0x04:
+            host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        else:
+            await self._socks5_reply(writer, 0x08)
+            return
+        port = struct.unpack(">H", await reader.readexactly(2))[0]
+        if version != 0x05 or command != 0x01:
+            await self._socks5_reply(writer, 0x07)  # 只支持 CONNECT
+            return
+
+        try:
+            upstream = await self._connect(host, port, user or None, forward_ok=False)
+        except GatewayError as e:
+            await self._socks5_reply(writer, e.socks_reply)
+            return
+        writer.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+        await self._serve(upstream, reader, writer)
+
+    @staticmethod
+    async def _socks5_reply(writer: asyncio.StreamWriter, code: int):
+        writer.write(bytes((0x05, code, 0x00, 0x01, 0, 0, 0, 0, 0, 0)))
+        await writer.drain()
+
+    @staticmethod
+    def _split_host_port(value: str, default_port: int) -> Tuple[str, int]:
+        """host:port / [v6]:port, 格式错误时抛出 ValueError"""
+        if value.startswith("["):
+            host, _, rest = value[1:].partition("]")
+            port = rest[1:] if rest.startswith(":") else ""
+        else:
+            host, _, port = value.rpartition(":") if ":" in value else (value, "", "")
+        if not host:
+            raise ValueError(value)
+        port = int(port) if port else default_port
+        if not 0 < port < 65536:
+            raise ValueError(value)
+        return host, port
+
+    # === 上游 ===
+
+    async def _connect(self, host: str, port: int, user: Optional[str], forward_ok: bool) -> UpstreamConnection:
+        """从代理池获取上游并建立连接, 失败时换一个上游重试, 都失败时抛出 GatewayError"""
+        order = self.FORWARD_TYPES if forward_ok else self.TUNNEL_TYPES
+        gate = self.pool.domain_gate(host)
+        tried: List[str] = []
+        for _ in range(self.max_retries + 1):
+            if gate is not None:
+                gate.refresh()
+            request = self.request_class(proxy_type="all", affinity_key=user, exclude_proxies=tried or None,
+                                         task_id=f"gateway_{next(self._seq)}", fields=["types"],
+                                         target_domain=gate.domain if gate is not None else None)
+            lease = self.pool.acquire_proxy(request, gate)
+            if lease is None:
+                break
+            proxy, task_id = lease["proxy"], lease["task_id"]
+            tried.append(proxy)
+            proxy_type = next((t for t in order if t in lease["types"]), "http")
+
+            start = time.perf_counter()
+            try:
+                reader, writer = await asyncio.wait_for(self._open(proxy, proxy_type, host, port, forward_ok),
+                                                        self.connect_timeout)
+            except TargetRefused:
+                # 上游工作正常, 换上游也连不上目标; 不能让坏的目标地址把上游都送进隔离
+                self.counts["target_refused"] += 1
+                self.pool.release_proxy(proxy, task_id, success=True, update_score=False)
+                raise
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    ValueError, UnicodeError, GatewayError) as e:
+                self.counts["upstream_failures"] += 1
+                logger.debug(f"通过上游 {proxy}({proxy_type}) 连接 {host}:{port} 失败: {e!r}")
+                self.pool.release_proxy(proxy, task_id, success=False, update_score=True)
+                continue
+
+            self._leases[task_id] = proxy
+            forward = proxy_type in ("http", "https") and forward_ok
+            return UpstreamConnection(proxy, task_id, reader, writer, forward, time.perf_counter() - start)
+
+        self.counts["failed"] += 1
+        if tried:
+            raise GatewayError(f"尝试了 {len(tried)} 个上游代理都无法连接 {host}:{port}", 502, 0x04)
+        raise GatewayError("没有可用的上游代理", 503, 0x01)
+
+    async def _open(self, proxy: str, proxy_type: str, host: str, port: int,
+                    forward: bool) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """连接上游代理并完成握手, 得到一条到目标的隧道(http 上游转发普通请求时不握手)"""
+        proxy_host, _, proxy_port = proxy.rpartition(":")
+        reader, writer = await asyncio.open_connection(proxy_host.strip("[]"), int(proxy_port),
+                                                       limit=self.BUFFER_SIZE)
+        try:
+            if proxy_type == "socks5":
+                await self._socks5_handshake(reader, writer, host, port)
+            elif proxy_type == "socks4":
+                await self._socks4_handshake(reader, writer, host, port)
+            elif not forward:
+                await self._connect_handshake(reader, writer, host, port)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    @staticmethod
+    async def _socks5_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int):
+        writer.write(b"\x05\x01\x00")
+        if await reader.readexactly(2) != b"\x05\x00":
+            raise GatewayError("上游 SOCKS5 不接受无认证连接")
+        try:
+            address = ipaddress.ip_address(host)
+            target = (b"\x01" if address.version == 4 else b"\x04") + address.packed
+        except ValueError:
+            encoded = host.encode("idna")
+            target = b"\x03" + bytes((len(encoded),)) + encoded
+        writer.write(b"\x05\x01\x00" + target + struct.pack(">H", port))
+        version, reply, _, address_type = await reader.readexactly(4)
+        if version != 0x05 or reply > 0x08:
+            raise GatewayError(f"上游 SOCKS5 应答格式错误({version}, {reply})")
+        if reply != 0x00:
+            raise TargetRefused(f"上游 SOCKS5 连接目标失败({reply})", 504 if reply == 0x06 else 502, reply)
+        # 跳过绑定地址
+        if address_type == 0x01:
+            await reader.readexactly(4 + 2)
+        elif address_type == 0x04:
+            await reader.readexactly(16 + 2)
+        else:
+            await reader.readexactly((await reader.readexactly(1))[0] + 2)
+
+    @staticmethod
+    async def _socks4_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int):
+        # SOCKS4a: IP 写 0.0.0.1, 由上游解析域名
+        try:
+            address = ipaddress.IPv4Address(host).packed
+            suffix = b""
+        except ValueError:
+            address = b"\x00\x00\x00\x01"
+            suffix = host.encode("idna") + b"\x00"
+        writer.write(b"\x04\x01" + struct.pack(">H", port) + address + b"\x00" + suffix)
+        reply = await reader.readexactly(8)
+        if reply[0] != 0x00 or reply[1] not in (0x5A, *ProxyGateway.SOCKS4_REPLIES):
+            raise GatewayError(f"上游 SOCKS4 应答格式错误({reply[:2].hex()})")
+        if reply[1] != 0x5A:
+            raise TargetRefused(f"上游 SOCKS4 连接目标失败({reply[1]})",
+                                socks_reply=ProxyGateway.SOCKS4_REPLIES[reply[1]])
+
+    @staticmethod
+    async def _connect_handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int):
+        authority = f"[{host}]:{port}" if ":" in host else f"{host.encode('idna').decode('ascii')}:{port}"
+        writer.write(f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n\r\n".encode("ascii"))
+        head = await reader.readuntil(b"\r\n\r\n")
+        parts = head.split(b" ", 2)
+        status = parts[1] if len(parts) > 1 else b""
+        if not parts[0].startswith(b"HTTP/") or len(status) != 3 or not status.isdigit():
+            raise GatewayError("上游 CONNECT 应答格式错误")
+        if status == b"407":
+            raise GatewayError("上游 HTTP 代理需要认证")  # 上游自身的问题
+        if status != b"200":
+            raise TargetRefused(f"上游 CONNECT 失败({status.decode('ascii')})", int(status), 0x05)
+
+    # === 转发 ===
+
+    async def _serve(self, upstream: UpstreamConnection, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        """
+        双向转发直到任一方向结束, 然后归还租约并记录建连耗时
+        上游正常关闭且客户端方向没有出错时才调整分数, 中途出错或超时只归还租约
+        """
+        for stream in (writer, upstream.writer):
+            stream.transport.set_write_buffer_limits(high=self.WRITE_HIGH_WATER)
+        clean = False
+        try:
+            await writer.drain()
+            sent = asyncio.create_task(self._pipe(reader, upstream.writer, "bytes_sent"))
+            received = asyncio.create_task(self._pipe(upstream.reader, writer, "bytes_received"))
+            try:
+                await asyncio.wait((sent, received), return_when=asyncio.FIRST_COMPLETED)
+                if not received.done():
+                    # 客户端先发完(半关闭), 等上游把响应发完; 上游先关闭时直接结束
+                    await received
+                clean = received.result() and (not sent.done() or sent.result())
+            finally:
+                for task in (sent, received):
+                    task.cancel()
+                await asyncio.gather(sent, received, return_exceptions=True)
+        finally:
+            upstream.writer.close()
+            self._leases.pop(upstream.task_id, None)
+            if not clean:
+                self.counts["aborted"] += 1
+            self.pool.release_proxy(upstream.proxy, upstream.task_id, success=True,
+                                    response_time=upstream.latency if clean else None, update_score=clean)
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, counter: str):
+        """
+        单向转发: 一次读一块, 写完 drain 之后再读下一块, 空闲超时或对端关闭时结束
+        对端正常关闭返回 True, 连接出错或空闲超时返回 False
+        """
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(self.BUFFER_SIZE), self.idle_timeout)
+                if not data:
+                    break
+                writer.write(data)
+                self.counts[counter] += len(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+            return True
+        except (ConnectionError, asyncio.TimeoutError, OSError):
+            return False
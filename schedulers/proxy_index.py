@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+# API服务的空闲代理索引
+
+import random
+from typing import Callable, Dict, List, Optional, Set, Tuple, Iterable
+
+from utils.score_buckets import ScoreBuckets
+
+
+class IdleProxyIndex:
+    """
+    空闲代理索引
+    按 (类型, 地区) 分桶, 每个桶是一个分数桶索引(ScoreBuckets),
+    取最高分空闲代理、加入、移除、改分数都是 O(1)/均摊 O(1)
+
+    选择策略(select):
+        best                - 分数最高(同分先空闲的先出)
+        weighted_random     - 按分数加权随机, 分散到不同代理上
+        p2c                 - 随机取两个, 选 cost 更低的(power of two choices)
+        least_recently_used - 空闲时间最长的
+        fastest             - 平均响应时间最短的(按响应时间另建一份分桶, 第一次使用前由调用方在锁外建立,
+                              见 latency_snapshot/build_latency/install_latency, 之后随加入/移除维护)
+    随机策略只遍历分数桶不遍历成员, 被 accept 拒绝时重试几次后退回按顺序查找
+    按顺序查找(有 accept 时的 best、least_recently_used、fastest)最多检查 SCAN_LIMIT 个候选,
+    都不符合(分数不够或被 accept 拒绝)时随机抽样 RANDOM_TRIES 次, 仍然没有就返回 None,
+    所以被拒绝的代理很多时可能选不到排在后面的可用代理, 但不会在锁内扫描整个桶
+    """
+
+    ALL = "all"
+    REGIONS = ("china", "international")
+    STRATEGIES = ("best", "weighted_random", "p2c", "least_recently_used", "fastest")
+    RANDOM_TRIES = 8
+    SCAN_LIMIT = 64  # 按顺序查找(best/least_recently_used/fastest)最多检查的候选数
+
+    # 响应时间分桶: 每 0.1 秒一档, 10 秒以上和未测过的放最后一档
+    LATENCY_STEP = 0.1
+    LATENCY_BUCKETS = 100
+
+    # (类型元组, 支持国内, 支持国际) -> 桶键, 不同组合很少, 缓存起来
+    _keys_cache: Dict[tuple, Tuple[Tuple[str, str], ...]] = {}
+
+    def __init__(self, max_score: int = 100, latency_of: Optional[Callable[[str], Optional[float]]] = None):
+        self.max_score = max_score
+        self.latency_of = latency_of  # proxy -> 平均响应时间(秒), fastest 策略使用
+        # (类型, 地区) -> 分数桶
+        self._buckets: Dict[Tuple[str, str], ScoreBuckets] = {}
+        # (类型, 地区) -> 响应时间桶, 建立之前为 None, 建立后和分数桶一起维护
+        self._latency: Optional[Dict[Tuple[str, str], ScoreBuckets]] = None
+        # 正在锁外建立响应时间桶时, 期间加入/移除过的代理, 替换时补上
+        self._latency_pending: Optional[Set[str]] = None
+        # proxy -> 所属桶键
+        self._entries: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+
+    @classmethod
+    def bucket_keys(cls, types: Iterable[str], support: Dict[str, bool]) -> Tuple[Tuple[str, str], ...]:
+        """代理所属的全部桶, 包含 all 通配桶"""
+        cache_key = (tuple(types), bool(support.get("china")), bool(support.get("international")))
+        keys = cls._keys_cache.get(cache_key)
+        if keys is None:
+            type_keys = [cls.ALL] + [t for t in cache_key[0] if t != cls.ALL]
+            region_keys = [cls.ALL] + [r for r, ok in zip(cls.REGIONS, cache_key[1:]) if ok]
+            keys = tuple((t, r) for t in type_keys for r in region_keys)
+            cls._keys_cache[cache_key] = keys
+        return keys
+
+    @classmethod
+    def request_key(cls, proxy_type: Optional[str], support_region: Optional[str]) -> Tuple[str, str]:
+        """把获取请求的筛选条件转换成桶键"""
+        return proxy_type or cls.ALL, support_region or cls.ALL
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, proxy: str) -> bool:
+        return proxy in self._entries
+
+    def bucket(self, key: Tuple[str, str]) -> Optional[ScoreBuckets]:
+        """某个 (类型, 地区) 的分数桶, 不存在时返回 None"""
+        return self._buckets.get(key)
+
+    def add(self, proxy: str, score: int, types: Iterable[str], support: Dict[str, bool]):
+        """加入(或刷新)一个空闲代理"""
+        keys = self.bucket_keys(types, support)
+        old_keys = self._entries.get(proxy)
+        if old_keys is not None and old_keys != keys:
+            self.remove(proxy)
+
+        self._entries[proxy] = keys
+        latency = None
+        for key in keys:
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                buckets = self._buckets[key] = ScoreBuckets(self.max_score)
+            buckets.add(proxy, score)
+
+            if self._latency is not None:
+                latency_buckets = self._latency.get(key)
+                if latency_buckets is None:
+                    latency_buckets = self._latency[key] = ScoreBuckets(self.LATENCY_BUCKETS)
+                if latency is None:
+                    latency = self._latency_bucket(proxy)
+                latency_buckets.add(proxy, latency)
+        if self._latency_pending is not None:
+            self._latency_pending.add(proxy)
+
+    def add_many(self, items: Iterable[Tuple[str, int, Iterable[str], Dict[str, bool]]]):
+        """
+        批量加入空闲代理 (proxy, score, types, support), 构建索引时用:
+        先按桶键分组, 再对每个桶整体填充一次, 已在索引中的代理逐个加入
+        """
+        grouped: Dict[Tuple[str, str], List[Tuple[str, int]]] = {}
+        entries = self._entries
+        bucket_keys = self.bucket_keys
+        existing = []
+        for item in items:
+            proxy, score, types, support = item
+            if proxy in entries:
+                existing.append(item)
+                continue
+            keys = entries[proxy] = bucket_keys(types, support)
+            pair = (proxy, score)
+            for key in keys:
+                members = grouped.get(key)
+                if members is None:
+                    members = grouped[key] = []
+                members.append(pair)
+
+        for key, members in grouped.items():
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                buckets = self._buckets[key] = ScoreBuckets(self.max_score)
+            buckets.add_many(members)
+            if self._latency is not None:
+                latency_buckets = self._latency.get(key)
+                if latency_buckets is None:
+                    latency_buckets = self._latency[key] = ScoreBuckets(self.LATENCY_BUCKETS)
+                latency_buckets.add_many((proxy, self._latency_bucket(proxy)) for proxy, _ in members)
+        if self._latency_pending is not None:
+            for members in grouped.values():
+                self._latency_pending.update(proxy for proxy, _ in members)
+
+        for item in existing:
+            self.add(*item)
+
+    def remove(self, proxy: str) -> bool:
+        """移除空闲代理"""
+        keys = self._entries.pop(proxy, None)
+        if keys is None:
+            return False
+        for key in keys:
+            self._buckets[key].remove(proxy)
+            if self._latency is not None:
+                latency_buckets = self._latency.get(key)
+                if latency_buckets is not None:
+                    latency_buckets.remove(proxy)
+        if self._latency_pending is not None:
+            self._latency_pending.add(proxy)
+        return True
+
+    def update_score(self, proxy: str, score: int):
+        """更新空闲代理的分数, 不在索引中则忽略"""
+        keys = self._entries.get(proxy)
+        if keys is None:
+            return
+        for key in keys:
+            self._buckets[key].move(proxy, score)
+
+    def clear(self):
+        self._buckets.clear()
+        self._latency = None
+        self._latency_pending = None
+        self._entries.clear()
+
+    @property
+    def latency_ready(self) -> bool:
+        """fastest 用的响应时间桶是否已经建立"""
+        return self._latency is not None
+
+    def latency_snapshot(self) -> Dict[str, Tuple[Tuple[str, str], ...]]:
+        """开始建立响应时间桶(调用方需持有锁): 返回当前空闲代理的快照, 之后加入/移除的代理记下来"""
+        self._latency_pending = set()
+        return dict(self._entries)
+
+    def build_latency(self, snapshot: Dict[str, Tuple[Tuple[str, str], ...]]) -> Dict[Tuple[str, str], ScoreBuckets]:
+        """按快照建立响应时间桶(不修改索引, 可以在锁外调用)"""
+        grouped: Dict[Tuple[str, str], List[Tuple[str, int]]] = {}
+        for proxy, keys in snapshot.items():
+            pair = (proxy, self._latency_bucket(proxy))
+            for key in keys:
+                members = grouped.get(key)
+                if members is None:
+                    members = grouped[key] = []
+                members.append(pair)
+
+        latency = {}
+        for key, members in grouped.items():
+            latency_buckets = latency[key] = ScoreBuckets(self.LATENCY_BUCKETS)
+            latency_buckets.add_many(members)
+        return latency
+
+    def install_latency(self, latency: Dict[Tuple[str, str], ScoreBuckets]):
+        """换上 build_latency 建好的响应时间桶(调用方需持有锁), 补上建立期间加入/移除的代理"""
+        pending = self._latency_pending or ()
+        self._latency_pending = None
+        for proxy in pending:
+            for latency_buckets in latency.values():
+                latency_buckets.remove(proxy)
+        self._latency = latency
+        for proxy in pending:
+            keys = self._entries.get(proxy)
+            if keys is None:
+                continue
+            value = self._latency_bucket(proxy)
+            for key in keys:
+                latency_buckets = latency.get(key)
+                if latency_buckets is None:
+                    latency_buckets = latency[key] = ScoreBuckets(self.LATENCY_BUCKETS)
+                latency_buckets.add(proxy, value)
+
+    def select(self, key: Tuple[str, str], strategy: str = "best", min_score: int = 0,
+               accept: Optional[Callable[[str], bool]] = None,
+               cost: Optional[Callable[[str], float]] = None,
+               rng: random.Random = random) -> Optional[str]:
+        """
+        按策略取出一个分数不低于 min_score 的空闲代理
+        accept: 额外的筛选条件(排除列表等), 返回 False 的代理不会被选中
+        cost: p2c 比较用的代价, 越小越好(不提供时比较分数)
+        """
+        buckets = self._buckets.get(key)
+        if not buckets:
+            return None
+
+        if strategy == "weighted_random":
+            selected = self._select_random(buckets, min_score, accept, rng, lambda score: score + 1)
+        elif strategy == "p2c":
+            selected = self._select_p2c(buckets, min_score, accept, cost, rng)
+        elif strategy == "least_recently_used":
+            selected = self._select_scan(buckets.iter_oldest(), buckets, min_score, accept, rng)
+        elif strategy == "fastest":
+            # 响应时间桶还没建立时按空闲时间
+            latency_buckets = self._latency.get(key) if self._latency is not None else None
+            candidates = latency_buckets.iter_asc() if latency_buckets is not None else buckets.iter_oldest()
+            selected = self._select_scan(candidates, buckets, min_score, accept, rng)
+        else:
+            selected = self._select_best(buckets, min_score, accept, rng)
+
+        if selected is not None:
+            self.remove(selected)
+        return selected
+
+    def _select_scan(self, candidates: Iterable[Tuple[int, str]], buckets: ScoreBuckets, min_score: int,
+                     accept: Optional[Callable[[str], bool]], rng: random.Random) -> Optional[str]:
+        """按 candidates 的顺序最多检查 SCAN_LIMIT 个, 都不符合时改为随机抽样, 避免在锁内扫描整个桶"""
+        for checked, (_, proxy) in enumerate(candidates):
+            if checked >= self.SCAN_LIMIT:
+                return self._sample(buckets, min_score, accept, rng)
+            if buckets.score_of(proxy) >= min_score and (accept is None or accept(proxy)):
+                return proxy
+        return None
+
+    def _sample(self, buckets: ScoreBuckets, min_score: int, accept: Optional[Callable[[str], bool]],
+                rng: random.Random, weight: Optional[Callable[[int], float]] = None) -> Optional[str]:
+        """随机抽样最多 RANDOM_TRIES 次, 都被 accept 拒绝时返回 None"""
+        for _ in range(self.RANDOM_TRIES):
+            picked = buckets.random_weighted(min_score, rng, weight)
+            if picked is None:
+                return None
+            if accept is None or accept(picked[1]):
+                return picked[1]
+        return None
+
+    def _select_best(self, buckets: ScoreBuckets, min_score: int,
+                     accept: Optional[Callable[[str], bool]], rng: random.Random) -> Optional[str]:
+        if accept is None:
+            top = buckets.top()
+            if top is not None and top[0] >= min_score:
+                return top[1]
+            return None
+        return self._select_scan(buckets.iter_desc(min_score), buckets, min_score, accept, rng)
+
+    def _select_random(self, buckets: ScoreBuckets, min_score: int, accept: Optional[Callable[[str], bool]],
+                       rng: random.Random, weight: Optional[Callable[[int], float]] = None) -> Optional[str]:
+        selected = self._sample(buckets, min_score, accept, rng, weight)
+        if selected is None and accept is not None:
+            # 可选的代理大多被拒绝, 退回按顺序查找(同样最多检查 SCAN_LIMIT 个)
+            selected = self._select_best(buckets, min_score, accept, rng)
+        return selected
+
+    def _select_p2c(self, buckets: ScoreBuckets, min_score: int, accept: Optional[Callable[[str], bool]],
+                    cost: Optional[Callable[[str], float]], rng: random.Random) -> Optional[str]:
+        first = self._select_random(buckets, min_score, accept, rng)
+        if first is None:
+            return None
+        second = self._select_random(buckets, min_score, accept, rng)
+        if second is None or second == first:
+            return first
+        if cost is None:
+            return first if buckets.score_of(first) >= buckets.score_of(second) else second
+        return first if cost(first) <= cost(second) else second
+
+    def _latency_bucket(self, proxy: str) -> int:
+        latency = self.latency_of(proxy) if self.latency_of else None
+        if not latency or latency <= 0:
+            return self.LATENCY_BUCKETS
+        return min(int(latency / self.LATENCY_STEP), self.LATENCY_BUCKETS)
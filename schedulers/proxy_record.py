@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# API服务内存中的紧凑代理记录
+
+import json
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 状态取值, 所有记录共用同一个字符串对象
+IDLE = sys.intern("idle")
+BUSY = sys.intern("busy")
+DEAD = sys.intern("dead")
+QUARANTINE = sys.intern("quarantine")  # 断路器打开, 退避时间到后自动恢复(只在内存中)
+_STATUSES = {IDLE: IDLE, BUSY: BUSY, DEAD: DEAD, QUARANTINE: QUARANTINE}
+
+# 布尔属性压缩到一个整数里
+FLAG_CHINA = 1
+FLAG_INTERNATIONAL = 2
+FLAG_TRANSPARENT = 4
+FLAG_BROWSER_VALID = 8
+
+# 代理类型对应的代理URL协议(https 代理也用 http:// 连接, 和 set_up_proxy 一致)
+URL_SCHEMES = {"http": "http", "https": "http", "socks4": "socks4", "socks5": "socks5"}
+
+# 按 flags 的地区位取支持的地区元组, 不用每次新建
+_REGIONS_BY_FLAGS = ((), ("china",), ("international",), ("china", "international"))
+
+# 类型组合很少, 同样的组合共用一个元组
+_types_cache: Dict[Any, Tuple[str, ...]] = {}
+
+# 冷数据列(只在查询代理详情时从数据库读取)
+COLD_COLUMNS = (
+    "detected_ip, city, region, country, loc, org, postal, timezone, "
+    "browser_check_date, browser_response_time, "
+    "dns_hijacking, ssl_valid, malicious_content, security_check_date"
+)
+
+
+def intern_types(types: Any) -> Tuple[str, ...]:
+    """把 types 列(JSON字符串或列表)转换成共享的类型元组"""
+    key = types if isinstance(types, (str, type(None))) else tuple(types)
+    cached = _types_cache.get(key)
+    if cached is None:
+        if isinstance(types, str):
+            types = json.loads(types) if types else []
+        cached = tuple(sys.intern(str(t)) for t in (types or ()))
+        _types_cache[key] = cached
+    return cached
+
+
+def intern_status(status: Optional[str]) -> str:
+    """状态字符串转换成共享对象, 未知或为空时视为空闲"""
+    if not status:
+        return IDLE
+    return _STATUSES.get(status) or sys.intern(status)
+
+
+def make_flags(support_china: Any, support_international: Any,
+               transparent: Any = False, browser_valid: Any = False) -> int:
+    flags = 0
+    if support_china:
+        flags |= FLAG_CHINA
+    if support_international:
+        flags |= FLAG_INTERNATIONAL
+    if transparent:
+        flags |= FLAG_TRANSPARENT
+    if browser_valid:
+        flags |= FLAG_BROWSER_VALID
+    return flags
+
+
+class ProxyRecord:
+    """
+    代理池中一个代理的热数据(选择、计数、打分用到的字段)和占用状态
+    类型和状态是驻留的共享对象, 地区/透明/浏览器可用压缩成标志位,
+    位置、安全检测等冷数据不常驻内存, 由 get_proxy_info 按需从数据库读取
+
+    一个代理可以同时有多个租约: 最早的租约放在 task_id/acquire_time/heartbeat_time,
+    其余的放在 extra_leases(task_id -> [acquire_time, heartbeat_time]), 只有一个租约时不额外占内存
+
+    断路器: failures 是连续失败次数, 为 0 时关闭; 失败后进入隔离(QUARANTINE), retry_at 到期后恢复为
+    半开(failures 仍大于 0, 只允许一个试用租约), 试用成功后 failures 清零
+    """
+
+    __slots__ = ("proxy", "score", "types", "flags", "status", "task_id", "acquire_time",
+                 "heartbeat_time", "avg_response_time", "success_rate", "last_checked", "urls",
+                 "lease_count", "extra_leases", "failures", "retry_at")
+
+    def __init__(self, proxy: str, score: int, types: Tuple[str, ...], flags: int, status: str = IDLE,
+                 task_id: Optional[str] = None, acquire_time: Optional[float] = None,
+                 heartbeat_time: Optional[float] = None, avg_response_time: Optional[float] = None,
+                 success_rate: Optional[float] = None, last_checked: Optional[str] = None):
+        self.proxy = proxy
+        self.score = score
+        self.types = types
+        self.flags = flags
+        self.status = status  # idle, busy, dead
+        self.task_id = task_id
+        self.acquire_time = acquire_time
+        self.heartbeat_time = heartbeat_time
+        self.avg_response_time = avg_response_time
+        self.success_rate = success_rate
+        self.last_checked = last_checked
+        self.urls: Optional[Tuple[str, ...]] = None  # 和 types 一一对应的代理URL, 第一次用到时生成
+        self.lease_count = 1 if status == BUSY else 0  # 从数据库恢复的占用算一个租约
+        self.extra_leases: Optional[Dict[str, List[float]]] = None
+        self.failures = 0
+        self.retry_at: Optional[float] = None  # 隔离结束时间
+
+    @property
+    def support(self) -> Dict[str, bool]:
+        return {
+            "china": bool(self.flags & FLAG_CHINA),
+            "international": bool(self.flags & FLAG_INTERNATIONAL)
+        }
+
+    @property
+    def regions(self) -> Tuple[str, ...]:
+        return _REGIONS_BY_FLAGS[self.flags & (FLAG_CHINA | FLAG_INTERNATIONAL)]
+
+    @property
+    def transparent(self) -> bool:
+        return bool(self.flags & FLAG_TRANSPARENT)
+
+    @property
+    def browser_valid(self) -> bool:
+        return bool(self.flags & FLAG_BROWSER_VALID)
+
+    def url(self, proxy_type: Optional[str] = None) -> str:
+        """scheme://ip:port, 优先用请求的类型, 代理不支持时用它的第一个类型"""
+        urls = self.urls
+        if urls is None:
+            urls = self.urls = tuple(f"{URL_SCHEMES.get(t, 'http')}://{self.proxy}" for t in self.types)
+        if not urls:
+            return f"http://{self.proxy}"
+        if proxy_type in self.types:
+            return urls[self.types.index(proxy_type)]
+        return urls[0]
+
+    def has_lease(self, task_id: str) -> bool:
+        if not self.lease_count:
+            return False
+        return self.task_id == task_id or (self.extra_leases is not None and task_id in self.extra_leases)
+
+    def add_lease(self, task_id: str, now: float):
+        """新增租约, 同一任务重复获取时只刷新时间"""
+        if not self.lease_count:
+            self.task_id = task_id
+            self.acquire_time = now
+            self.heartbeat_time = now
+        elif self.task_id == task_id:
+            self.heartbeat_time = now
+            return
+        else:
+            if self.extra_leases is None:
+                self.extra_leases = {}
+            elif task_id in self.extra_leases:
+                self.extra_leases[task_id][1] = now
+                return
+            self.extra_leases[task_id] = [now, now]
+        self.lease_count += 1
+
+    def remove_lease(self, task_id: str) -> bool:
+        """移除租约, 最早的租约被移除时由下一个租约顶上"""
+        if not self.lease_count:
+            return False
+        if self.task_id == task_id:
+            if self.extra_leases:
+                next_task = next(iter(self.extra_leases))
+                self.acquire_time, self.heartbeat_time = self.extra_leases.pop(next_task)
+                self.task_id = next_task
+                if not self.extra_leases:
+                    self.extra_leases = None
+            else:
+                self.task_id = None
+                self.acquire_time = None
+        elif self.extra_leases is not None and task_id in self.extra_leases:
+            del self.extra_leases[task_id]
+            if not self.extra_leases:
+                self.extra_leases = None
+        else:
+            return False
+        self.lease_count -= 1
+        return True
+
+    def touch_lease(self, task_id: str, now: float) -> bool:
+        """刷新租约的心跳时间"""
+        if not self.lease_count:
+            return False
+        if self.task_id == task_id:
+            self.heartbeat_time = now
+            return True
+        if self.extra_leases is not None and task_id in self.extra_leases:
+            self.extra_leases[task_id][1] = now
+            return True
+        return False
+
+    def leases(self) -> List[Tuple[Optional[str], Optional[float], Optional[float]]]:
+        """全部租约 (task_id, acquire_time, heartbeat_time), 按获取先后排列(不加锁读取时也可以调用)"""
+        if not self.lease_count:
+            return []
+        result = [(self.task_id, self.acquire_time, self.heartbeat_time)]
+        extra = self.extra_leases
+        if extra:
+            # 先一次性复制(C 层面完成, 不会和并发修改交错), 再逐个展开
+            result.extend((task_id, times[0], times[1]) for task_id, times in tuple(extra.items()))
+        return result
+
+    def earliest_seen(self, now: float) -> float:
+        """所有租约中最早的最后活动时间(心跳或获取时间), 用于计算租约到期"""
+        seen = self.heartbeat_time or self.acquire_time or now
+        if self.extra_leases:
+            for acquire_time, heartbeat_time in self.extra_leases.values():
+                seen = min(seen, heartbeat_time or acquire_time)
+        return seen
+
+    def copy_leases(self, other: "ProxyRecord"):
+        """接管另一条记录(同一代理的旧记录)的全部租约"""
+        self.task_id = other.task_id
+        self.acquire_time = other.acquire_time
+        self.heartbeat_time = other.heartbeat_time
+        self.lease_count = other.lease_count
+        self.extra_leases = other.extra_leases
+
+    def copy_breaker(self, other: "ProxyRecord"):
+        """接管另一条记录(同一代理的旧记录)的断路器状态"""
+        self.failures = other.failures
+        self.retry_at = other.retry_at
+
+    def performance(self) -> Dict[str, Any]:
+        return {
+            "avg_response_time": self.avg_response_time,
+            "success_rate": self.success_rate,
+            "last_checked": self.last_checked
+        }
+
+    def hot_info(self) -> Dict[str, Any]:
+        """只包含热数据的 info(获取代理时返回)"""
+        return {
+            "types": list(self.types),
+            "support": self.support,
+            "transparent": self.transparent,
+            "browser": {"valid": self.browser_valid},
+            "performance": self.performance()
+        }
+
+    def full_info(self, cold: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """热数据和冷数据合并成完整的 info, 结构和数据库导出的一致"""
+        cold = cold or {}
+        return {
+            "types": list(self.types),
+            "support": self.support,
+            "transparent": self.transparent,
+            "detected_ip": cold.get("detected_ip"),
+            "location": cold.get("location", {}),
+            "browser": {"valid": self.browser_valid, **cold.get("browser", {})},
+            "security": cold.get("security", {}),
+            "performance": self.performance()
+        }
+
+
+def cold_info_from_row(row: Iterable[Any]) -> Dict[str, Any]:
+    """把按 COLD_COLUMNS 顺序查出的一行转换成冷数据字典"""
+    (detected_ip, city, region, country, loc, org, postal, timezone,
+     browser_check_date, browser_response_time,
+     dns_hijacking, ssl_valid, malicious_content, security_check_date) = row
+    return {
+        "detected_ip": detected_ip,
+        "location": {
+            "city": city,
+            "region": region,
+            "country": country,
+            "loc": loc,
+            "org": org,
+            "postal": postal,
+            "timezone": timezone
+        },
+        "browser": {
+            "check_date": browser_check_date,
+            "response_time": browser_response_time
+        },
+        "security": {
+            "dns_hijacking": dns_hijacking,
+            "ssl_valid": ssl_valid,
+            "malicious_content": malicious_content,
+            "check_date": security_check_date
+        }
+    }
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# API服务的后写(write-behind)持久化队列
+
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindWriter:
+    """
+    后写队列
+    请求路径只把状态变化和分数变化写进内存队列, 同一代理的多次变化会合并:
+    状态以最后一次为准, 分数/成功率变化累加, 响应时间按 EWMA 折叠;
+    由独立的写线程定期用 executemany 在一个事务里批量落盘
+
+    durability:
+        interval - 每 flush_interval_ms 毫秒或积累 flush_batch 条记录时落盘
+        shutdown - 只在关闭服务(或手动调用 flush)时落盘
+    """
+
+    DURABILITY_MODES = ("interval", "shutdown")
+
+    def __init__(self, db_manager, flush_interval_ms: int = 500, flush_batch: int = 500,
+                 durability: str = "interval", max_score: int = 100,
+                 on_flush: Optional[Callable[[float, int], object]] = None):
+        if durability not in self.DURABILITY_MODES:
+            logger.warning(f"未知的持久化模式 {durability}, 使用 interval")
+            durability = "interval"
+
+        self.db_manager = db_manager
+        self.flush_interval = max(flush_interval_ms, 10) / 1000
+        self.flush_batch = max(flush_batch, 1)
+        self.durability = durability
+        self.max_score = max_score
+        self.on_flush = on_flush  # 每次落盘成功后调用 (耗时秒数, 写入条数), 用于监控
+
+        # proxy -> ("status", (status, task_id, acquire_time, heartbeat_time)) 或 ("heartbeat", heartbeat_time)
+        self._pending: Dict[str, Tuple[str, object]] = {}
+        # proxy -> [分数变化, 成功率变化, 响应时间衰减系数, 响应时间增量]
+        self._scores: Dict[str, List[float]] = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # 保证同一时间只有一个落盘操作
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._flush_requested = False
+        self._holds = 0  # 进行中的 batch() 数量, 期间落盘等待, 保证一批记录在同一个事务里
+
+    def record_status(self, proxy: str, status: str, task_id: Optional[str] = None,
+                      acquire_time: Optional[float] = None, heartbeat_time: Optional[float] = None):
+        """记录一次完整的状态变化(覆盖该代理之前未落盘的记录)"""
+        with self._cond:
+            self._pending[proxy] = ("status", (status, task_id, acquire_time, heartbeat_time))
+            self._notify_if_full()
+
+    def record_heartbeat(self, proxy: str, heartbeat_time: float):
+        """记录一次心跳"""
+        with self._cond:
+            pending = self._pending.get(proxy)
+            if pending and pending[0] == "status":
+                # 合并到未落盘的状态记录中
+                status, task_id, acquire_time, _ = pending[1]
+                self._pending[proxy] = ("status", (status, task_id, acquire_time, heartbeat_time))
+            else:
+                self._pending[proxy] = ("heartbeat", heartbeat_time)
+            self._notify_if_full()
+
+    def record_score(self, proxy: str, score_delta: int, success_delta: float,
+                     rt_decay: float = 1.0, rt_add: float = 0.0):
+        """
+        记录一次分数更新, 与该代理未落盘的更新折叠成一条
+        新平均响应时间 = 旧平均响应时间 * rt_decay + rt_add
+        """
+        with self._cond:
+            folded = self._scores.get(proxy)
+            if folded is None:
+                self._scores[proxy] = [score_delta, success_delta, rt_decay, rt_add]
+            else:
+                folded[0] += score_delta
+                folded[1] += success_delta
+                folded[2] *= rt_decay
+                folded[3] = folded[3] * rt_decay + rt_add
+            self._notify_if_full()
+
+    def pending_count(self) -> int:
+        """等待落盘的记录数(状态和分数分别计数), 用于监控队列积压"""
+        with self._cond:
+            return len(self._pending) + len(self._scores)
+
+    def pending_score(self, proxy: str) -> Optional[Tuple[float, float, float, float]]:
+        """该代理还没落盘的分数更新 (分数变化, 成功率变化, 响应时间衰减系数, 响应时间增量), 没有时返回 None"""
+        with self._cond:
+            folded = self._scores.get(proxy)
+            return tuple(folded) if folded is not None else None
+
+    def request_flush(self):
+        """通知写线程尽快落盘(不等待完成), 非 interval 模式下忽略"""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify()
+
+    @contextmanager
+    def batch(self):
+        """批量记录期间暂缓落盘, 让这批记录一起在下一次落盘的事务里写入(不能在里面调用 flush)"""
+        with self._cond:
+            self._holds += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._holds -= 1
+                if not self._holds:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def paused(self):
+        """
+        期间不落盘(先等进行中的落盘完成), 读取数据库后要和内存中未落盘的更新对齐时用:
+        期间读到的行包含所有已落盘的更新, 未落盘的正好是 pending_score 给出的(不能在里面调用 flush)
+        """
+        with self._flush_lock:
+            yield
+
+    def start(self):
+        """启动写线程"""
+        if self.durability != "interval" or self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止写线程并把剩余记录全部落盘"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def flush(self) -> int:
+        """立即把队列中的记录落盘, 返回写入条数"""
+        with self._flush_lock:
+            with self._cond:
+                while self._holds:
+                    self._cond.wait()
+                if not self._pending and not self._scores:
+                    return 0
+                batch, self._pending = self._pending, {}
+                scores, self._scores = self._scores, {}
+
+            status_rows = []
+            heartbeat_rows = []
+            for proxy, (kind, value) in batch.items():
+                if kind == "status":
+                    status_rows.append((proxy, *value))
+                else:
+                    heartbeat_rows.append((value, proxy))
+
+            start = time.perf_counter()
+            today = datetime.now().strftime("%Y-%m-%d")
+            score_rows = [
+                (score_delta, success_delta, rt_decay, rt_add, today, proxy)
+                for proxy, (score_delta, success_delta, rt_decay, rt_add) in scores.items()
+            ]
+
+            try:
+                with self.db_manager.get_writer() as conn:
+                    cursor = conn.cursor()
+                    if score_rows:
+                        # 只写增量, 不覆盖CLI验证器同时写入的结果
+                        cursor.executemany('''
+                        UPDATE proxies SET
+                            score = MAX(0, MIN(?, score + ?)),
+                            success_rate = MAX(0.0, MIN(1.0, ROUND(COALESCE(success_rate, 0) + ?, 2))),
+                            avg_response_time = ROUND(COALESCE(avg_response_time, 0) * ? + ?, 3),
+                            last_checked = ?,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE proxy = ?
+                        ''', [(self.max_score, *row) for row in score_rows])
+                    if status_rows:
+                        cursor.executemany('''
+                        INSERT OR REPLACE INTO proxy_status (proxy, status, task_id, acquire_time, heartbeat_time)
+                        VALUES (?, ?, ?, ?, ?)
+                        ''', status_rows)
+                    if heartbeat_rows:
+                        cursor.executemany('''
+                        UPDATE proxy_status SET heartbeat_time = ? WHERE proxy = ?
+                        ''', heartbeat_rows)
+                    conn.commit()
+            except Exception as e:
+                logger.error(f"批量保存代理状态失败: {e}")
+                self._requeue(batch, scores)
+                return 0
+
+            written = len(batch) + len(scores)
+            if self.on_flush is not None:
+                self.on_flush(time.perf_counter() - start, written)
+            return written
+
+    def _requeue(self, batch: Dict[str, Tuple[str, object]], scores: Dict[str, List[float]]):
+        """落盘失败时放回队列, 已有更新状态记录的代理以新记录为准, 分数变化重新折叠"""
+        with self._cond:
+            for proxy, item in batch.items():
+                self._pending.setdefault(proxy, item)
+            newer, self._scores = self._scores, scores
+        for proxy, (score_delta, success_delta, rt_decay, rt_add) in newer.items():
+            self.record_score(proxy, score_delta, success_delta, rt_decay, rt_add)
+
+    def _notify_if_full(self):
+        if self.durability == "interval" and len(self._pending) + len(self._scores) >= self.flush_batch:
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (not self._stopping and not self._flush_requested
+                       and len(self._pending) + len(self._scores) < self.flush_batch):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+                self._flush_requested = False
+            self.flush()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# 测试用的代理数据库和代理池
+
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedulers.api_server import ProxyPoolManager  # noqa: E402
+from schedulers.pool_stats import PoolCounters  # noqa: E402
+from schedulers.proxy_record import IDLE, BUSY  # noqa: E402
+
+PROXIES_SCHEMA = '''
+CREATE TABLE proxies (
+    proxy TEXT PRIMARY KEY,
+    score INTEGER,
+    types TEXT,
+    support_china INTEGER,
+    support_international INTEGER,
+    transparent INTEGER,
+    detected_ip TEXT,
+    city TEXT,
+    region TEXT,
+    country TEXT,
+    loc TEXT,
+    org TEXT,
+    postal TEXT,
+    timezone TEXT,
+    browser_valid INTEGER,
+    browser_check_date TEXT,
+    browser_response_time REAL,
+    dns_hijacking TEXT,
+    ssl_valid TEXT,
+    malicious_content TEXT,
+    data_integrity TEXT,
+    behavior_analysis TEXT,
+    security_check_date TEXT,
+    avg_response_time REAL,
+    success_rate REAL,
+    last_checked TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+
+def insert_proxy(conn: sqlite3.Connection, proxy: str, score: int = 50, types=("http",),
+                 china: bool = True, international: bool = True, avg_response_time: float = 1.0,
+                 success_rate: float = 0.9):
+    """按 CLI 验证器的列写入一个代理"""
+    conn.execute('''
+    INSERT OR REPLACE INTO proxies (proxy, score, types, support_china, support_international, transparent,
+        detected_ip, city, region, country, browser_valid, avg_response_time, success_rate, last_checked)
+    VALUES (?, ?, ?, ?, ?, 0, '1.2.3.4', 'city', 'region', 'CN', 1, ?, ?, '2026-01-01')
+    ''', (proxy, score, json.dumps(list(types)), int(china), int(international), avg_response_time, success_rate))
+
+
+def assert_consistent(pool):
+    """计数器、分数索引、空闲索引、到期堆都和代理记录一致"""
+    expected = PoolCounters(pool.max_score)
+    for proxy, record in pool.proxies.items():
+        expected.add_proxy(record.status, record.score, record.types, record.support,
+                           record.browser_valid, record.transparent)
+        assert pool.score_index.score_of(proxy) == record.score
+        assert (proxy in pool.idle_index) == pool._has_capacity(record), (proxy, record.status)
+        assert (pool.lease_expiry.deadline_of(proxy) is not None) == bool(record.lease_count)
+        if record.status in (IDLE, BUSY):
+            assert (record.status == BUSY) == bool(record.lease_count)
+    assert len(pool.score_index) == len(pool.proxies)
+
+    snapshot = pool.get_stats()
+    for key, value in expected.snapshot().items():
+        assert snapshot[key] == value, key
+
+
+@pytest.fixture
+def make_db(tmp_path):
+    """建一个代理数据库: make_db(n) 写入 n 个分数、类型、地区各不相同的代理, 返回数据库路径"""
+    def make(count: int = 30) -> str:
+        path = str(tmp_path / "proxies.db")
+        conn = sqlite3.connect(path)
+        conn.execute(PROXIES_SCHEMA)
+        for i in range(count):
+            insert_proxy(conn, f"10.0.{i // 256}.{i % 256}:{8000 + i}",
+                         score=10 + i * 7 % 90,
+                         types=(("http", "https"), ("socks4",), ("socks5",))[i % 3],
+                         china=i % 2 == 0, international=i % 4 != 1,
+                         avg_response_time=0.2 + i % 10 * 0.3, success_rate=0.5 + i % 5 * 0.1)
+        conn.commit()
+        conn.close()
+        return path
+    return make
+
+
+@pytest.fixture
+def make_pool(make_db):
+    """建一个代理池: make_pool(n, **api_config), 默认不启动后台线程, 测试结束后关闭"""
+    pools = []
+
+    def make(count: int = 30, **api_config) -> ProxyPoolManager:
+        api_config.setdefault("status_durability", "shutdown")
+        pool = ProxyPoolManager(make_db(count), api_config)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
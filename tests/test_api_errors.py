@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# 获取代理失败时的 404 / 429
+
+import pytest
+from fastapi.testclient import TestClient
+
+import schedulers.api_server as api_server
+
+
+@pytest.fixture
+def client_for(make_pool, monkeypatch):
+    def make(count: int = 3, **api_config) -> TestClient:
+        pool = make_pool(count, **api_config)
+        monkeypatch.setattr(api_server, "proxy_pool", pool)
+        return TestClient(api_server.app)
+    return make
+
+
+def acquire(client, **body):
+    body.setdefault("proxy_type", "all")
+    return client.post("/proxy/acquire", json=body)
+
+
+def test_no_matching_proxy_is_404(client_for):
+    client = client_for(3)
+    response = acquire(client, min_score=1000)
+    assert response.status_code == 404
+
+    response = client.post("/proxy/acquire_batch", json={"proxy_type": "all", "count": 2, "min_score": 1000})
+    assert response.status_code == 404
+
+
+def test_all_leased_without_domain_is_404(client_for):
+    client = client_for(3)
+    for _ in range(3):
+        assert acquire(client).status_code == 200
+    assert acquire(client).status_code == 404
+
+
+def test_domain_rate_limit_is_429(client_for):
+    client = client_for(3, domain_rate_per_minute=60, domain_burst=1)
+    for _ in range(3):
+        response = acquire(client, target_domain="example.com")
+        assert response.status_code == 200
+        lease = response.json()["data"]
+        assert client.post("/proxy/release", json={"proxy": lease["proxy"], "task_id": lease["task_id"]}).status_code == 200
+
+    response = acquire(client, target_domain="example.com")
+    assert response.status_code == 429
+    assert 0 < int(response.headers["retry-after"]) <= 1
+    detail = response.json()["detail"]
+    assert detail["target_domain"] == "example.com" and 0 < detail["retry_after"] <= 1
+
+    # 其他域名和不限域名不受影响
+    assert acquire(client, target_domain="other.com").status_code == 200
+    assert acquire(client).status_code == 200
+
+
+def test_all_leased_and_limited_is_429(client_for):
+    client = client_for(3, domain_rate_per_minute=60, domain_burst=1)
+    for _ in range(3):
+        assert acquire(client, target_domain="example.com").status_code == 200
+
+    # 代理都被占用, 但对这个域名的令牌都用完了, 仍然告诉客户端什么时候再来
+    response = acquire(client, target_domain="example.com")
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+
+    # 没有限速记录的域名是普通的 404
+    assert acquire(client, target_domain="other.com").status_code == 404
+
+
+def test_batch_domain_rate_limit_is_429(client_for):
+    client = client_for(3, domain_rate_per_minute=60, domain_burst=1)
+    response = client.post("/proxy/acquire_batch", json={"proxy_type": "all", "count": 3,
+                                                         "target_domain": "example.com"})
+    assert response.status_code == 200
+    for lease in response.json()["data"]["proxies"]:
+        client.post("/proxy/release", json={"proxy": lease["proxy"], "task_id": lease["task_id"]})
+
+    response = client.post("/proxy/acquire_batch", json={"proxy_type": "all", "count": 3,
+                                                         "target_domain": "example.com"})
+    assert response.status_code == 429
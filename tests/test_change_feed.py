@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# CLI验证器写库后的增量同步
+
+import sqlite3
+
+from schedulers.api_server import AcquireRequest
+from schedulers.proxy_record import IDLE, BUSY, DEAD
+
+from conftest import assert_consistent, insert_proxy
+
+
+def external_write(pool, *statements):
+    """用单独的连接写库, 模拟 CLI 验证器(更新时总会写 ChangeFeed.WATCH_COLUMNS 中的列)"""
+    conn = sqlite3.connect(pool.db_path)
+    for sql, params in statements:
+        if callable(sql):
+            sql(conn, *params)
+        else:
+            conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_own_writes_are_not_fed_back(make_pool):
+    # API 自己落盘的分数更新不进入变更记录, 也不改变 data_version
+    pool = make_pool(10)
+    assert pool.change_feed.poll() == 0
+    for _ in range(3):
+        lease = pool.acquire_proxy(AcquireRequest(proxy_type="all"))
+        pool.release_proxy(lease["proxy"], lease["task_id"], True, 0.5, True)
+    pool.writer.flush()
+    assert pool.change_feed.poll() == 0
+    assert pool.change_feed.applied == 0
+
+
+def test_insert_update_delete_are_applied(make_pool):
+    pool = make_pool(10)
+    busy = pool.acquire_proxy(AcquireRequest(proxy_type="all"))
+    idle = next(proxy for proxy, record in pool.proxies.items() if record.status == IDLE)
+    victim = next(proxy for proxy, record in pool.proxies.items()
+                  if record.status == IDLE and proxy != idle)
+
+    external_write(
+        pool,
+        (insert_proxy, ("1.1.1.1:80", 99, ("https",), True, False)),
+        ("UPDATE proxies SET score = 77, detected_ip = '5.6.7.8' WHERE proxy = ?", (busy["proxy"],)),
+        ("UPDATE proxies SET score = 5, types = '[\"socks5\"]' WHERE proxy = ?", (idle,)),
+        ("DELETE FROM proxies WHERE proxy = ?", (victim,)),
+    )
+    assert pool.change_feed.poll() == 4
+
+    added = pool.proxies["1.1.1.1:80"]
+    assert added.status == IDLE and added.score == 99 and added.types == ("https",)
+    result = pool.acquire_proxy(AcquireRequest(proxy_type="https", support_region="china", min_score=99))
+    assert result["proxy"] == "1.1.1.1:80"
+
+    # 占用中的代理保留租约
+    record = pool.proxies[busy["proxy"]]
+    assert record.status == BUSY and record.score == 77 and record.task_id == busy["task_id"]
+    assert pool.lease_expiry.deadline_of(busy["proxy"]) is not None
+
+    assert pool.proxies[idle].score == 5 and pool.proxies[idle].types == ("socks5",)
+    assert victim not in pool.proxies and victim not in pool.idle_index
+    assert_consistent(pool)
+
+
+def test_dead_proxy_revived_by_validator(make_pool):
+    pool = make_pool(3, breaker_max_failures=1)
+    lease = pool.acquire_proxy(AcquireRequest(proxy_type="all"))
+    proxy = lease["proxy"]
+    pool.release_proxy(proxy, lease["task_id"], success=False)
+    assert pool.proxies[proxy].status == DEAD
+
+    external_write(pool, ("UPDATE proxies SET score = 60, browser_valid = 1 WHERE proxy = ?", (proxy,)))
+    assert pool.change_feed.poll() == 1
+    assert pool.proxies[proxy].status == IDLE and proxy in pool.idle_index
+    assert_consistent(pool)
+
+
+def test_pending_score_survives_apply(make_pool):
+    pool = make_pool(3)
+    lease = pool.acquire_proxy(AcquireRequest(proxy_type="all"))
+    proxy = lease["proxy"]
+    pool.release_proxy(proxy, lease["task_id"], True, 0.5, True)
+    expected = pool.proxies[proxy].score
+    assert pool.writer.pending_score(proxy) is not None
+
+    # 读取前不落盘: 未落盘的分数变化叠加到数据库的值上
+    pool.change_feed.before_poll = None
+    external_write(pool, ("UPDATE proxies SET transparent = 1 WHERE proxy = ?", (proxy,)))
+    assert pool.change_feed.poll() == 1
+    assert pool.proxies[proxy].score == expected
+    assert pool.proxies[proxy].transparent
+
+    pool.writer.flush()
+    with pool.db_manager.get_connection() as conn:
+        row = conn.execute("SELECT score FROM proxies WHERE proxy = ?", (proxy,)).fetchone()
+    assert row[0] == expected
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# 租约到期回收和断路器隔离/恢复
+
+import time
+
+from schedulers.api_server import AcquireRequest
+from schedulers.proxy_record import IDLE, BUSY, DEAD, QUARANTINE
+
+from conftest import assert_consistent
+
+
+def acquire(pool, **kwargs):
+    kwargs.setdefault("proxy_type", "all")
+    return pool.acquire_proxy(AcquireRequest(**kwargs))
+
+
+def test_expired_lease_is_reaped(make_pool):
+    pool = make_pool(5, lease_timeout=60, breaker_max_failures=1)
+    lease = acquire(pool)
+    proxy = lease["proxy"]
+    deadline = pool.next_lease_deadline()
+    assert deadline is not None and deadline > time.time()
+
+    # 还没到期时不回收
+    assert pool.reap_expired_leases(now=deadline - 1) == 0
+    assert pool.proxies[proxy].status == BUSY
+
+    assert pool.reap_expired_leases(now=deadline + 1) == 1
+    assert pool.proxies[proxy].lease_count == 0
+    assert pool.proxies[proxy].status == DEAD
+    assert pool.next_lease_deadline() is None
+    assert_consistent(pool)
+
+
+def test_heartbeat_extends_lease(make_pool):
+    pool = make_pool(5, lease_timeout=60)
+    lease = acquire(pool)
+    first = pool.next_lease_deadline()
+
+    time.sleep(0.01)
+    assert pool.heartbeat(lease["proxy"], lease["task_id"])
+    assert not pool.heartbeat(lease["proxy"], "other-task")
+
+    # 原来的到期时间到了也不回收, 按心跳时间重新安排
+    assert pool.reap_expired_leases(now=first + 0.001) == 0
+    assert pool.proxies[lease["proxy"]].status == BUSY
+    assert pool.next_lease_deadline() > first
+    assert_consistent(pool)
+
+
+def test_failure_quarantines_with_backoff(make_pool):
+    pool = make_pool(5, breaker_base_backoff=30, breaker_max_backoff=100, breaker_max_failures=3)
+    lease = acquire(pool)
+    proxy = lease["proxy"]
+    before = time.time()
+    pool.release_proxy(proxy, lease["task_id"], success=False)
+
+    record = pool.proxies[proxy]
+    assert record.status == QUARANTINE
+    assert record.failures == 1
+    assert before + 30 <= record.retry_at <= time.time() + 30
+    assert proxy not in pool.idle_index
+    assert pool.next_quarantine_deadline() == record.retry_at
+    # 隔离中的代理不会被选中
+    assert all(acquire(pool, exclude_proxies=[])["proxy"] != proxy for _ in range(4))
+    assert_consistent(pool)
+
+
+def test_quarantine_recovery_and_trip_to_dead(make_pool):
+    pool = make_pool(1, breaker_base_backoff=30, breaker_max_backoff=50, breaker_max_failures=3)
+    proxy = next(iter(pool.proxies))
+    record = pool.proxies[proxy]
+
+    lease = acquire(pool)
+    pool.release_proxy(proxy, lease["task_id"], success=False)
+    assert pool.recover_quarantined(now=record.retry_at - 1) == 0
+    assert pool.recover_quarantined(now=record.retry_at + 1) == 1
+    assert record.status == IDLE and record.retry_at is None and proxy in pool.idle_index
+
+    # 半开试用失败: 退避翻倍(不超过上限), 并按持续故障扣分
+    score = record.score
+    lease = acquire(pool)
+    now = time.time()
+    pool.release_proxy(proxy, lease["task_id"], success=False, update_score=True)
+    assert record.status == QUARANTINE and record.failures == 2
+    assert now + 50 <= record.retry_at <= time.time() + 50
+    assert record.score == score - 1
+
+    pool.recover_quarantined(now=record.retry_at + 1)
+    lease = acquire(pool)
+    pool.release_proxy(proxy, lease["task_id"], success=False)
+    assert record.status == DEAD and record.retry_at is None
+    assert pool.next_quarantine_deadline() is None
+    assert acquire(pool) is None
+    assert_consistent(pool)
+
+
+def test_success_closes_breaker(make_pool):
+    pool = make_pool(1, breaker_max_failures=3)
+    proxy = next(iter(pool.proxies))
+    record = pool.proxies[proxy]
+
+    lease = acquire(pool)
+    pool.release_proxy(proxy, lease["task_id"], success=False)
+    pool.recover_quarantined(now=record.retry_at + 1)
+    lease = acquire(pool)
+    pool.release_proxy(proxy, lease["task_id"], success=True)
+    assert record.status == IDLE and record.failures == 0
+    assert_consistent(pool)
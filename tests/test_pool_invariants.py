@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# 计数器和索引与代理记录保持一致
+
+import random
+
+from schedulers.api_server import AcquireRequest, AcquireBatchRequest
+
+from conftest import assert_consistent
+
+
+def test_load_builds_consistent_indexes(make_pool):
+    pool = make_pool(60)
+    assert len(pool.proxies) == 60
+    assert len(pool.idle_index) == 60
+    assert_consistent(pool)
+
+
+def test_random_operations_keep_counters_and_indexes(make_pool):
+    pool = make_pool(60, breaker_max_failures=2)
+    rng = random.Random(1)
+    held = []
+    for i in range(600):
+        request = AcquireRequest(proxy_type=rng.choice(["all", "http", "socks5"]),
+                                 strategy=rng.choice(["best", "weighted_random", "p2c", "fastest", "least_recently_used"]))
+        result = pool.acquire_proxy(request)
+        if result:
+            held.append(result)
+        if held and rng.random() < 0.6:
+            lease = held.pop(rng.randrange(len(held)))
+            assert pool.release_proxy(lease["proxy"], lease["task_id"], rng.random() < 0.8,
+                                      rng.random() * 3, True)
+        if i % 150 == 0:
+            pool.recover_quarantined(now=float("inf"))
+        assert_consistent(pool)
+
+    for lease in held:
+        assert pool.release_proxy(lease["proxy"], lease["task_id"])
+    assert_consistent(pool)
+
+
+def test_batch_acquire_returns_distinct_proxies(make_pool):
+    pool = make_pool(30)
+    results = pool.acquire_proxies(AcquireBatchRequest(proxy_type="all", count=10, task_ids=["a", "b"]))
+    assert len(results) == 10
+    assert len({result["proxy"] for result in results}) == 10
+    assert [result["task_id"] for result in results[:2]] == ["a", "b"]
+    assert pool.get_stats()["busy"] == 10
+    assert_consistent(pool)
+
+
+def test_best_strategy_returns_highest_score(make_pool):
+    pool = make_pool(30)
+    result = pool.acquire_proxy(AcquireRequest(proxy_type="all"))
+    assert result["proxy_info"]["score"] == max(record.score for record in pool.proxies.values())
+
+
+def test_score_update_moves_proxy_in_indexes(make_pool):
+    pool = make_pool(10)
+    result = pool.acquire_proxy(AcquireRequest(proxy_type="all"))
+    proxy = result["proxy"]
+    before = pool.proxies[proxy].score
+    assert proxy not in pool.idle_index
+
+    pool.release_proxy(proxy, result["task_id"], True, 0.5, True)
+    assert pool.proxies[proxy].score == min(before + 2, pool.max_score)
+    assert pool.writer.pending_score(proxy) is not None
+    assert_consistent(pool)
+
+    pool.writer.flush()
+    with pool.db_manager.get_connection() as conn:
+        row = conn.execute("SELECT score FROM proxies WHERE proxy = ?", (proxy,)).fetchone()
+    assert row[0] == pool.proxies[proxy].score
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# 一致性哈希环
+
+import hashlib
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Set
+
+
+class HashRing:
+    """
+    一致性哈希环
+    - 每个成员在环上有 REPLICAS 个虚拟节点, 由成员名的一次 blake2b 摘要切分得到,
+      不受 PYTHONHASHSEED 影响, 服务重启后键的映射不变
+    - 环按哈希值的高位分成 2^BUCKET_BITS 个桶, 桶内按哈希值有序(array 紧凑存储),
+      增删成员只改 REPLICAS 个小桶; 查找先定位桶再在桶内二分, 之后顺时针逐个桶往后走,
+      空桶也要跨过: 虚拟节点数和桶数相当以后每一步平均 O(1), 成员很少(环很稀疏)时
+      最坏要检查全部 2^BUCKET_BITS 个桶(几千次循环, 成员少时总量也小)
+    - 增删成员只影响落在该成员虚拟节点上的键
+    """
+
+    REPLICAS = 8  # 64 字节摘要切成 8 个 64 位哈希
+    BUCKET_BITS = 12
+    _SHIFT = 64 - BUCKET_BITS
+    _UNPACK = struct.Struct(">8Q").unpack
+
+    def __init__(self):
+        size = 1 << self.BUCKET_BITS
+        self._points: List[array] = [array("Q") for _ in range(size)]
+        self._owners: List[List[str]] = [[] for _ in range(size)]
+        self._members: Set[str] = set()
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, member: str) -> bool:
+        return member in self._members
+
+    @staticmethod
+    def hash_key(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def _points_of(self, member: str) -> tuple:
+        return self._UNPACK(hashlib.blake2b(member.encode("utf-8"), digest_size=64).digest())
+
+    def add(self, member: str):
+        if member in self._members:
+            return
+        self._members.add(member)
+        for point in self._points_of(member):
+            bucket = point >> self._SHIFT
+            points = self._points[bucket]
+            i = bisect_left(points, point)
+            points.insert(i, point)
+            self._owners[bucket].insert(i, member)
+
+    def add_many(self, members: Iterable[str]):
+        """批量加入(构建时用), 每个桶只排序一次"""
+        pending: List[List[tuple]] = [[] for _ in range(len(self._points))]
+        for member in members:
+            if member in self._members:
+                continue
+            self._members.add(member)
+            for point in self._points_of(member):
+                pending[point >> self._SHIFT].append((point, member))
+
+        for bucket, items in enumerate(pending):
+            if not items:
+                continue
+            items.extend(zip(self._points[bucket], self._owners[bucket]))
+            items.sort()
+            self._points[bucket] = array("Q", (point for point, _ in items))
+            self._owners[bucket] = [owner for _, owner in items]
+
+    def remove(self, member: str) -> bool:
+        if member not in self._members:
+            return False
+        self._members.discard(member)
+        for point in self._points_of(member):
+            bucket = point >> self._SHIFT
+            points = self._points[bucket]
+            owners = self._owners[bucket]
+            i = bisect_left(points, point)
+            # 不同成员的虚拟节点哈希相同时按成员名找到自己的那个
+            while i < len(points) and points[i] == point and owners[i] != member:
+                i += 1
+            if i < len(points) and points[i] == point:
+                del points[i]
+                del owners[i]
+        return True
+
+    def walk(self, key: str) -> Iterator[str]:
+        """
+        从键在环上的位置顺时针依次给出不重复的成员; 遍历期间不能修改
+        找到下一个成员要跨过中间的空桶, 环很稀疏时最坏 O(2^BUCKET_BITS)
+        """
+        if not self._members:
+            return
+        point = self.hash_key(key)
+        size = len(self._points)
+        start = point >> self._SHIFT
+        offset = bisect_left(self._points[start], point)
+        seen = set()
+        # 从起点桶的 offset 开始绕一圈, 最后回到起点桶的 offset 之前
+        for step in range(size + 1):
+            bucket = (start + step) % size
+            owners = self._owners[bucket]
+            if step == 0:
+                indexes = range(offset, len(owners))
+            elif step == size:
+                indexes = range(min(offset, len(owners)))
+            else:
+                indexes = range(len(owners))
+            for i in indexes:
+                owner = owners[i]
+                if owner not in seen:
+                    seen.add(owner)
+                    yield owner
+                    if len(seen) == len(self._members):
+                        return
+
+    def clear(self):
+        for points in self._points:
+            del points[:]
+        for owners in self._owners:
+            owners.clear()
+        self._members.clear()
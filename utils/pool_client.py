@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+# 代理池API客户端(同步 / asyncio), 只依赖 requests(异步版另需 aiohttp), 可以直接复制到爬虫项目中使用
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # 只用同步客户端时不需要
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# 批量接口一块的结果: (这一块的条目, 应答的 data)
+BatchResult = Tuple[List[Dict[str, Any]], Dict[str, Any]]
+
+# 代理类型对应的代理URL协议(https 代理也用 http:// 连接)
+URL_SCHEMES = {"http": "http", "https": "http", "socks4": "socks4", "socks5": "socks5"}
+
+
+class BatchRequestError(Exception):
+    """批量接口调用失败(网络错误或非 2xx 应答), unsent 为还没有被服务端处理的条目"""
+
+    def __init__(self, message: str, unsent: List[Dict[str, Any]]):
+        super().__init__(message)
+        self.unsent = unsent
+
+
+class Lease:
+    """一个代理租约, 归还时需要 proxy 和 task_id"""
+
+    __slots__ = ("proxy", "task_id", "info", "acquired_at", "response_time")
+
+    def __init__(self, proxy: str, task_id: str, info: Optional[Dict[str, Any]] = None):
+        self.proxy = proxy
+        self.task_id = task_id
+        self.info = info or {}
+        self.acquired_at = time.time()
+        self.response_time: Optional[float] = None  # 使用方可以填上请求耗时, 归还时一起上报
+
+    @classmethod
+    def from_result(cls, result: Dict[str, Any]) -> "Lease":
+        return cls(result["proxy"], result["task_id"], (result.get("proxy_info") or {}).get("info"))
+
+    @property
+    def url(self) -> str:
+        """scheme://ip:port, 按代理支持的第一个类型"""
+        types = self.info.get("types") or ["http"]
+        return f"{URL_SCHEMES.get(types[0], 'http')}://{self.proxy}"
+
+    @property
+    def proxies(self) -> Dict[str, str]:
+        """requests 的 proxies 参数"""
+        return {"http": self.url, "https": self.url}
+
+    def __repr__(self):
+        return f"Lease({self.proxy}, {self.task_id})"
+
+
+class _PoolClientBase:
+    """
+    同步和异步客户端共用的状态(不做网络请求)
+    - 预取缓冲: 默认条件的获取先从本地缓冲取, 缓冲不足一半时用一次批量获取补满 prefetch 个
+    - 心跳: 持有的全部租约(包括缓冲中的)每隔 heartbeat_interval 用一次批量心跳续期
+    - 归还: 先放进待归还列表, 每隔 release_delay 秒或攒够 RELEASE_BATCH 个时一次批量归还;
+      发送失败(网络错误、5xx 等)的放回列表退避重试, 最多 RELEASE_MAX_ATTEMPTS 次
+    服务端没有批量接口(旧版本返回 404/405)时退回逐个调用;
+    心跳失败(服务端已经回收)的租约从缓冲和持有列表中去掉, 不会再交给使用方
+    """
+
+    HEARTBEAT_BATCH_PATH = "/proxy/heartbeat_batch"
+    RELEASE_BATCH_PATH = "/proxy/release_batch"
+    RELEASE_BATCH = 100
+    MAX_BATCH = 1000  # 批量接口每次最多的条数, 超出的分块发送
+    RELEASE_MAX_ATTEMPTS = 5
+    RELEASE_RETRY_DELAY = 1.0  # 归还失败后的重试间隔, 每次翻倍
+    RELEASE_RETRY_MAX_DELAY = 30.0
+
+    def __init__(self, api_url: str = "http://localhost:8000", prefetch: int = 0,
+                 heartbeat_interval: float = 60, release_delay: float = 0.2, timeout: float = 10,
+                 max_connections: int = 10, **defaults):
+        self.api_url = api_url.rstrip("/")
+        self.prefetch = max(0, int(prefetch))
+        self.heartbeat_interval = heartbeat_interval
+        self.release_delay = release_delay
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # 预取和不带参数的 acquire 使用的获取条件(proxy_type, support_region, min_score, strategy ...)
+        self.defaults = {"proxy_type": "http", **defaults}
+
+        self._lock = threading.Lock()
+        self._buffer: Deque[Lease] = deque()  # 预取但还没交给使用方的租约
+        self._held: Dict[str, Lease] = {}  # 交给使用方还没归还的租约 task_id -> Lease
+        self._pending: List[Dict[str, Any]] = []  # 待批量归还
+        self._pending_since = 0.0
+        self._release_attempts: Dict[str, int] = {}  # 发送失败过的归还 task_id -> 失败次数
+        self._retry_at = 0.0
+        self._last_heartbeat = time.time()
+        self._batch_supported = {"heartbeat": True, "release": True}
+        self._closed = False
+
+    def _acquire_payload(self, filters: Dict[str, Any], count: Optional[int] = None) -> Dict[str, Any]:
+        data = {**self.defaults, **filters, "task_id": f"client_{uuid.uuid4().hex}"}
+        if count is not None:
+            data["count"] = count
+        return {key: value for key, value in data.items() if value is not None}
+
+    def _take_buffered(self) -> Optional[Lease]:
+        with self._lock:
+            if not self._buffer:
+                return None
+            lease = self._buffer.popleft()
+            self._held[lease.task_id] = lease
+            return lease
+
+    def _hold(self, leases: List[Lease], keep: int = 0) -> Optional[Lease]:
+        """把批量获取的结果放进缓冲, keep 为 1 时先取出第一个交给使用方"""
+        with self._lock:
+            first = None
+            if keep and leases:
+                first = leases[0]
+                self._held[first.task_id] = first
+                leases = leases[1:]
+            self._buffer.extend(leases)
+            return first
+
+    def _top_up_count(self) -> int:
+        """缓冲不足一半时需要补充的数量"""
+        if not self.prefetch or self._closed:
+            return 0
+        with self._lock:
+            return self.prefetch - len(self._buffer) if len(self._buffer) * 2 < self.prefetch else 0
+
+    def _queue_release(self, lease: Lease, success: Optional[bool], response_time: Optional[float]):
+        with self._lock:
+            self._held.pop(lease.task_id, None)
+            if not self._pending:
+                self._pending_since = time.time()
+            self._pending.append({"proxy": lease.proxy, "task_id": lease.task_id, "success": success,
+                                  "response_time": response_time})
+
+    def _releases_due(self, force: bool = False) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            if not self._pending:
+                return []
+            if not force and (now < self._retry_at or (len(self._pending) < self.RELEASE_BATCH and
+                                                       now - self._pending_since < self.release_delay)):
+                return []
+            items, self._pending = self._pending, []
+            return items
+
+    def _requeue_releases(self, items: List[Dict[str, Any]], error: Any):
+        """发送失败的归还放回队列退避重试, 失败太多次的放弃(由服务端在租约超时后回收)"""
+        now = time.time()
+        with self._lock:
+            kept = []
+            for item in items:
+                attempts = self._release_attempts.pop(item["task_id"], 0) + 1
+                if attempts >= self.RELEASE_MAX_ATTEMPTS:
+                    logger.warning(f"归还代理 {item['proxy']} 失败 {attempts} 次, 放弃: {error}")
+                    continue
+                self._release_attempts[item["task_id"]] = attempts
+                kept.append(item)
+            if not kept:
+                return
+            if not self._pending:
+                self._pending_since = now
+            self._pending[:0] = kept
+            attempts = max(self._release_attempts[item["task_id"]] for item in kept)
+            self._retry_at = now + min(self.RELEASE_RETRY_MAX_DELAY, self.RELEASE_RETRY_DELAY * 2 ** (attempts - 1))
+        logger.debug(f"归还 {len(kept)} 个代理失败, 稍后重试: {error}")
+
+    def _releases_sent(self, items: Iterable[Dict[str, Any]]):
+        with self._lock:
+            for item in items:
+                self._release_attempts.pop(item["task_id"], None)
+
+    def _evict(self, task_ids: Iterable[str]):
+        """心跳失败的租约(服务端已经回收)从缓冲和持有列表中去掉"""
+        task_ids = set(task_ids)
+        if not task_ids:
+            return
+        with self._lock:
+            self._buffer = deque(lease for lease in self._buffer if lease.task_id not in task_ids)
+            for task_id in task_ids:
+                self._held.pop(task_id, None)
+        logger.info(f"{len(task_ids)} 个租约已被服务端回收")
+
+    @staticmethod
+    def _rejected(items: List[Dict[str, Any]], data: Dict[str, Any]) -> List[str]:
+        """批量心跳应答中失败的条目的 task_id"""
+        return [item["task_id"] for item, ok in zip(items, data.get("results") or ()) if not ok]
+
+    def _heartbeats_due(self) -> List[Dict[str, str]]:
+        now = time.time()
+        if now - self._last_heartbeat < self.heartbeat_interval:
+            return []
+        self._last_heartbeat = now
+        with self._lock:
+            leases = list(self._held.values()) + list(self._buffer)
+        return [{"proxy": lease.proxy, "task_id": lease.task_id} for lease in leases]
+
+    def _drain_buffer(self) -> List[Lease]:
+        with self._lock:
+            leases, self._buffer = list(self._buffer), deque()
+            return leases
+
+    @staticmethod
+    def _single_release(item: Dict[str, Any]) -> Dict[str, Any]:
+        # 逐个归还的接口 success 必须是布尔值, 没用过的租约按成功归还
+        return {**item, "success": item["success"] is not False}
+
+    @property
+    def held(self) -> int:
+        return len(self._held)
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+
+class ProxyPoolClient(_PoolClientBase):
+    """
+    同步客户端: requests.Session 保持长连接, 后台线程负责补充预取、批量心跳和批量归还
+
+        client = ProxyPoolClient("http://localhost:8000", prefetch=20, proxy_type="all", min_score=50)
+        with client.get_proxy() as lease:
+            requests.get(url, proxies=lease.proxies)
+        client.close()
+    """
+
+    def __init__(self, api_url: str = "http://localhost:8000", **kwargs):
+        super().__init__(api_url, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._wake = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="proxy-pool-client", daemon=True)
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _post(self, path: str, data: Dict[str, Any], timeout: Optional[float] = None) -> requests.Response:
+        return self.session.post(f"{self.api_url}{path}", json=data, timeout=timeout or self.timeout)
+
+    def _post_batch(self, path: str, items: List[Dict[str, Any]]) -> Optional[List[BatchResult]]:
+        """
+        分块调用批量接口, 返回每一块的结果; 服务端没有该接口时返回 None,
+        网络错误或其他非 2xx 应答时抛出 BatchRequestError
+        """
+        results = []
+        for start in range(0, len(items), self.MAX_BATCH):
+            chunk = items[start:start + self.MAX_BATCH]
+            try:
+                response = self._post(path, {"items": chunk})
+            except requests.RequestException as e:
+                raise BatchRequestError(repr(e), items[start:]) from e
+            if response.status_code in (404, 405) and not start:
+                return None
+            if not 200 <= response.status_code < 300:
+                raise BatchRequestError(f"HTTP {response.status_code}", items[start:])
+            results.append((chunk, response.json().get("data") or {}))
+        return results
+
+    def acquire(self, wait_timeout: Optional[float] = None, **filters) -> Optional[Lease]:
+        """
+        获取一个代理, 没有可用代理时返回 None
+        不传筛选条件时优先从预取缓冲中取; 传了条件(proxy_type、min_score、affinity_key 等)时单独获取
+        """
+        if not filters and self.prefetch:
+            lease = self._take_buffered()
+            if lease is None:
+                # 缓冲空了, 一次批量获取补满, 第一个直接返回
+                lease = self._hold(self._acquire_batch(self.prefetch, {}, wait_timeout), keep=1)
+            elif self._top_up_count():
+                self._wake.set()
+            return lease
+
+        if wait_timeout:
+            filters["wait_timeout"] = wait_timeout
+        try:
+            response = self._post("/proxy/acquire", self._acquire_payload(filters),
+                                  timeout=self.timeout + (wait_timeout or 0))
+            if response.status_code == 200:
+                lease = Lease.from_result(response.json()["data"])
+                with self._lock:
+                    self._held[lease.task_id] = lease
+                return lease
+        except requests.RequestException as e:
+            logger.warning(f"获取代理失败: {e}")
+        return None
+
+    def _acquire_batch(self, count: int, filters: Dict[str, Any], wait_timeout: Optional[float] = None) -> List[Lease]:
+        if wait_timeout:
+            filters = {**filters, "wait_timeout": wait_timeout}
+        try:
+            response = self._post("/proxy/acquire_batch", self._acquire_payload(filters, count),
+                                  timeout=self.timeout + (wait_timeout or 0))
+            if response.status_code == 200:
+                return [Lease.from_result(result) for result in response.json()["data"]["proxies"]]
+        except requests.RequestException as e:
+            logger.warning(f"批量获取代理失败: {e}")
+        return []
+
+    def release(self, lease: Lease, success: bool = True, response_time: Optional[float] = None,
+                flush: bool = False):
+        """归还代理(攒批后台发送), flush 为真时立即发送"""
+        self._queue_release(lease, success, response_time if response_time is not None else lease.response_time)
+        if flush:
+            self._flush_releases(force=True)
+
+    @contextmanager
+    def get_proxy(self, **filters):
+        """上下文管理器: 正常退出按成功归还, 抛出异常按失败归还; 没有可用代理时返回 None"""
+        lease = self.acquire(**filters)
+        if lease is None:
+            yield None
+            return
+        try:
+            yield lease
+        except Exception:
+            self.release(lease, success=False)
+            raise
+        self.release(lease, success=True)
+
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.session.get(f"{self.api_url}/proxy/stats", timeout=self.timeout)
+            if response.status_code == 200:
+                return response.json()["data"]
+        except requests.RequestException:
+            pass
+        return None
+
+    def _flush_releases(self, force: bool = False):
+        items = self._releases_due(force)
+        if not items:
+            return
+        if self._batch_supported["release"]:
+            try:
+                if self._post_batch(self.RELEASE_BATCH_PATH, items) is not None:
+                    self._releases_sent(items)
+                    return
+            except BatchRequestError as e:
+                self._releases_sent(items[:len(items) - len(e.unsent)])
+                self._requeue_releases(e.unsent, e)
+                return
+            self._batch_supported["release"] = False
+
+        for i, item in enumerate(items):
+            try:
+                response = self._post("/proxy/release", self._single_release(item))
+            except requests.RequestException as e:
+                self._requeue_releases(items[i:], repr(e))
+                return
+            if response.status_code >= 500:
+                self._requeue_releases([item], f"HTTP {response.status_code}")
+            else:
+                # 400 表示租约已经不存在(超时回收), 不用再还
+                self._releases_sent([item])
+
+    def _send_heartbeats(self):
+        items = self._heartbeats_due()
+        if not items:
+            return
+        # 心跳发送失败不影响使用, 下个周期再试
+        if self._batch_supported["heartbeat"]:
+            try:
+                results = self._post_batch(self.HEARTBEAT_BATCH_PATH, items)
+            except BatchRequestError as e:
+                logger.debug(f"心跳失败: {e}")
+                return
+            if results is not None:
+                self._evict(task_id for chunk, data in results for task_id in self._rejected(chunk, data))
+                return
+            self._batch_supported["heartbeat"] = False
+
+        rejected = []
+        for item in items:
+            try:
+                response = self._post("/proxy/heartbeat", item)
+            except requests.RequestException as e:
+                logger.debug(f"心跳失败: {e}")
+                break
+            if response.status_code == 400:
+                rejected.append(item["task_id"])
+        self._evict(rejected)
+
+    def _run(self):
+        tick = max(0.05, min(self.release_delay, self.heartbeat_interval))
+        while not self._closed:
+            self._wake.wait(tick)
+            self._wake.clear()
+            try:
+                self._flush_releases()
+                self._send_heartbeats()
+                count = self._top_up_count()
+                if count:
+                    self._hold(self._acquire_batch(count, {}))
+            except Exception as e:
+                logger.error(f"代理池客户端后台任务异常: {e}")
+
+    def close(self):
+        """归还没用过的预取代理和待归还的代理, 停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._worker.join(timeout=self.timeout)
+        for lease in self._drain_buffer():
+            self._queue_release(lease, None, None)
+        self._flush_releases(force=True)
+        if self._pending:
+            logger.warning(f"关闭时还有 {len(self._pending)} 个代理没能归还, 由服务端在租约超时后回收")
+        self.session.close()
+
+
+class AsyncProxyPoolClient(_PoolClientBase):
+    """
+    asyncio 客户端: aiohttp 连接池保持长连接, 后台任务负责补充预取、批量心跳和批量归还
+
+        async with AsyncProxyPoolClient("http://localhost:8000", prefetch=20, proxy_type="all") as client:
+            async with client.get_proxy() as lease:
+                ...
+    """
+
+    def __init__(self, api_url: str = "http://localhost:8000", **kwargs):
+        if aiohttp is None:
+            raise RuntimeError("AsyncProxyPoolClient 需要安装 aiohttp")
+        super().__init__(api_url, **kwargs)
+        self.session: Optional["aiohttp.ClientSession"] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._refill: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self._wake = asyncio.Event()
+        self._refill = asyncio.Lock()
+        self._worker = asyncio.create_task(self._run())
+
+    async def _post(self, path: str, data: Dict[str, Any],
+                    timeout: Optional[float] = None) -> "tuple[int, Optional[Dict[str, Any]]]":
+        async with self.session.post(f"{self.api_url}{path}", json=data,
+                                     timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)) as response:
+            body = await response.json(content_type=None) if 200 <= response.status < 300 else None
+            return response.status, body
+
+    async def _post_batch(self, path: str, items: List[Dict[str, Any]]) -> Optional[List[BatchResult]]:
+        """分块调用批量接口, 规则同 ProxyPoolClient._post_batch"""
+        results = []
+        for start in range(0, len(items), self.MAX_BATCH):
+            chunk = items[start:start + self.MAX_BATCH]
+            try:
+                status, body = await self._post(path, {"items": chunk})
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise BatchRequestError(repr(e), items[start:]) from e
+            if status in (404, 405) and not start:
+                return None
+            if body is None:
+                raise BatchRequestError(f"HTTP {status}", items[start:])
+            results.append((chunk, body.get("data") or {}))
+        return results
+
+    async def acquire(self, wait_timeout: Optional[float] = None, **filters) -> Optional[Lease]:
+        """获取一个代理, 规则同 ProxyPoolClient.acquire"""
+        if not filters and self.prefetch:
+            lease = self._take_buffered()
+            if lease is None:
+                # 并发的获取只让一个去补充, 其他的等它补完再从缓冲取
+                async with self._refill:
+                    lease = self._take_buffered()
+                    if lease is None:
+                        lease = self._hold(await self._acquire_batch(self.prefetch, {}, wait_timeout), keep=1)
+            elif self._top_up_count():
+                self._wake.set()
+            return lease
+
+        if wait_timeout:
+            filters["wait_timeout"] = wait_timeout
+        try:
+            status, body = await self._post("/proxy/acquire", self._acquire_payload(filters),
+                                            timeout=self.timeout + (wait_timeout or 0))
+            if status == 200:
+                lease = Lease.from_result(body["data"])
+                self._held[lease.task_id] = lease
+                return lease
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"获取代理失败: {e!r}")
+        return None
+
+    async def _acquire_batch(self, count: int, filters: Dict[str, Any],
+                             wait_timeout: Optional[float] = None) -> List[Lease]:
+        if wait_timeout:
+            filters = {**filters, "wait_timeout": wait_timeout}
+        try:
+            status, body = await self._post("/proxy/acquire_batch", self._acquire_payload(filters, count),
+                                            timeout=self.timeout + (wait_timeout or 0))
+            if status == 200:
+                return [Lease.from_result(result) for result in body["data"]["proxies"]]
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"批量获取代理失败: {e!r}")
+        return []
+
+    async def release(self, lease: Lease, success: bool = True, response_time: Optional[float] = None,
+                      flush: bool = False):
+        """归还代理(攒批后台发送), flush 为真时立即发送"""
+        self._queue_release(lease, success, response_time if response_time is not None else lease.response_time)
+        if flush:
+            await self._flush_releases(force=True)
+
+    @asynccontextmanager
+    async def get_proxy(self, **filters):
+        """上下文管理器: 正常退出按成功归还, 抛出异常按失败归还; 没有可用代理时返回 None"""
+        lease = await self.acquire(**filters)
+        if lease is None:
+            yield None
+            return
+        try:
+            yield lease
+        except Exception:
+            await self.release(lease, success=False)
+            raise
+        await self.release(lease, success=True)
+
+    async def get_stats(self) -> Optional[Dict[str, Any]]:
+        try:
+            async with self.session.get(f"{self.api_url}/proxy/stats") as response:
+                if response.status == 200:
+                    return (await response.json(content_type=None))["data"]
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        return None
+
+    async def _flush_releases(self, force: bool = False):
+        items = self._releases_due(force)
+        if not items:
+            return
+        if self._batch_supported["release"]:
+            try:
+                if await self._post_batch(self.RELEASE_BATCH_PATH, items) is not None:
+                    self._releases_sent(items)
+                    return
+            except BatchRequestError as e:
+                self._releases_sent(items[:len(items) - len(e.unsent)])
+                self._requeue_releases(e.unsent, e)
+                return
+            self._batch_supported["release"] = False
+
+        responses = await asyncio.gather(
+            *(self._post("/proxy/release", self._single_release(item)) for item in items), return_exceptions=True
+        )
+        failed = []
+        for item, response in zip(items, responses):
+            if isinstance(response, BaseException):
+                failed.append(item)
+            elif response[0] >= 500:
+                failed.append(item)
+            else:
+                # 400 表示租约已经不存在(超时回收), 不用再还
+                self._releases_sent([item])
+        if failed:
+            self._requeue_releases(failed, "逐个归还失败")
+
+    async def _send_heartbeats(self):
+        items = self._heartbeats_due()
+        if not items:
+            return
+        # 心跳发送失败不影响使用, 下个周期再试
+        if self._batch_supported["heartbeat"]:
+            try:
+                results = await self._post_batch(self.HEARTBEAT_BATCH_PATH, items)
+            except BatchRequestError as e:
+                logger.debug(f"心跳失败: {e}")
+                return
+            if results is not None:
+                self._evict(task_id for chunk, data in results for task_id in self._rejected(chunk, data))
+                return
+            self._batch_supported["heartbeat"] = False
+
+        responses = await asyncio.gather(*(self._post("/proxy/heartbeat", item) for item in items),
+                                         return_exceptions=True)
+        self._evict(item["task_id"] for item, response in zip(items, responses)
+                    if not isinstance(response, BaseException) and response[0] == 400)
+
+    async def _run(self):
+        tick = max(0.05, min(self.release_delay, self.heartbeat_interval))
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), tick)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._flush_releases()
+                await self._send_heartbeats()
+                count = self._top_up_count()
+                if count and not self._refill.locked():
+                    async with self._refill:
+                        self._hold(await self._acquire_batch(count, {}))
+            except Exception as e:
+                logger.error(f"代理池客户端后台任务异常: {e!r}")
+
+    async def close(self):
+        """归还没用过的预取代理和待归还的代理, 停止后台任务"""
+        if self._closed or self.session is None:
+            return
+        self._closed = True
+        self._wake.set()
+        try:
+            await self._worker
+        except Exception:
+            pass
+        for lease in self._drain_buffer():
+            self._queue_release(lease, None, None)
+        await self._flush_releases(force=True)
+        if self._pending:
+            logger.warning(f"关闭时还有 {len(self._pending)} 个代理没能归还, 由服务端在租约超时后回收")
+        await self.session.close()
+
+
+# 使用示例
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    # 同步: 预取 20 个, 用完自动归还
+    with ProxyPoolClient("http://localhost:8000", prefetch=20, proxy_type="all", min_score=30) as client:
+        with client.get_proxy() as lease:
+            if lease:
+                start = time.time()
+                response = requests.get("https://httpbin.org/ip", proxies=lease.proxies, timeout=10)
+                lease.response_time = time.time() - start
+                print(f"使用代理 {lease.proxy}: {response.text}")
+        print(f"代理池统计: {client.get_stats()}")
+
+    # 异步
+    async def main():
+        async with AsyncProxyPoolClient("http://localhost:8000", prefetch=20, proxy_type="all") as client:
+            leases = await asyncio.gather(*(client.acquire() for _ in range(5)))
+            print(f"获取到: {[lease.proxy for lease in leases if lease]}")
+            for lease in leases:
+                if lease:
+                    await client.release(lease)
+
+    if aiohttp is not None:
+        asyncio.run(main())
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# 分数桶索引
+
+import random
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class ScoreBuckets:
+    """
+    分数桶索引
+    分数是 0..max_score 的有界整数, 每个分数一个桶, 桶内是按加入顺序排列的有序集合,
+    加入、移动、删除、取最高分都是 O(1)/均摊 O(1), 按分数从高到低遍历不需要排序
+    """
+
+    def __init__(self, max_score: int = 100):
+        self.max_score = max(int(max_score), 0)
+        # 每个桶: 成员 -> 在 _items 中的位置(dict 保持加入顺序), _items 支持 O(1) 随机取样
+        self._order: List[Dict[str, int]] = [{} for _ in range(self.max_score + 1)]
+        self._items: List[List[str]] = [[] for _ in range(self.max_score + 1)]
+        self._scores: Dict[str, int] = {}
+        self._top = -1  # 最高非空桶的上界
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, member: str) -> bool:
+        return member in self._scores
+
+    def _clamp(self, score: int) -> int:
+        return min(max(int(score), 0), self.max_score)
+
+    def add(self, member: str, score: int):
+        """加入成员, 已存在则移动到新分数的桶(放在桶尾)"""
+        score = self._clamp(score)
+        old = self._scores.get(member)
+        if old is not None:
+            if old == score:
+                return
+            self._discard(member, old)
+
+        items = self._items[score]
+        self._order[score][member] = len(items)
+        items.append(member)
+        self._scores[member] = score
+        if score > self._top:
+            self._top = score
+
+    move = add
+
+    def add_many(self, members: Iterable[Tuple[str, int]]):
+        """
+        批量加入 (member, score), 构建索引时用: 新成员直接追加到各桶, 每个桶的位置表最后一次性补上,
+        已存在的成员最后再逐个移动
+        """
+        scores = self._scores
+        buckets = self._items
+        max_score = self.max_score
+        starts = [len(items) for items in buckets]
+        moved = []
+        for member, score in members:
+            if member in scores:
+                moved.append((member, score))
+                continue
+            score = int(score)
+            if score < 0:
+                score = 0
+            elif score > max_score:
+                score = max_score
+            scores[member] = score
+            buckets[score].append(member)
+
+        for score, start in enumerate(starts):
+            items = buckets[score]
+            if len(items) > start:
+                self._order[score].update(zip(items[start:], range(start, len(items))))
+                if score > self._top:
+                    self._top = score
+
+        for member, score in moved:
+            self.add(member, score)
+
+    def remove(self, member: str) -> bool:
+        """移除成员"""
+        score = self._scores.pop(member, None)
+        if score is None:
+            return False
+        self._discard(member, score)
+        return True
+
+    def _discard(self, member: str, score: int):
+        order = self._order[score]
+        items = self._items[score]
+        pos = order.pop(member)
+        last = items.pop()
+        if last != member:
+            # 用最后一个元素填补空位, 改已有键的值不影响 dict 中的顺序
+            items[pos] = last
+            order[last] = pos
+
+    def clear(self):
+        for order in self._order:
+            order.clear()
+        for items in self._items:
+            items.clear()
+        self._scores.clear()
+        self._top = -1
+
+    def score_of(self, member: str) -> Optional[int]:
+        return self._scores.get(member)
+
+    def top_score(self) -> int:
+        """最高非空桶的分数, 为空时返回 -1"""
+        while self._top >= 0 and not self._items[self._top]:
+            self._top -= 1
+        return self._top
+
+    def top(self) -> Optional[Tuple[int, str]]:
+        """最高分桶中最早加入的成员"""
+        score = self.top_score()
+        if score < 0:
+            return None
+        return score, next(iter(self._order[score]))
+
+    def iter_desc(self, min_score: int = 0) -> Iterator[Tuple[int, str]]:
+        """按分数从高到低遍历 (score, member), 同分按加入顺序; 遍历期间不能修改"""
+        for score in range(self.top_score(), max(min_score, 0) - 1, -1):
+            for member in self._order[score]:
+                yield score, member
+
+    def iter_asc(self) -> Iterator[Tuple[int, str]]:
+        """按分数从低到高遍历 (score, member), 同分按加入顺序; 遍历期间不能修改"""
+        for score in range(0, self.top_score() + 1):
+            for member in self._order[score]:
+                yield score, member
+
+    def iter_oldest(self, min_score: int = 0) -> Iterator[Tuple[int, str]]:
+        """按加入顺序遍历 (score, member), 改分数不影响顺序, 移除后重新加入排到最后; 遍历期间不能修改"""
+        for member, score in self._scores.items():
+            if score >= min_score:
+                yield score, member
+
+    def random_member(self, score: int, rng: random.Random = random) -> Optional[str]:
+        """从某个分数桶中随机取一个成员"""
+        items = self._items[self._clamp(score)]
+        if not items:
+            return None
+        return items[rng.randrange(len(items))]
+
+    def random_weighted(self, min_score: int = 0, rng: random.Random = random,
+                        weight: Optional[Callable[[int], float]] = None) -> Optional[Tuple[int, str]]:
+        """
+        随机取一个分数不低于 min_score 的成员, 只遍历分数桶(O(max_score)), 不遍历成员
+        每个成员被选中的概率和 weight(score) 成正比, 不指定 weight 时均匀随机
+        """
+        low = max(int(min_score), 0)
+        candidates = []
+        total = 0.0
+        for score in range(self.top_score(), low - 1, -1):
+            size = len(self._items[score])
+            if size:
+                w = size * (weight(score) if weight else 1)
+                if w > 0:
+                    candidates.append((score, w))
+                    total += w
+        if not candidates:
+            return None
+
+        r = rng.random() * total
+        for score, w in candidates:
+            if r < w:
+                break
+            r -= w
+        # 浮点误差时落到最后一个桶
+        return score, self.random_member(score, rng)
@@ -4,7 +4,7 @@ import time
 import os
 
 from core.config import ConfigManager
-from data.settings import PROXY_POOL_USAGE_TEMPLATE
+from utils import pool_client
 from schedulers.api_server import api_main
 
 class UseAPI:
@@ -103,6 +103,7 @@ class UseAPI:
                 print(f"总代理数: {data.get('total', 0)}")
                 print(f"空闲代理: {data.get('idle', 0)}")
                 print(f"占用代理: {data.get('busy', 0)}")
+                print(f"隔离代理: {data.get('quarantine', 0)}")
                 print(f"死亡代理: {data.get('dead', 0)}")
                 print(f"最后更新: {data.get('last_updated', '未知')}")
             else:
@@ -126,7 +127,9 @@ class UseAPI:
     # 生成api爬虫调用模板代码(.py)
     def api_usage_template(self):
         """生成API爬虫调用模板代码"""
-        template = PROXY_POOL_USAGE_TEMPLATE
+        # 导出的就是 utils/pool_client.py(同步/异步客户端, 带预取、批量心跳和批量归还)
+        with open(pool_client.__file__, "r", encoding="utf-8") as f:
+            template = f.read()
 
         # 获取保存路径
         print("[info] 请输入要保存的文件路径（例如：./api_client.py 或 ./clients/proxy_api.py）：")